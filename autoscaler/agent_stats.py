@@ -1,48 +1,144 @@
 import logging
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from autoscaler import tracing
 
 class AgentStats:
-    def __init__(self, api_client):
+    """Collector of Mesos agent statistics. A single instance is shared by
+    all Autoscalers so that each agent is fetched at most once per cycle
+    no matter how many apps have tasks on it. Every snapshot is indexed
+    by executor_id.
+    """
+
+    def __init__(self, api_client, max_age=None, workers=8):
+        """
+        :param api_client:
+        :param max_age: 快照的有效期(秒)，为None时直到reset()前一直有效
+        :param workers: 并行拉取agent统计信息的线程数
+        """
         self.api_client = api_client
+        self.max_age = max_age
+        self.workers = workers
+        # agent -> (fetched_at, {executor_id: statistics})
         self.stats = {}
+        self.lock = threading.Lock()
+        # agent -> 拉取该agent的锁，随快照一起淘汰
+        self.agent_locks = {}
+        self.evicted_at = time.monotonic()
+        self.executor = None
         self.log = logging.getLogger('autoscale')
 
     def reset(self):
         """ Drop all cached statistics.
         """
-        self.stats = {}
+        with self.lock:
+            self.stats = {}
+            self._evict(time.monotonic())
+
+    def _evict(self, now):
+        """ Drop the expired snapshots and the locks of the agents without
+        a snapshot, so that agents gone from the cluster are forgotten.
+        Called holding self.lock.
+        """
+        self.evicted_at = now
+        if self.max_age is not None:
+            for agent, entry in list(self.stats.items()):
+                if now - entry[0] >= self.max_age:
+                    del self.stats[agent]
+        for agent, lock in list(self.agent_locks.items()):
+            # 拉取中的agent保留其锁
+            if agent not in self.stats and not lock.locked():
+                del self.agent_locks[agent]
+
+    def _agent_lock(self, agent):
+        with self.lock:
+            return self.agent_locks.setdefault(agent, threading.Lock())
+
+    def _snapshot(self, agent):
+        entry = self.stats.get(agent)
+        if entry is None:
+            return None
+        if self.max_age is not None and time.monotonic() - entry[0] >= self.max_age:
+            return None
+        return entry[1]
+
+    def _fetch(self, agent):
+        snapshot = self.api_client.dcos_rest(
+            "get",
+            '/slave/' + agent + '/monitor/statistics',
+            use_cache=False
+        )
+        return self.index(snapshot)
 
-    def get_task_stats(self, agent, task, n=0):
+    @staticmethod
+    def index(snapshot):
+        return {i['executor_id']: i['statistics'] for i in snapshot}
+
+    def store(self, agent, snapshot):
+        """ Store a /monitor/statistics response fetched elsewhere.
+        """
+        with self.lock:
+            self.stats[agent] = (time.monotonic(), self.index(snapshot))
+
+    def get_snapshot(self, agent):
+        """ Returns the statistics snapshot of the agent indexed by
+        executor_id. If it is cached it is returned, otherwise a request
+        to the agent is made; concurrent callers share the request.
+        """
+        snapshot = self._snapshot(agent)
+        if snapshot is not None:
+            return snapshot
+
+        with self._agent_lock(agent):
+            snapshot = self._snapshot(agent)
+            if snapshot is not None:
+                return snapshot
+            snapshot = self._fetch(agent)
+            now = time.monotonic()
+            with self.lock:
+                self.stats[agent] = (now, snapshot)
+                # 每个有效期淘汰一次
+                if self.max_age is not None and now - self.evicted_at >= self.max_age:
+                    self._evict(now)
+            return snapshot
+
+    def prefetch(self, agents):
+        """ Fetch the snapshots of the given agents in parallel.
+        Agents which already have a valid snapshot are skipped.
+        """
+        missing = [agent for agent in set(agents) if self._snapshot(agent) is None]
+        if len(missing) < 2:
+            return
+        with tracing.stage('prefetch_agent_stats'):
+            self._prefetch(missing)
+
+    def _prefetch(self, missing):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                       thread_name_prefix='agent-stats')
+        futures = [self.executor.submit(self.get_snapshot, agent) for agent in missing]
+        wait(futures)
+        for future in futures:
+            if future.exception() is not None:
+                self.log.error("failed to prefetch agent statistics: %s", future.exception())
+
+    def get_task_stats(self, agent, task):
         """ Get the performance metrics of the given task running on
-        the specified agent. If the n'th snapshot is cached, it is
-        returned, otherwise a request to the agent is made.
+        the specified agent. If the agent snapshot is cached, it is
+        used, otherwise a request to the agent is made.
         Args:
             task: marathon app task
             agent: agent on which the task is run
-            n: statistics snapshot index
         Returns:
             statistics snapshot for the specific task running on the agent
         """
-
-        agent_stats = self.stats.get(agent, [])
-        assert len(agent_stats) >= n, \
-            'n must be one of indexes of snapshots fetched previosly or be ' + \
-            'greater by one to fetch a new snapshot'
-
-        if len(agent_stats) > n:
-            snapshot = agent_stats[n]
-        else:
-            snapshot = self.api_client.dcos_rest(
-                "get",
-                '/slave/' + agent + '/monitor/statistics'
-            )
-            agent_stats.append(snapshot)
-            self.stats[agent] = agent_stats
-
-        for i in snapshot:
-            executor_id = i['executor_id']
-            if executor_id == task:
-                task_stats = i['statistics']
-                self.log.debug("stats for task %s agent %s: %s",
-                               executor_id, agent, task_stats)
-                return task_stats
+        with tracing.stage('get_task_stats'):
+            task_stats = self.get_snapshot(agent).get(task)
+        if task_stats is not None:
+            self.log.debug("stats for task %s agent %s: %s",
+                           task, agent, task_stats)
+        return task_stats
@@ -0,0 +1,202 @@
+# encoding: utf-8
+
+"""
+@file: alarm.py
+"""
+import copy
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+from autoscaler import http_transport
+
+
+class AlarmSuppressor:
+    '''
+    告警抑制。同一(租户+app, 原因)在window秒内只发送第一条告警，其余计数后丢弃；
+    窗口结束后以最后一条告警附带抑制次数的汇总发出。状态按LRU保存，最多max_keys个。
+    '''
+
+    SUMMARY = '（过去{}秒内重复告警{}次已抑制）'
+
+    def __init__(self, window=600, max_keys=10000):
+        self.window = window
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        # key -> [窗口开始时间, 抑制次数, 最后一条被抑制的告警]
+        self.states = OrderedDict()
+        self.suppressed = 0
+
+    def summarize(self, msg, count):
+        msg = copy.deepcopy(msg)
+        msg['body']['detail'] = msg['body'].get('detail', '') + self.SUMMARY.format(self.window, count)
+        return msg
+
+    def check(self, key, msg, now=None):
+        """Returns the message to send (with a summary of repeats suppressed
+        in the previous window), or None if it is suppressed.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            state = self.states.get(key)
+            if state is not None and now - state[0] < self.window:
+                state[1] += 1
+                state[2] = msg
+                self.suppressed += 1
+                return None
+            self.states[key] = [now, 0, None]
+            self.states.move_to_end(key)
+            while len(self.states) > self.max_keys:
+                self.states.popitem(last=False)
+        if state is not None and state[1]:
+            return self.summarize(msg, state[1])
+        return msg
+
+    def expired(self, now=None):
+        """Summaries of the windows which ended with suppressed repeats.
+        Ended windows are dropped, so the next alarm of their key is sent
+        at once.
+        """
+        now = time.monotonic() if now is None else now
+        summaries = []
+        with self.lock:
+            for key in [key for key, state in self.states.items() if now - state[0] >= self.window]:
+                state = self.states.pop(key)
+                if state[1]:
+                    summaries.append(self.summarize(state[2], state[1]))
+        return summaries
+
+
+class AlarmDispatcher:
+    '''
+    告警异步发送器。告警消息进入有界队列后立即返回，由后台线程批量取出发送，
+    失败时按指数退避重试，队列满时丢弃并计数，扩缩线程不会因告警接口阻塞。
+    消息结构为：
+    {
+        'request_params':{
+        },
+        'body':{
+        }
+    }
+    '''
+
+    def __init__(self, host, url, method='POST', queue_size=1000, batch_size=50,
+                 retries=3, backoff=1.0, transport=None, suppressor=None):
+        """
+        :param host: 告警接口host
+        :param url: 告警接口uri
+        :param queue_size: 队列容量，超出后丢弃新告警
+        :param batch_size: 每次唤醒最多发送的告警数
+        :param retries: 发送失败的重试次数
+        :param backoff: 首次重试前等待的秒数，之后每次翻倍
+        :param suppressor: AlarmSuppressor，为None时不抑制
+        """
+        self.host = host
+        self.url = url
+        self.method = method
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+        self.transport = transport
+        self.suppressor = suppressor
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.log = logging.getLogger('autoscale')
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._active = False
+
+    def submit(self, msg, key=None):
+        """Queue an alarm without blocking. Returns False if it was
+        suppressed as a repeat of key or dropped because the queue is full.
+        """
+        if self.suppressor is not None and key is not None:
+            msg = self.suppressor.check(key, msg)
+            if msg is None:
+                return False
+        return self._put(msg)
+
+    def _put(self, msg):
+        try:
+            self.queue.put_nowait(msg)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            self.log.error('alarm queue full, dropped alarm of %s (%s dropped so far)',
+                           msg['body'].get('source'), self.dropped)
+            return False
+
+    def stats(self):
+        return {'sent': self.sent, 'failed': self.failed, 'dropped': self.dropped,
+                'suppressed': self.suppressor.suppressed if self.suppressor is not None else 0,
+                'queued': self.queue.qsize()}
+
+    def start(self):
+        self._active = True
+        self._thread = threading.Thread(target=self._loop, name='alarm-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._active = False
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        next_sweep = 0
+        while self._active or not self.queue.empty():
+            if self.suppressor is not None and time.monotonic() >= next_sweep:
+                for msg in self.suppressor.expired():
+                    self._put(msg)
+                next_sweep = time.monotonic() + 10
+            try:
+                batch = [self.queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        pending = batch
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            failed = []
+            for msg in pending:
+                try:
+                    self.send(msg)
+                    self.sent += 1
+                except Exception as e:
+                    self.log.warning('failed to send alarm of %s: %s', msg['body'].get('source'), e)
+                    failed.append(msg)
+            pending = failed
+            if not pending:
+                return
+        self.failed += len(pending)
+        self.log.error('gave up sending %s alarms after %s retries', len(pending), self.retries)
+
+    def send(self, msg):
+        #拼装url
+        url = self.url
+        if (url.find('?') >= 0):
+            sep = '&'
+        else:
+            sep = '?'
+        request_params = urllib.parse.urlencode(msg['request_params'])
+        url = 'http://' + self.host + url + "%c%s" % (sep, request_params)
+
+        transport = self.transport or http_transport.get_transport()
+        if self.method == "GET":
+            response = transport.get(url, upstream='alarm')
+        else:
+            response = transport.post(url, upstream='alarm', json=msg['body'])
+        response.raise_for_status()
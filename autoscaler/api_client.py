@@ -2,25 +2,207 @@ import os
 import requests
 import json
 import jwt
-import sys
 import logging
 import time
 import threading
-from functools import lru_cache
+import re
+from autoscaler import http_transport
+from collections import OrderedDict, namedtuple
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'shared', 'evictions',
+                                     'expirations', 'entries', 'bytes'])
+
+
+class AuthenticationError(Exception):
+    """DC/OS rejected the credentials of the autoscaler"""
+
+
+class _InFlight:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResponseCache:
+    """Thread safe cache of GET responses.
+
+    Entries expire after a TTL chosen per path (the first matching regex of
+    ttl_rules, otherwise default_ttl) and the least recently used entries
+    are evicted once max_entries or max_bytes is exceeded. Concurrent loads
+    of the same key are collapsed into a single in-flight request.
+    """
+
+    def __init__(self, default_ttl=10, ttl_rules=None, max_entries=10000,
+                 max_bytes=64 * 1024 * 1024):
+        """
+        :param default_ttl: 默认过期时间(秒)
+        :param ttl_rules: {path正则: 过期时间(秒)}，按顺序匹配
+        :param max_entries: 最大缓存条数
+        :param max_bytes: 最大缓存字节数(按响应体大小计算)
+        """
+        self.default_ttl = default_ttl
+        self.ttl_rules = [(re.compile(pattern), ttl) for pattern, ttl in (ttl_rules or {}).items()]
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key -> (expires_at, size, value)
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def ttl_for(self, path):
+        for pattern, ttl in self.ttl_rules:
+            if pattern.search(path):
+                return ttl
+        return self.default_ttl
+
+    def get_or_load(self, key, path, loader):
+        """Return the cached value for key, calling loader() on a miss.
+        loader must return a tuple of (value, size in bytes).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._remove(key)
+                self.expirations += 1
+            flight = self.inflight.get(key)
+            if flight is not None:
+                self.shared += 1
+                owner = False
+            else:
+                flight = self.inflight[key] = _InFlight()
+                self.misses += 1
+                owner = True
+
+        if not owner:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            value, size = loader()
+            flight.result = value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+                if flight.error is None:
+                    self._store(key, path, value, size)
+            flight.event.set()
+        return value
+
+    def put(self, key, path, value, size=0):
+        """Store a value loaded elsewhere, e.g. by a prefetching collector"""
+        with self.lock:
+            self._store(key, path, value, size)
+
+    def _store(self, key, path, value, size):
+        ttl = self.ttl_for(path)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + ttl, size, value)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def info(self):
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.shared, self.evictions,
+                             self.expirations, len(self.entries), self.bytes)
 
 
 class APIClient:
 
     DCOS_CA = 'dcos-ca.crt'
 
-    def __init__(self, dcos_master):
+    def __init__(self, dcos_master, cache=None, transport=None):
         self.dcos_master = dcos_master
+        self.log = logging.getLogger('autoscale')
+        #共享的连接池
+        self.transport = transport if transport is not None else http_transport.get_transport()
+        #GET请求的响应缓存
+        self.cache = cache if cache is not None else ResponseCache()
         self.dcos_headers = {
             'User-Agent': 'marathon-autoscale',
             'Content-type': 'application/json'
         }
-        self.authenticate()
-        self.log = logging.getLogger('autoscale')
+        #认证在后台线程中进行，启动时不必等待；请求前等待认证完成
+        self.authenticated = threading.Event()
+        #凭据被拒绝，进程应退出(由主循环检查)
+        self.fatal = threading.Event()
+        self.auth_error = None
+        self.auth_lock = threading.Lock()
+        threading.Thread(target=self._authenticate_initially, name='dcos-auth', daemon=True).start()
+
+    def _authenticate_initially(self, backoff=1.0, max_backoff=60.0):
+        """Authenticate once, retrying network errors with exponential
+        backoff. Rejected credentials are fatal.
+        """
+        while True:
+            try:
+                self.authenticate()
+                break
+            except requests.exceptions.RequestException as e:
+                self.log.warning("Initial authentication to DC/OS failed, retrying in %ss: %s", backoff, e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, max_backoff)
+            except Exception as e:
+                self.auth_error = e
+                self.log.error("Initial authentication to DC/OS failed: %s", e)
+                self.fatal.set()
+                break
+        self.authenticated.set()
+
+    def ensure_authenticated(self, timeout=30):
+        """Wait for the initial authentication. Raises AuthenticationError
+        if it failed or is still being retried after timeout seconds.
+        """
+        if not self.authenticated.wait(timeout):
+            raise AuthenticationError("authentication to DC/OS still pending")
+        if self.fatal.is_set():
+            raise AuthenticationError(self.auth_error)
+
+    def renew(self, authorization):
+        """Renew the token after a 401 of a request sent with the
+        authorization header; requests rejected together renew it once.
+        Rejected credentials are fatal.
+        """
+        with self.auth_lock:
+            if self.dcos_headers.get('Authorization') != authorization:
+                return
+            try:
+                self.authenticate()
+            except AuthenticationError as e:
+                self.auth_error = e
+                self.fatal.set()
+                raise
 
     def authenticate(self):
         """Using a userid/pass or a service account secret,
@@ -32,8 +214,9 @@ class APIClient:
         # Get the cert authority
         if not os.path.isfile(self.DCOS_CA):
 
-            response = requests.get(
+            response = self.transport.get(
                 self.dcos_master + '/ca/dcos-ca.crt',
+                upstream='dcos',
                 headers=self.dcos_headers,
                 verify=False
             )
@@ -72,97 +255,79 @@ class APIClient:
             return
 
         # Create or renew auth token for the service account
-        response = requests.post(
+        response = self.transport.post(
             self.dcos_master + "/acs/api/v1/auth/login",
+            upstream='dcos',
             headers=self.dcos_headers,
             data=auth_data,
             verify=self.DCOS_CA
         )
 
+        if response.status_code >= 500:
+            response.raise_for_status()
         result = response.json()
 
         if 'token' not in result:
             self.log.error("Unable to authenticate or renew JWT token: %s", result)
-            sys.exit(1)
+            raise AuthenticationError("Unable to authenticate or renew JWT token: %s" % result)
 
         self.dcos_headers.update({
             'Authorization': 'token=' + result['token']
         })
 
-    def dcos_rest(self, method, path, data=None, auth=True):
+    def dcos_rest(self, method, path, data=None, auth=True, use_cache=True):
         """Common querying procedure that handles 401 errors
         Args:
             method (str): HTTP method (get or put)
             path (str): URI path after the mesos master address
+            use_cache (bool): serve GET requests from the response cache
         Returns:
             JSON requests.response.content result of the query
         """
 
         #如果是method是“GET"，则通过带缓存的dcos_rest_get方法访问
-        if method.lower().__eq__('get'):
+        if use_cache and method.lower().__eq__('get'):
             return self.dcos_rest_get(method, path, data=data, auth=auth)
 
-        try:
-            if data is None:
-                response = requests.request(
-                    method,
-                    self.dcos_master + path,
-                    headers=self.dcos_headers,
-                    verify=False
-                )
-            else:
-                response = requests.request(
-                    method,
-                    self.dcos_master + path,
-                    headers=self.dcos_headers,
-                    data=data,
-                    verify=False
-                )
-
-            self.log.debug("%s %s %s", method, path, response.status_code)
-
-            if response.status_code != 200:
-                if response.status_code == 401 and auth:
-                    self.log.info("Token expired. Re-authenticating to DC/OS")
-                    self.authenticate()
-                    return self.dcos_rest(method, path, data=data, auth=False)
-                else:
-                    response.raise_for_status()
+        return self._request(method, path, data=data, auth=auth)[0]
 
-            content = response.content.strip()
-            if not content:
-                content = "{}"
-
-            result = json.loads(content)
-            return result
-
-        except requests.exceptions.HTTPError as e:
-            self.log.error("HTTP Error: %s", e)
-            raise
-        except Exception as e:
-            self.log.error("Error: %s", e)
-            raise
-    @lru_cache(maxsize=None)
     def dcos_rest_get(self, method, path, data=None, auth=True):
-        """Common querying procedure that handles 401 errors
+        """Same as dcos_rest, but served from the response cache. Concurrent
+        callers asking for the same path share a single request.
         Args:
-            method (str): HTTP method (get or put)
+            method (str): HTTP method (get)
             path (str): URI path after the mesos master address
         Returns:
             JSON requests.response.content result of the query
         """
+        return self.cache.get_or_load(
+            (method.lower(), path, data),
+            path,
+            lambda: self._request(method, path, data=data, auth=auth)
+        )
+
+    def _request(self, method, path, data=None, auth=True):
+        """Issue the request
+        Returns:
+            tuple of the JSON result and the size in bytes of the response body
+        """
+        upstream = 'mesos_agent' if path.startswith('/slave/') else 'dcos'
+        self.ensure_authenticated()
+        authorization = self.dcos_headers.get('Authorization')
         try:
             if data is None:
-                response = requests.request(
+                response = self.transport.request(
                     method,
                     self.dcos_master + path,
+                    upstream=upstream,
                     headers=self.dcos_headers,
                     verify=False
                 )
             else:
-                response = requests.request(
+                response = self.transport.request(
                     method,
                     self.dcos_master + path,
+                    upstream=upstream,
                     headers=self.dcos_headers,
                     data=data,
                     verify=False
@@ -173,8 +338,8 @@ class APIClient:
             if response.status_code != 200:
                 if response.status_code == 401 and auth:
                     self.log.info("Token expired. Re-authenticating to DC/OS")
-                    self.authenticate()
-                    return self.dcos_rest(method, path, data=data, auth=False)
+                    self.renew(authorization)
+                    return self._request(method, path, data=data, auth=False)
                 else:
                     response.raise_for_status()
 
@@ -183,7 +348,7 @@ class APIClient:
                 content = "{}"
 
             result = json.loads(content)
-            return result
+            return result, len(content)
 
         except requests.exceptions.HTTPError as e:
             self.log.error("HTTP Error: %s", e)
@@ -2,35 +2,150 @@ import requests
 import sys
 import logging
 import threading
+import time
+
+from autoscaler import tracing
+
+
+class AppsSnapshot:
+    """Snapshot of all apps of one tenant's Marathon, fetched with a single
+    GET /v2/apps?embed=apps.tasks at most once per max_age seconds and
+    indexed by app id, together with the tenant's GET /v2/deployments
+    indexed by affected app. Every MarathonApp of the tenant reads from it.
+    """
+
+    MARATHON_APPS_URI = '/service/marathon/v2/apps'
+    MARATHON_DEPLOYMENTS_URI = '/service/marathon/v2/deployments'
+
+    def __init__(self, api_client, dcos_tenant, max_age):
+        self.api_client = api_client
+        self.dcos_tenant = dcos_tenant
+        self.max_age = max_age
+        self.marathon_apps_uri = AppsSnapshot.MARATHON_APPS_URI.replace('marathon', dcos_tenant)
+        self.deployments_uri = AppsSnapshot.MARATHON_DEPLOYMENTS_URI.replace('marathon', dcos_tenant)
+        self.apps = {}
+        # app id -> 进行中的部署id
+        self.deployments = {}
+        self.fetched_at = None
+        self.lock = threading.Lock()
+        self.log = logging.getLogger('autoscale')
+
+    def expired(self):
+        return self.fetched_at is None or time.monotonic() - self.fetched_at >= self.max_age
+
+    def uri(self):
+        return self.marathon_apps_uri + '?embed=apps.tasks'
+
+    def refresh(self):
+        """Fetch all apps and deployments of the tenant and rebuild the index"""
+        response = self.api_client.dcos_rest(
+            "get",
+            self.uri(),
+            use_cache=False
+        )
+        deployments = self.api_client.dcos_rest(
+            "get",
+            self.deployments_uri,
+            use_cache=False
+        )
+        self.load(response, deployments)
+
+    def load(self, response, deployments=None):
+        """Rebuild the index from a GET /v2/apps response and a GET
+        /v2/deployments response. Without the latter the deployments
+        embedded in the app documents are used.
+        """
+        self.apps = {app['id']: app for app in response.get('apps', [])}
+        if deployments is None:
+            self.deployments = {app_id: [d.get('id') for d in app['deployments']]
+                                for app_id, app in self.apps.items() if app.get('deployments')}
+        else:
+            self.deployments = {}
+            for deployment in deployments:
+                for app_id in deployment.get('affectedApps', []):
+                    self.deployments.setdefault(app_id, []).append(deployment.get('id'))
+        self.fetched_at = time.monotonic()
+        self.log.debug("Marathon snapshot of tenant %s refreshed, %s apps, %s apps being deployed",
+                       self.dcos_tenant, len(self.apps), len(self.deployments))
+
+    def ensure_fresh(self):
+        if self.expired():
+            #只允许一个线程刷新，其余线程等待刷新结果
+            with self.lock:
+                if self.expired():
+                    self.refresh()
+
+    def get(self, app_id):
+        """Returns the app document for app_id, or None if it does not exist"""
+        self.ensure_fresh()
+        return self.apps.get(app_id)
+
+    def deployments_of(self, app_id):
+        """Returns the ids of the deployments in progress affecting app_id"""
+        self.ensure_fresh()
+        return self.deployments.get(app_id, [])
+
+
+class AppsSnapshotService:
+    """Holds one AppsSnapshot per tenant"""
+
+    def __init__(self, api_client, max_age):
+        self.api_client = api_client
+        self.max_age = max_age
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def for_tenant(self, dcos_tenant):
+        snapshot = self.snapshots.get(dcos_tenant)
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.snapshots.setdefault(
+                    dcos_tenant, AppsSnapshot(self.api_client, dcos_tenant, self.max_age))
+        return snapshot
+
 
 class MarathonApp:
 
     MARATHON_APPS_URI = '/service/marathon/v2/apps'
 
-    def __init__(self, app_id, api_client, dcos_tenant):
+    def __init__(self, app_id, api_client, dcos_tenant, snapshot=None):
         '''
         支持多租户
         :param app_id:
         :param api_client:
         :param dcos_tenant: 租户
+        :param snapshot: 租户的AppsSnapshot，为None时按app单独查询
         '''
         self.app_id = app_id
         self.api_client = api_client
+        self.snapshot = snapshot
         self.log = logging.getLogger('autoscale')
         self.marathon_apps_uri = MarathonApp.MARATHON_APPS_URI.replace('marathon', dcos_tenant)
         #app_name不同于app_id
         self.app_name = None
+
+    def get_app(self):
+        """Returns the Marathon app document, either from the tenant
+        snapshot or from GET /v2/apps/<id>
+        """
+        if self.snapshot is not None:
+            return self.snapshot.get(self.app_id)
+        response = self.api_client.dcos_rest(
+            "get",
+            self.marathon_apps_uri + self.app_id
+        )
+        return response['app']
+
     def app_exists(self):
         """Determines if the application exists in Marathon
         """
         try:
-            response = self.api_client.dcos_rest(
-                "get",
-                self.marathon_apps_uri + self.app_id
-            )
-            if(None != response['app'].get('env') and None != response['app'].get('env').get('APP_NAME')):
-                self.app_name = response['app'].get('env').get('APP_NAME')
-            return self.app_id == response['app']['id']
+            app = self.get_app()
+            if app is None:
+                return False
+            if(None != app.get('env') and None != app.get('env').get('APP_NAME')):
+                self.app_name = app.get('env').get('APP_NAME')
+            return self.app_id == app['id']
         except requests.exceptions.HTTPError as e:
             if e.response is not None:
                 if e.response.status_code != 404:
@@ -42,21 +157,26 @@ class MarathonApp:
         """Returns the number of running tasks for a given Marathon app"""
         app_instances = 0
 
-        response = self.api_client.dcos_rest(
-            "get",
-            self.marathon_apps_uri + self.app_id
-        )
+        app = self.get_app()
 
         try:
-            app_instances = response['app']['instances']
+            app_instances = app['instances']
             self.log.debug("Marathon app %s has %s deployed instances",
                            self.app_id, app_instances)
-        except KeyError:
+        except (KeyError, TypeError):
             self.log.error('No task data in marathon for app %s', self.app_id)
 
-
         return app_instances
 
+    def get_deployments(self):
+        """Returns the ids of the Marathon deployments in progress for the app"""
+        if self.snapshot is not None:
+            return self.snapshot.deployments_of(self.app_id)
+        app = self.get_app()
+        if app is None:
+            return []
+        return [d.get('id') for d in app.get('deployments') or []]
+
     def get_app_details(self):
         """Retrieve metadata about marathon_app
         Returns:
@@ -64,20 +184,18 @@ class MarathonApp:
         """
         app_task_dict = {}
 
-        response = self.api_client.dcos_rest(
-            "get",
-            self.marathon_apps_uri + self.app_id
-        )
+        with tracing.stage('get_app_details'):
+            app = self.get_app()
 
         try:
-            for i in response['app']['tasks']:
+            for i in app['tasks']:
                 taskid = i['id']
                 hostid = i['host']
                 slave_id = i['slaveId']
                 self.log.debug("Task %s is running on host %s with slaveId %s",
                                taskid, hostid, slave_id)
                 app_task_dict[str(taskid)] = str(slave_id)
-        except KeyError:
+        except (KeyError, TypeError):
             self.log.error('No task data in marathon for app %s', self.app_id)
 
         return app_task_dict
@@ -0,0 +1,248 @@
+# encoding: utf-8
+
+"""
+@file: async_engine.py
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from autoscaler import metrics
+from autoscaler import sqs
+from autoscaler.modes.registry import AGENT_STATS, PROMETHEUS, SQS
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncEngine:
+    """asyncio based alternative to Scheduler. Once per interval it fetches,
+    concurrently and with a bounded number of requests per upstream host,
+    the Marathon app and deployment lists of every tenant, and then exactly
+    the data the mode of each app declares it requires: the statistics of
+    the agents running its tasks, its Prometheus queries and its SQS queue
+    lengths. The results are stored into the shared AppsSnapshotService,
+    AgentStats and PrometheusClient, after which every Autoscaler is
+    evaluated by the usual threaded decision logic without further I/O,
+    and the scale requests queued in the ScaleBatcher are sent.
+
+    It exposes the same add/remove/get/keys interface as Scheduler. An app
+    is collected and evaluated in the first cycle at which its interval
+    has elapsed, so per-app intervals are rounded up to a whole number of
+    cycles.
+    """
+
+    def __init__(self, api_client, snapshots, agent_stats, prometheus, interval,
+                 workers=16, per_host_limit=16, timeout=10, batcher=None):
+        """
+        :param per_host_limit: 每个上游host的最大并发请求数
+        :param timeout: 单个请求超时(秒)
+        :param batcher: ScaleBatcher，每周期评估结束后下发合并的扩缩请求
+        """
+        if aiohttp is None:
+            raise ImportError("the asyncio engine requires the aiohttp package")
+        self.api_client = api_client
+        self.snapshots = snapshots
+        self.agent_stats = agent_stats
+        self.prometheus = prometheus
+        self.interval = interval
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.batcher = batcher
+        self.log = logging.getLogger('autoscale')
+
+        self._autoscalers = {}
+        # key -> (interval, 下次评估的monotonic时间)
+        self._schedule = {}
+        self._semaphores = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='autoscale-worker')
+        self._thread = None
+        self._active = False
+        self.workers = workers
+        #正在执行评估的工作线程数，由工作线程并发更新
+        self.busy = 0
+        self._busy_lock = threading.Lock()
+
+    def add(self, key, autoscaler, interval=None, delay=None):
+        self._schedule[key] = (interval, time.monotonic() + (delay or 0.0))
+        self._autoscalers[key] = autoscaler
+
+    def remove(self, key):
+        self._schedule.pop(key, None)
+        autoscaler = self._autoscalers.pop(key, None)
+        if autoscaler is not None:
+            autoscaler.terminal()
+        return autoscaler
+
+    def set_interval(self, key, interval):
+        """Change the interval of a registered Autoscaler, effective from
+        its next evaluation
+        """
+        if key in self._schedule:
+            self._schedule[key] = (interval, self._schedule[key][1])
+
+    def get(self, key):
+        return self._autoscalers.get(key)
+
+    def keys(self):
+        return list(self._autoscalers.keys())
+
+    def __len__(self):
+        return len(self._autoscalers)
+
+    def start(self):
+        self._active = True
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run_forever()),
+                                        name='autoscale-async-engine', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._active = False
+        if wait and self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+
+    async def _run_forever(self):
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while self._active:
+                started = time.monotonic()
+                try:
+                    await self.cycle(session, self.due(started))
+                except Exception as e:
+                    self.log.exception(e)
+                elapsed = time.monotonic() - started
+                self.log.debug("async cycle of %s apps took %.3fs", len(self._autoscalers), elapsed)
+                await asyncio.sleep(max(0.0, self.interval - elapsed))
+
+    def due(self, now):
+        """The autoscalers whose interval has elapsed at now, scheduled
+        for their next evaluation
+        """
+        autoscalers = []
+        for key, autoscaler in list(self._autoscalers.items()):
+            interval, due = self._schedule.get(key, (None, now))
+            # asyncio的定时可能提前一个时钟精度唤醒
+            if due <= now + self.interval * 0.01:
+                self._schedule[key] = (interval, now + (interval or self.interval))
+                autoscalers.append(autoscaler)
+        return autoscalers
+
+    async def cycle(self, session, autoscalers=None):
+        """Collect and evaluate autoscalers, all of them by default"""
+        if autoscalers is None:
+            autoscalers = list(self._autoscalers.values())
+        if not autoscalers:
+            return
+        await self.collect(session, autoscalers)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *[loop.run_in_executor(self._executor, self._evaluate, a) for a in autoscalers],
+            return_exceptions=True)
+        for autoscaler, result in zip(autoscalers, results):
+            if isinstance(result, Exception):
+                autoscaler.log.error("evaluation failed: %s", result)
+        if self.batcher is not None:
+            await loop.run_in_executor(self._executor, self.batcher.flush)
+
+    def _evaluate(self, autoscaler):
+        with self._busy_lock:
+            self.busy += 1
+        try:
+            autoscaler.evaluate()
+        finally:
+            with self._busy_lock:
+                self.busy -= 1
+
+    async def collect(self, session, autoscalers):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.api_client.ensure_authenticated)
+        # 1. Marathon apps and deployments of every tenant
+        tenants = {a.dcos_tenant for a in autoscalers}
+        await asyncio.gather(*[self._collect_tenant(session, t) for t in tenants])
+
+        # 2. the agents, Prometheus queries and SQS queues the modes require
+        agents = set()
+        queries = set()
+        queues = set()
+        for autoscaler in autoscalers:
+            snapshot = autoscaler.marathon_app.snapshot
+            if snapshot is None or snapshot.expired():
+                # 避免在事件循环中同步拉取
+                continue
+            try:
+                if not autoscaler.marathon_app.app_exists():
+                    continue
+                requirements = autoscaler.scaling_mode.requirements()
+                if AGENT_STATS in requirements:
+                    agents.update(autoscaler.marathon_app.get_app_details().values())
+                if PROMETHEUS in requirements:
+                    queries.update(autoscaler.scaling_mode.prometheus_queries())
+                if SQS in requirements:
+                    queues.update(autoscaler.scaling_mode.sqs_queues())
+            except Exception as e:
+                autoscaler.log.error("failed to resolve collection targets: %s", e)
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *[self._collect_agent(session, agent) for agent in agents],
+            *[self._collect_query(session, query) for query in queries],
+            *([loop.run_in_executor(self._executor, sqs.SQS.prefetch, queues)] if queues else []))
+
+    async def _collect_tenant(self, session, tenant):
+        snapshot = self.snapshots.for_tenant(tenant)
+        try:
+            apps, deployments = await asyncio.gather(self._get_dcos(session, snapshot.uri(), 'dcos'),
+                                                     self._get_dcos(session, snapshot.deployments_uri, 'dcos'))
+            snapshot.load(apps, deployments)
+        except Exception as e:
+            self.log.error("failed to fetch apps of tenant %s: %s", tenant, e)
+
+    async def _collect_agent(self, session, agent):
+        try:
+            self.agent_stats.store(agent, await self._get_dcos(
+                session, '/slave/' + agent + '/monitor/statistics', 'mesos_agent'))
+        except Exception as e:
+            self.log.error("failed to fetch statistics of agent %s: %s", agent, e)
+
+    async def _collect_query(self, session, query):
+        try:
+            response = await self._get_json(session, self.prometheus.query_url(query), 'prometheus')
+            self.prometheus.store(query, response['data']['result'])
+        except Exception as e:
+            self.log.error("failed to run prometheus query %s: %s", query, e)
+
+    async def _get_dcos(self, session, path, upstream, auth=True):
+        authorization = self.api_client.dcos_headers.get('Authorization')
+        try:
+            return await self._get_json(session, self.api_client.dcos_master + path, upstream,
+                                        headers=self.api_client.dcos_headers)
+        except aiohttp.ClientResponseError as e:
+            if e.status == 401 and auth:
+                self.log.info("Token expired. Re-authenticating to DC/OS")
+                await asyncio.get_running_loop().run_in_executor(self._executor, self.api_client.renew, authorization)
+                return await self._get_dcos(session, path, upstream, auth=False)
+            raise
+
+    def _semaphore(self, url):
+        host = urlsplit(url).netloc
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return semaphore
+
+    async def _get_json(self, session, url, upstream, headers=None):
+        async with self._semaphore(url):
+            started = time.monotonic()
+            status = 'error'
+            try:
+                async with session.get(url, headers=headers, ssl=False) as response:
+                    status = response.status
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+            finally:
+                metrics.UPSTREAM_SECONDS.observe(upstream, status, value=time.monotonic() - started)
@@ -12,10 +12,16 @@ import time
 import copy
 import math
 import datetime
+import threading
 from autoscaler.agent_stats import AgentStats
 from autoscaler.app import MarathonApp
-from autoscaler.modes.scalebyjvm import ScaleByJvm
-from autoscaler.modes.scalemem import ScaleByMemory
+from autoscaler.prometheus import PrometheusClient
+from autoscaler.scale_down import ScaleDownGuard
+from autoscaler.modes.abstractmode import NoSample
+from autoscaler.modes.registry import ModeRegistry
+from autoscaler import metrics
+from autoscaler import tracing
+from autoscaler import recording
 ALARM_API_BODY = {
         'request_params':{
             'key':'starship'
@@ -36,11 +42,30 @@ ALARM_API_BODY = {
     }
 #如果有全局key，则使用
 ALARM_API_BODY_GLOBALKEY = None
-# Dictionary defines the different scaling modes available to autoscaler
-MODES = {
-    'mem': ScaleByMemory,
-    'jvm': ScaleByJvm
-}
+#告警异步发送器(AlarmDispatcher)，为None时告警只写入日志
+ALARM_DISPATCHER = None
+# Registry of the different scaling modes available to autoscaler, as
+# 'module:Class' imported on first use; third-party modes are added from
+# entry points by MODES.discover()
+MODES = ModeRegistry({
+    'cpu': 'autoscaler.modes.scalecpu:ScaleByCPU',
+    'mem': 'autoscaler.modes.scalemem:ScaleByMemory',
+    'sqs': 'autoscaler.modes.scalesqs:ScaleBySQS',
+    'and': 'autoscaler.modes.scalecpuandmem:ScaleByCPUAndMemory',
+    'or': 'autoscaler.modes.scalebycpuormem:ScaleByCPUOrMemory',
+    'jvm': 'autoscaler.modes.scalebyjvm:ScaleByJvm',
+    'jvm_range': 'autoscaler.modes.scalebyjvmrange:ScaleByJvmRange',
+    'forecast': 'autoscaler.modes.scalebyforecast:ScaleByForecast',
+    'target': 'autoscaler.modes.scalebytarget:ScaleByTarget',
+    'policy': 'autoscaler.modes.scalebypolicy:ScaleByPolicy'
+})
+
+
+def load_mode(trigger_mode):
+    '''
+    按trigger_mode加载扩缩模式类，模块在首次使用时才导入，未使用的模式(及其依赖)不会被加载
+    '''
+    return MODES.load(trigger_mode)
 
 class Autoscaler:
     """Marathon autoscaler upon initialization, it reads a list of
@@ -54,63 +79,240 @@ class Autoscaler:
     PROMETHEUS_QUERY_URI = '/api/v1/query'
 
     def __init__(self, dcos_tenant, prometheus_host, app_id, trigger_mode, autoscale_multiplier, min_instances, max_instances, cool_down_factor
-                 , scale_up_factor, min_range, max_range, interval, log_level, api_client, alarm_key):
-        self.scale_up = 0
-        self.cool_down = 0
-        self.trigger_mode = trigger_mode
-        self.autoscale_multiplier = float(autoscale_multiplier)
-        self.min_instances = int(min_instances)
-        self.max_instances = int(max_instances)
-        self.cool_down_factor = int(cool_down_factor)
-        self.scale_up_factor = int(scale_up_factor)
-        self.interval = interval
-        self.log_level = log_level
-        self.alarm_key = alarm_key
-        self.dcos_tenant = dcos_tenant
+                 , scale_up_factor, min_range, max_range, interval, log_level, api_client, alarm_key, snapshots=None,
+                 agent_stats=None, prometheus=None, mode_options=None, scale_down=None, batcher=None,
+                 checkpoint=None):
+        self.init_state(dcos_tenant, app_id, scale_down=scale_down, batcher=batcher, checkpoint=checkpoint)
         self.prometheus_host = prometheus_host
-        self.app_id = app_id
-        self.min_range = min_range
-        self.max_range = max_range
-        self.marathon_apps_uri = Autoscaler.MARATHON_APPS_URI.replace('marathon', dcos_tenant)
-        #多线程时的终止条件
-        self.active = True
 
-        # Start logging
         self.log = logging.getLogger(self.dcos_tenant + self.app_id)
-        if self.log_level == 'DEBUG':
-            self.log.setLevel(logging.DEBUG)
-        else:
-            self.log.setLevel(logging.INFO)
 
         # Initialize marathon client for auth requests
         self.api_client = api_client
 
-        # Initialize agent statistics fetcher and keeper
-        self.agent_stats = AgentStats(self.api_client)
+        # Initialize agent statistics fetcher and keeper, shared by all
+        # autoscalers when given
+        self.owns_agent_stats = agent_stats is None
+        self.agent_stats = agent_stats if agent_stats is not None else AgentStats(self.api_client)
 
         # Instantiate the Marathon app class
         app_id = app_id
         if not app_id.startswith('/'):
             app_id = '/' + app_id
+        # 多个app共享同一租户的app快照，每周期每个租户只查询一次marathon
         self.marathon_app = MarathonApp(
             app_id=app_id,
             api_client=self.api_client,
-            dcos_tenant=self.dcos_tenant
+            dcos_tenant=self.dcos_tenant,
+            snapshot=snapshots.for_tenant(self.dcos_tenant) if snapshots is not None else None
         )
 
-        # Instantiate the scaling mode class
-        min = [float(i) for i in min_range]
-        max = [float(i) for i in max_range]
+        # Prometheus client, shared by all autoscalers when given
+        if prometheus is None and self.prometheus_host is not None:
+            prometheus = PrometheusClient(self.prometheus_host, max_age=interval)
+        self.prometheus = prometheus
+
+        self.reconfigure(trigger_mode, autoscale_multiplier, min_instances, max_instances,
+                         cool_down_factor, scale_up_factor, min_range, max_range, interval,
+                         log_level, alarm_key, mode_options)
+
+    def init_state(self, dcos_tenant, app_id, scale_down=None, batcher=None, checkpoint=None, clock=time.monotonic):
+        '''
+        初始化评估状态，live autoscaler与回测的SimulatedAutoscaler共用
+        '''
+        self.scale_up = 0
+        self.cool_down = 0
+        #持续低于缩容阈值的开始时间，及上次扩缩动作的时间
+        self.below_since = None
+        self.last_scaled = None
+        self.clock = clock
+        #评估与热更新配置互斥，评估期间持有(含网络I/O)
+        self.lock = threading.RLock()
+        #仅保护待应用的新配置，不跨越I/O
+        self.config_lock = threading.Lock()
+        self.pending = None
+        #最近一次成功应用的策略的间隔
+        self.applied_interval = None
+        self.dcos_tenant = dcos_tenant
+        self.app_id = app_id
+        #调度与监控中使用的app标识
+        self.key = dcos_tenant + app_id
+        self.marathon_apps_uri = Autoscaler.MARATHON_APPS_URI.replace('marathon', dcos_tenant)
+        #多线程时的终止条件
+        self.active = True
+
+        # Scale-down safeguards, shared by all autoscalers when given
+        self.scale_down = scale_down if scale_down is not None else ScaleDownGuard()
+
+        # Batches the scale requests of all autoscalers per tenant when
+        # given, otherwise every scale is a PUT of its own
+        self.batcher = batcher
+
+        # 检查点在首次评估时才读取，不拖慢启动
+        self.checkpoint = checkpoint
+        self.restored = checkpoint is None
+        #上次评估的时间(wall clock)
+        self.evaluated_at = None
+        #评估结束时的状态快照，检查点线程读取时不等待评估的I/O
+        self.state = None
 
-        dimension = {"min": min, "max": max}
+        self.trigger_mode = None
+        self.scaling_mode = None
 
-        self.scaling_mode = MODES[self.trigger_mode](
+    def dimension(self, min_range=None, max_range=None):
+        min = [float(i) for i in (self.min_range if min_range is None else min_range)]
+        max = [float(i) for i in (self.max_range if max_range is None else max_range)]
+
+        return {"min": min, "max": max}
+
+    def build_scaling_mode(self, trigger_mode=None, mode_options=None, dimension=None):
+        """Instantiate the scaling mode class, of the current policy unless
+        given
+        """
+        trigger_mode = self.trigger_mode if trigger_mode is None else trigger_mode
+        return load_mode(trigger_mode)(
             api_client=self.api_client,
             agent_stats=self.agent_stats,
             prometheus_host = self.prometheus_host,
             app=self.marathon_app,
-            dimension=dimension,
+            dimension=self.dimension() if dimension is None else dimension,
+            prometheus=self.prometheus,
+            options=self.mode_options if mode_options is None else mode_options,
         )
+
+    def reconfigure(self, trigger_mode, autoscale_multiplier, min_instances, max_instances, cool_down_factor,
+                    scale_up_factor, min_range, max_range, interval, log_level, alarm_key, mode_options=None):
+        """Apply a new scaling policy to the running autoscaler. The
+        scale_up/cool_down counters and the scaling mode (with its history)
+        are kept unless the trigger mode or its options change; new
+        thresholds are applied to the running mode. While an evaluation is
+        in flight the policy is applied when it ends, so that the config
+        loop does not wait for its I/O.
+        """
+        with self.config_lock:
+            self.pending = (trigger_mode, autoscale_multiplier, min_instances, max_instances, cool_down_factor,
+                            scale_up_factor, min_range, max_range, interval, log_level, alarm_key, mode_options)
+            #调度器随即读取新的间隔
+            self.interval = interval
+        if self.lock.acquire(blocking=False):
+            try:
+                self.apply_pending(defer_errors=False)
+            finally:
+                self.lock.release()
+
+    def apply_pending(self, defer_errors=True):
+        """Apply the policy given to reconfigure, if any, holding self.lock.
+        With defer_errors a policy which fails to apply is logged and
+        dropped, the running policy is kept.
+        """
+        with self.config_lock:
+            pending, self.pending = self.pending, None
+        if pending is None:
+            return
+        try:
+            self._reconfigure(*pending)
+        except Exception as e:
+            with self.config_lock:
+                #未应用的策略不改变调度间隔，除非其后又有新策略
+                if self.pending is None:
+                    self.interval = self.applied_interval
+            if not defer_errors:
+                raise
+            self.log.error("failed to apply the new scaling policy: %s", e)
+
+    def _reconfigure(self, trigger_mode, autoscale_multiplier, min_instances, max_instances, cool_down_factor,
+                     scale_up_factor, min_range, max_range, interval, log_level, alarm_key, mode_options=None):
+        mode_options = mode_options or {}
+        with self.lock:
+            #先校验新策略并构建(或更新)扩缩模式，失败时autoscaler的字段保持不变
+            autoscale_multiplier = float(autoscale_multiplier)
+            min_instances = int(min_instances)
+            max_instances = int(max_instances)
+            cool_down_factor = int(cool_down_factor)
+            scale_up_factor = int(scale_up_factor)
+            dimension = self.dimension(min_range, max_range)
+            rebuild = self.scaling_mode is None or trigger_mode != self.trigger_mode \
+                or mode_options != self.mode_options
+            if rebuild:
+                scaling_mode = self.build_scaling_mode(trigger_mode, mode_options, dimension)
+            else:
+                # 新阈值无效时set_dimension抛出，运行中的模式保留原阈值
+                self.scaling_mode.set_dimension(dimension)
+                scaling_mode = self.scaling_mode
+
+            if self.scaling_mode is not None and trigger_mode != self.trigger_mode:
+                # 扩缩指标变化，之前累计的周期数不再有意义
+                self.scale_up = 0
+                self.cool_down = 0
+                self.below_since = None
+
+            self.trigger_mode = trigger_mode
+            self.autoscale_multiplier = autoscale_multiplier
+            self.min_instances = min_instances
+            self.max_instances = max_instances
+            self.cool_down_factor = cool_down_factor
+            self.scale_up_factor = scale_up_factor
+            self.min_range = min_range
+            self.max_range = max_range
+            self.interval = interval
+            self.applied_interval = interval
+            self.log_level = log_level
+            self.alarm_key = alarm_key
+            self.mode_options = mode_options
+
+            if self.log_level == 'DEBUG':
+                self.log.setLevel(logging.DEBUG)
+            else:
+                self.log.setLevel(logging.INFO)
+
+            self.scaling_mode = scaling_mode
+
+    def wall_time(self, monotonic):
+        return None if monotonic is None else time.time() - (self.clock() - monotonic)
+
+    def monotonic_time(self, wall):
+        return None if wall is None else self.clock() - (time.time() - wall)
+
+    def get_state(self):
+        """State to checkpoint: the cycle counters, the stabilisation
+        timestamps (as wall clock times) and the history of the scaling
+        mode, as snapshotted at the end of the last evaluation. None until
+        the app's checkpoint, if any, has been restored.
+        """
+        return self.state
+
+    def snapshot_state(self):
+        """Copy the state to checkpoint, holding self.lock"""
+        if not self.restored:
+            return
+        self.state = copy.deepcopy({
+            'trigger_mode': self.trigger_mode,
+            'mode_options': self.mode_options,
+            'scale_up': self.scale_up,
+            'cool_down': self.cool_down,
+            'below_since': self.wall_time(self.below_since),
+            'last_scaled': self.wall_time(self.last_scaled),
+            'mode': self.scaling_mode.get_state(),
+        })
+
+    def restore(self, state, age):
+        """Resume from a state returned by get_state age seconds ago. The
+        cycle counters are only restored from a recent checkpoint, the
+        history of the scaling mode and the time of the last scale always.
+        """
+        if state is None:
+            return
+        if state.get('trigger_mode') != self.trigger_mode or state.get('mode_options') != self.mode_options:
+            self.log.info("checkpoint of a different scaling mode, not restored")
+            return
+        self.scaling_mode.set_state(state.get('mode') or {})
+        self.last_scaled = self.monotonic_time(state.get('last_scaled'))
+        if age <= self.checkpoint.max_age:
+            self.scale_up = state.get('scale_up', 0)
+            self.cool_down = state.get('cool_down', 0)
+            self.below_since = self.monotonic_time(state.get('below_since'))
+        self.log.info("restored the checkpoint saved %.0fs ago", age)
+
     def terminal(self):
         self.active = False
     def timer(self):
@@ -124,6 +326,11 @@ class Autoscaler:
         factor. If scale_up/cool_down cycle count exceeds scaling
         factor, autoscale (up/down) will be triggered.
         """
+        if direction == -1:
+            if self.below_since is None:
+                self.below_since = self.clock()
+        else:
+            self.below_since = None
 
         if direction == 1:
             self.scale_up += 1
@@ -151,7 +358,7 @@ class Autoscaler:
             self.log.info("%s within thresholds" % self.trigger_mode)
             self.scale_up = 0
             self.cool_down = 0
-    def alarm(self, detail):
+    def alarm(self, detail, reason='scale_up'):
         msg = copy.deepcopy(ALARM_API_BODY)
         if ALARM_API_BODY_GLOBALKEY != None:
             msg['request_params']['key'] = ALARM_API_BODY_GLOBALKEY
@@ -162,72 +369,203 @@ class Autoscaler:
         msg['body']['startTime'] = datetime.datetime.now().isoformat()
         msg['body']['threshold'] = '扩缩策略:{},扩容阈值:{}%,缩容阈值:{}%,最小实例数:{},最大实例数:{}'\
             .format(self.trigger_mode, str(self.max_range), str(self.min_range), str(self.min_instances), str(self.max_instances))
-        self.log.warning(json.dumps(msg,ensure_ascii=False))
+        if ALARM_DISPATCHER is not None:
+            self.log.warning('alarm: %s', detail)
+            # 同一app同一原因的重复告警在时间窗口内被抑制
+            ALARM_DISPATCHER.submit(msg, key=(self.dcos_tenant + self.app_id, reason))
+        else:
+            self.log.warning(json.dumps(msg,ensure_ascii=False))
     def scale_app(self, is_up):
         """Scale marathon_app up or down
         Args:
             is_up(bool): Scale up if True, scale down if False
         """
-        # get the number of instances running
-        app_instances = self.marathon_app.get_app_instances()
+        with tracing.stage('scale_app'):
+            self._scale_app(is_up)
 
+    def target_instances(self, app_instances, is_up):
+        """Number of instances to scale app_instances to, shared by the
+        live scaling and the trace replay. The scaling mode may size the
+        app directly (target tracking), otherwise it is multiplied by
+        autoscale_multiplier. A scale up never lowers the instance count and
+        a scale down never raises it, so that a scale down always goes
+        through the ScaleDownGuard.
+        """
+        desired = self.scaling_mode.desired_instances(app_instances)
         if is_up:
-            target_instances = math.ceil(app_instances * self.autoscale_multiplier)
+            if desired is not None:
+                target_instances = max(desired, self.min_instances)
+            else:
+                target_instances = math.ceil(app_instances * self.autoscale_multiplier)
             if target_instances > self.max_instances:
                 self.log.warning("Reached the set maximum of instances %s", self.max_instances)
                 target_instances = self.max_instances
+            target_instances = max(target_instances, app_instances)
+        else:
+            if desired is not None:
+                target_instances = desired
+            else:
+                target_instances = math.floor(app_instances / self.autoscale_multiplier)
+            if target_instances < self.min_instances:
+                self.log.info("Reached the set minimum of instances %s", self.min_instances)
+                target_instances = self.min_instances
+            target_instances = min(target_instances, app_instances)
+            target_instances = self.scale_down.limit(app_instances, target_instances)
+        return target_instances
+
+    def scale_down_target(self, app_instances):
+        """Number of instances to scale down to, or None while the app has
+        not been below the thresholds for the stabilisation window, was
+        scaled within the window, or cannot be scaled down further
+        """
+        now = self.clock()
+        window = self.scale_down.window
+        if self.below_since is None or now - self.below_since < window:
+            self.log.info("below thresholds for %.0fs, waiting for the %ss stabilisation window",
+                          0 if self.below_since is None else now - self.below_since, window)
+            return None
+        if self.last_scaled is not None and now - self.last_scaled < window:
+            self.log.info("scaled %.0fs ago, waiting for the %ss stabilisation window",
+                          now - self.last_scaled, window)
+            return None
+        target_instances = self.target_instances(app_instances, False)
+        if target_instances >= app_instances:
+            return None
+        return target_instances
+
+    def _scale_down_target(self, app_instances):
+        target_instances = self.scale_down_target(app_instances)
+        if target_instances is None:
+            return app_instances
+        if not self.scale_down.acquire(self.key):
+            self.log.warning("scale down budget of %s concurrent scale downs exhausted",
+                             self.scale_down.budget)
+            return app_instances
+        self.alarm("当前实例数为{}，将缩容至实例数{}".format(app_instances, target_instances), 'scale_down')
+        return target_instances
+
+    def _scale_app(self, is_up):
+        # get the number of instances running
+        app_instances = self.marathon_app.get_app_instances()
+
+        if is_up:
+            target_instances = self.target_instances(app_instances, True)
             if target_instances > app_instances:
                 detail = "当前实例数为{}，将扩容至实例数{}".format(app_instances, target_instances)
             else:
                 detail = "当前实例数为{}，已达到最大实例数".format(app_instances)
-            self.alarm(detail)
-        else:
-            # target_instances = math.floor(app_instances / self.autoscale_multiplier)
-            # if target_instances < self.min_instances:
-            #     self.log.info("Reached the set minimum of instances %s", self.min_instances)
-            #     target_instances = self.min_instances
-            #缩容动作动作不执行，日志告警
+            self.alarm(detail, 'max_instances' if target_instances <= app_instances else 'scale_up')
+        elif not self.scale_down.enabled:
+            #缩容动作不执行，日志告警
             target_instances = app_instances
             self.log.warning('scale down trigger off')
+        else:
+            target_instances = self._scale_down_target(app_instances)
 
         self.log.debug("scale_app: app_instances %s target_instances %s",
                        app_instances, target_instances)
 
         if app_instances != target_instances:
-            data = {'instances': target_instances}
-            json_data = json.dumps(data)
-            response = self.api_client.dcos_rest(
-                "put",
-                self.marathon_apps_uri + self.marathon_app.app_id,
-                data=json_data
-            )
-            self.log.debug("scale_app response: %s", response)
+            if self.batcher is not None:
+                #同一租户的扩缩动作合并为一个批量请求
+                self.batcher.submit(self.dcos_tenant, self.marathon_app.app_id, target_instances)
+            else:
+                data = {'instances': target_instances}
+                json_data = json.dumps(data)
+                response = self.api_client.dcos_rest(
+                    "put",
+                    self.marathon_apps_uri + self.marathon_app.app_id,
+                    data=json_data
+                )
+                self.log.debug("scale_app response: %s", response)
+            self.last_scaled = self.clock()
+            metrics.SCALE_ACTIONS.inc(self.key, 'up' if target_instances > app_instances else 'down')
 
-    def run(self):
-        """Main function
+    def evaluate(self):
+        """Run a single evaluation cycle for the app
         """
-        self.cool_down = 0
-        self.scale_up = 0
+        started = time.monotonic()
+        try:
+            with self.lock, tracing.TRACER.evaluation(self.key), tracing.stage('evaluate'):
+                self.apply_pending()
+                try:
+                    self._evaluate()
+                finally:
+                    #评估期间到达的新配置
+                    self.apply_pending()
+                    if self.checkpoint is not None:
+                        self.snapshot_state()
+        except Exception:
+            metrics.EVALUATION_ERRORS.inc(self.key)
+            raise
+        finally:
+            metrics.EVALUATION_SECONDS.observe(self.key, value=time.monotonic() - started)
 
-        while self.active:
+    def _evaluate(self):
+        self.evaluated_at = time.time()
+        if not self.restored:
             try:
-                self.agent_stats.reset()
+                self.restore(*self.checkpoint.load(self.key))
+            except Exception as e:
+                self.log.error("failed to restore the checkpoint: %s", e)
+            self.restored = True
+
+        # 共享的agent统计信息按有效期过期，不在此处清空
+        if self.owns_agent_stats:
+            self.agent_stats.reset()
+
+        # Test for apps existence in Marathon
+        with tracing.stage('app_exists'):
+            exists = self.marathon_app.app_exists()
+        if not exists:
+            self.log.error("Could not find %s in list of apps.",
+                           self.marathon_app.app_id)
+            return
 
-                # Test for apps existence in Marathon
-                if not self.marathon_app.app_exists():
-                    self.log.error("Could not find %s in list of apps.",
-                                   self.marathon_app.app_id)
-                    continue
+        # The scale-down budget taken by the app is given back once its
+        # deployment is over
+        deployments = self.marathon_app.get_deployments()
+        if self.scale_down.holds(self.key) and not deployments:
+            self.scale_down.release(self.key)
 
-                # Get the mode scaling direction
+        # 部署中的任务统计不可信，再次扩缩会叠加新的部署，推迟到部署结束后评估
+        if deployments:
+            self.log.info("deployment %s of %s in progress, evaluation deferred",
+                          deployments, self.app_id)
+            metrics.DEPLOYMENT_SKIPS.inc(self.key)
+            return
+
+        # Get the mode scaling direction
+        with tracing.stage('get_value'):
+            try:
                 direction = self.scaling_mode.scale_direction()
-                self.log.debug("scaling mode direction = %s", direction)
+            except NoSample as e:
+                #首个周期等尚无样本，本周期不做决策
+                self.log.debug("no scaling decision for %s: %s", self.app_id, e)
+                return
+        self.log.debug("scaling mode direction = %s", direction)
+        metrics.SCALE_DIRECTION.inc(self.key, direction)
+        if recording.RECORDER.enabled:
+            recording.RECORDER.record(self.key, self.trigger_mode, self.scaling_mode.last_value,
+                                      self.marathon_app.get_app_instances())
+
+        # Evaluate whether to auto-scale
+        with tracing.stage('autoscale'):
+            self.autoscale(direction)
+        metrics.SCALE_UP_CYCLES.set(self.key, value=self.scale_up)
+        metrics.COOL_DOWN_CYCLES.set(self.key, value=self.cool_down)
 
-                # Evaluate whether to auto-scale
-                self.autoscale(direction)
+    def run(self):
+        """Main function
+        """
+        self.cool_down = 0
+        self.scale_up = 0
 
+        while self.active:
+            try:
+                self.evaluate()
             except Exception as e:
                 self.log.exception(e)
             finally:
                 self.timer()
-        self.log.info('termination')
\ No newline at end of file
+        self.log.info('termination')
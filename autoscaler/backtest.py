@@ -0,0 +1,447 @@
+# encoding: utf-8
+
+"""
+@file: backtest.py
+
+Replays recorded traces (see recording.py) through the scaling modes and
+Autoscaler.autoscale to evaluate scaling policies offline:
+
+    python -m autoscaler.backtest trace.gz --configs configs.json --step 20 \
+        --grid max_range=70,80,90 --grid scale_up_factor=2,3
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from autoscaler.autoscaler import Autoscaler, load_mode
+from autoscaler.modes.scalebypolicy import ScaleByPolicy
+from autoscaler.recording import load_trace
+from autoscaler.scale_down import ScaleDownGuard
+
+# 可在网格中调整的参数
+PARAMETERS = ('min_range', 'max_range', 'scale_up_factor', 'cool_down_factor',
+              'autoscale_multiplier', 'min_instances', 'max_instances', 'target', 'max_step_up',
+              'max_step_down', 'scale_down_window', 'scale_down_max_step')
+# target跟踪模式的参数，属于mode_options
+MODE_OPTIONS = ('target', 'max_step_up', 'max_step_down')
+# 缩容保护(ScaleDownGuard)的参数，对所有app相同
+SCALE_DOWN = {'scale_down_window': 300, 'scale_down_max_step': 1}
+FLOAT_PARAMETERS = ('min_range', 'max_range', 'autoscale_multiplier', 'target', 'scale_down_window')
+# 扩缩方向为记录值与min_range/max_range比较(AbstractMode.scale_direction)的模式，
+# sweep以numpy逐步模拟；target另按desired_instances计算实例数。其他模式逐个replay
+VECTORISED = frozenset(['cpu', 'mem', 'sqs', 'jvm', 'jvm_range', 'forecast', 'target'])
+# 每个app每个组合的回放结果，参数无效(如target不在阈值之间)的组合为NaN
+RESULTS = ('scale_ups', 'scale_downs', 'final_instances', 'mean_instances', 'hot_ratio')
+
+
+def app_parameters(app):
+    """Numeric policy parameters of an app config of the autoscale api"""
+    first = lambda value: float(value[0] if isinstance(value, list) else value)
+    options = app.get('mode_options') or {}
+    min_range, max_range = first(app['min_range']), first(app['max_range'])
+    return {
+        'min_range': min_range,
+        'max_range': max_range,
+        'scale_up_factor': int(app['scale_up_factor']),
+        'cool_down_factor': int(app['cool_down_factor']),
+        'autoscale_multiplier': float(app['autoscale_multiplier']),
+        'min_instances': int(app['min_instances']),
+        'max_instances': int(app['max_instances']),
+        'target': float(options['target']) if options.get('target') is not None else (min_range + max_range) / 2,
+        'max_step_up': int(options.get('max_step_up') or 0),
+        'max_step_down': int(options.get('max_step_down') or 0),
+    }
+
+
+class SimulatedAutoscaler(Autoscaler):
+    """Autoscaler whose scale_app changes a simulated instance count
+    instead of the Marathon app, on a simulated clock. The decision logic
+    (scale_direction of the mode, autoscale, target_instances and the
+    scale-down stabilisation window) is the one of the live autoscaler;
+    the concurrency budget and deployment checks are not simulated.
+    """
+
+    def __init__(self, app, instances, mode_class=None, scale_down=None):
+        self.now = 0.0
+        self.init_state(app['dcos_tenant'], app['id'], clock=lambda: self.now,
+                        scale_down=scale_down if scale_down is not None else ScaleDownGuard(max_concurrent=0))
+        self.log = logging.getLogger('backtest')
+        self.api_client = None
+        self.agent_stats = None
+        self.prometheus = None
+        self.prometheus_host = None
+        self.marathon_app = None
+        self.mode_class = mode_class
+        self.instances = instances
+        self.scale_ups = 0
+        self.scale_downs = 0
+
+        self.reconfigure(app['trigger_mode'], app['autoscale_multiplier'], app['min_instances'],
+                         app['max_instances'], app['cool_down_factor'], app['scale_up_factor'],
+                         app['min_range'], app['max_range'], app.get('interval'), 'INFO',
+                         app.get('alarm_key'), app.get('mode_options'))
+
+    def build_scaling_mode(self, trigger_mode=None, mode_options=None, dimension=None):
+        dimension = self.dimension() if dimension is None else dimension
+        mode_class = self.mode_class or load_mode(self.trigger_mode if trigger_mode is None else trigger_mode)
+        mode = mode_class(dimension=dimension, options=self.mode_options if mode_options is None else mode_options)
+        mode.set_dimension(dimension)
+        return mode
+
+    def scale_app(self, is_up):
+        if is_up:
+            target_instances = self.target_instances(self.instances, True)
+        elif not self.scale_down.enabled:
+            return
+        else:
+            target_instances = self.scale_down_target(self.instances)
+            if target_instances is None:
+                return
+        if target_instances > self.instances:
+            self.scale_ups += 1
+        elif target_instances < self.instances:
+            self.scale_downs += 1
+        if target_instances != self.instances:
+            self.last_scaled = self.clock()
+        self.instances = target_instances
+
+    def step(self, value, now):
+        """Evaluate one recorded value of the scaling metric at time now,
+        returns the direction of the scaling mode
+        """
+        self.now = now
+        self.scaling_mode.get_value = lambda: value
+        direction = self.scaling_mode.scale_direction()
+        self.autoscale(direction)
+        return direction
+
+
+def simulated_value(value, recorded_instances, instances, proportional):
+    """With proportional, the load of the recorded value is spread over the
+    simulated instance count instead of the recorded one
+    """
+    if proportional and recorded_instances and not math.isnan(recorded_instances) and instances:
+        return value * recorded_instances / instances
+    return value
+
+
+def scale_down_guard(overrides=None, enabled=True):
+    parameters = dict(SCALE_DOWN, **{k: v for k, v in (overrides or {}).items() if k in SCALE_DOWN})
+    return ScaleDownGuard(enabled=enabled, window=parameters['scale_down_window'],
+                          max_step=parameters['scale_down_max_step'], max_concurrent=0)
+
+
+def replay(app, values, instances, overrides=None, mode_class=None, proportional=True, step=20,
+           scale_down=True):
+    """Replay the values of one app through its scaling mode and
+    Autoscaler.autoscale, one step at a time
+    Args:
+        app: app config of the autoscale api
+        values: scaling metric per step, NaN where the evaluation failed
+        instances: recorded instance count per step
+        overrides: policy parameters replacing those of app
+        step: seconds between two values
+        scale_down: False to simulate with scale-down disabled
+    Returns:
+        dict of scale_ups, scale_downs, final_instances, mean_instances, hot_ratio,
+        all NaN when the scaling mode rejects the parameters
+    """
+    overrides = dict(overrides or {})
+    guard = scale_down_guard(overrides, scale_down)
+    for name in SCALE_DOWN:
+        overrides.pop(name, None)
+    options = dict(app.get('mode_options') or {})
+    for name in MODE_OPTIONS:
+        if name in overrides:
+            options[name] = overrides.pop(name)
+    for name in ('min_range', 'max_range'):
+        if name in overrides:
+            overrides[name] = [overrides[name]]
+    app = dict(app, mode_options=options, **overrides)
+    recorded = [n for n in instances if not math.isnan(n)]
+    try:
+        simulation = SimulatedAutoscaler(app, int(recorded[0]) if recorded else int(app['min_instances']),
+                                         mode_class, guard)
+    except ValueError as e:
+        logging.getLogger('backtest').warning('invalid parameters %s for %s: %s', overrides, app['id'], e)
+        return dict.fromkeys(RESULTS, math.nan)
+    # 组合策略(policy, and, or)记录的是规则的得分而非负载，不按实例数换算
+    proportional = proportional and not isinstance(simulation.scaling_mode, ScaleByPolicy)
+    valid = hot = 0
+    instance_steps = 0
+    for index, (value, recorded_instances) in enumerate(zip(values, instances)):
+        if math.isnan(value):
+            continue
+        value = simulated_value(value, recorded_instances, simulation.instances, proportional)
+        valid += 1
+        instance_steps += simulation.instances
+        if simulation.step(value, index * step) == 1:
+            hot += 1
+    return {
+        'scale_ups': simulation.scale_ups,
+        'scale_downs': simulation.scale_downs,
+        'final_instances': simulation.instances,
+        'mean_instances': instance_steps / valid if valid else float(simulation.instances),
+        'hot_ratio': hot / valid if valid else 0.0,
+    }
+
+
+def combinations(grid):
+    """[{name: value}] for the cartesian product of grid {name: [values]}"""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[n] for n in names])]
+
+
+def vectorised_sweep(apps, values, instances, combos, proportional=True, step=20, scale_down=True, defaults=None):
+    """numpy re-implementation of replay() for apps of the VECTORISED
+    modes: the apps x combinations state mirroring
+    AbstractMode.scale_direction, Autoscaler.autoscale,
+    Autoscaler.target_instances and Autoscaler.scale_down_target is
+    advanced one step at a time over arrays. verify() checks it against
+    replay().
+    Returns:
+        {result: [apps, combinations] array}
+    """
+    values = numpy.asarray(values, dtype=float)
+    instances = numpy.asarray(instances, dtype=float)
+    shape = (len(apps), len(combos))
+    base = [dict(SCALE_DOWN, **dict(defaults or {}, **app_parameters(app))) for app in apps]
+    p = {name: numpy.array([[combo.get(name, base[a][name]) for combo in combos]
+                            for a in range(len(apps))], dtype=float)
+         for name in PARAMETERS}
+
+    tracking = numpy.array([[app['trigger_mode'] == 'target'] for app in apps])
+    # 未显式给出target时，取每个组合自身阈值的中点，与ScaleByTarget.target一致
+    explicit = numpy.array([['target' in combo or (app.get('mode_options') or {}).get('target') is not None
+                             for combo in combos] for app in apps])
+    p['target'] = numpy.where(explicit, p['target'], (p['min_range'] + p['max_range']) / 2)
+    # ScaleByTarget拒绝不在阈值之间的target(阈值倒置时中点也不在其间)
+    invalid = tracking & ~((p['min_range'] < p['target']) & (p['target'] < p['max_range']))
+    # 以第一个记录的实例数为初始实例数
+    first = numpy.array([row[~numpy.isnan(row)][0] if (~numpy.isnan(row)).any() else p['min_instances'][a, 0]
+                         for a, row in enumerate(instances)])
+    current = numpy.repeat(first[:, None], len(combos), axis=1)
+    scale_up = numpy.zeros(shape)
+    cool_down = numpy.zeros(shape)
+    below_since = numpy.full(shape, numpy.nan)
+    last_scaled = numpy.full(shape, numpy.nan)
+    scale_ups = numpy.zeros(shape)
+    scale_downs = numpy.zeros(shape)
+    valid_steps = numpy.zeros(shape)
+    hot = numpy.zeros(shape)
+    instance_steps = numpy.zeros(shape)
+
+    for t in range(values.shape[1]):
+        now = t * step
+        value = values[:, t:t + 1]
+        recorded = instances[:, t:t + 1]
+        valid = numpy.broadcast_to(~numpy.isnan(value), shape)
+        if proportional:
+            value = numpy.where(numpy.isnan(recorded) | (recorded == 0), value, value * recorded / current)
+        else:
+            value = numpy.broadcast_to(value, shape)
+        # AbstractMode.scale_direction
+        above = valid & (value > p['max_range'])
+        below = valid & ~above & (value < p['min_range'])
+        valid_steps += valid
+        instance_steps += numpy.where(valid, current, 0)
+        hot += above
+        # Autoscaler.autoscale
+        below_since = numpy.where(below, numpy.where(numpy.isnan(below_since), now, below_since),
+                                  numpy.where(valid, numpy.nan, below_since))
+        scale_up = numpy.where(above, scale_up + 1, numpy.where(valid, 0, scale_up))
+        cool_down = numpy.where(below, cool_down + 1, numpy.where(valid, 0, cool_down))
+        fire_up = above & (scale_up >= p['scale_up_factor'])
+        fire_down = below & (cool_down >= p['cool_down_factor'])
+        scale_up = numpy.where(fire_up, 0, scale_up)
+        cool_down = numpy.where(fire_down, 0, cool_down)
+        # Autoscaler.target_instances
+        desired = numpy.ceil(current * value / p['target'])
+        desired = numpy.where(p['max_step_up'] > 0, numpy.minimum(desired, current + p['max_step_up']), desired)
+        desired = numpy.where(p['max_step_down'] > 0, numpy.maximum(desired, current - p['max_step_down']), desired)
+        up_target = numpy.where(tracking, numpy.maximum(desired, p['min_instances']),
+                                numpy.ceil(current * p['autoscale_multiplier']))
+        up_target = numpy.maximum(numpy.minimum(up_target, p['max_instances']), current)
+        down_target = numpy.where(tracking, desired, numpy.floor(current / p['autoscale_multiplier']))
+        down_target = numpy.minimum(numpy.maximum(down_target, p['min_instances']), current)
+        down_target = numpy.where(p['scale_down_max_step'] > 0,
+                                  numpy.maximum(down_target, current - p['scale_down_max_step']), down_target)
+        # Autoscaler.scale_down_target
+        window = p['scale_down_window']
+        allowed = fire_down & (now - below_since >= window) \
+            & (numpy.isnan(last_scaled) | (now - last_scaled >= window)) & (down_target < current)
+        if not scale_down:
+            allowed = numpy.zeros(shape, dtype=bool)
+        target = numpy.where(fire_up, up_target, numpy.where(allowed, down_target, current))
+        last_scaled = numpy.where(target != current, now, last_scaled)
+        scale_ups += target > current
+        scale_downs += target < current
+        current = target
+
+    results = {
+        'scale_ups': scale_ups,
+        'scale_downs': scale_downs,
+        'final_instances': current,
+        'mean_instances': numpy.where(valid_steps > 0, instance_steps / numpy.maximum(valid_steps, 1), current),
+        'hot_ratio': numpy.where(valid_steps > 0, hot / numpy.maximum(valid_steps, 1), 0.0),
+    }
+    return {name: numpy.where(invalid, numpy.nan, result) for name, result in results.items()}
+
+
+def sweep(apps, values, instances, grid, proportional=True, step=20, scale_down=True, defaults=None):
+    """Replay every app under every combination of the grid. Apps of the
+    VECTORISED modes are simulated at once with vectorised_sweep() when
+    numpy is installed, the others are replayed pair by pair with replay().
+    Args:
+        apps: app configs, one per row of values
+        values, instances: [apps, steps] arrays from Trace.grid
+        grid: {parameter: [values]}
+        defaults: values of the scale-down guard parameters not in grid
+    Returns:
+        (combinations, {result: [apps][combinations] values})
+    """
+    combos = combinations(grid) or [{}]
+    results = {name: [[math.nan] * len(combos) for _ in apps] for name in RESULTS}
+    fast = [a for a, app in enumerate(apps) if numpy is not None and app['trigger_mode'] in VECTORISED]
+    if fast:
+        vectorised = vectorised_sweep([apps[a] for a in fast], [values[a] for a in fast],
+                                      [instances[a] for a in fast], combos, proportional=proportional,
+                                      step=step, scale_down=scale_down, defaults=defaults)
+        for row, a in enumerate(fast):
+            for name in RESULTS:
+                results[name][a] = [float(v) for v in vectorised[name][row]]
+    for a in sorted(set(range(len(apps))) - set(fast)):
+        for c, combo in enumerate(combos):
+            for name, value in replay(apps[a], values[a], instances[a], dict(defaults or {}, **combo),
+                                      proportional=proportional, step=step, scale_down=scale_down).items():
+                results[name][a][c] = value
+    return combos, results
+
+
+def threshold_insensitive(apps, grid):
+    """Ids of the apps whose results do not depend on the min_range and
+    max_range of grid: composed modes (policy, and, or) record the score of
+    their rule, which replay turns into a direction without thresholds.
+    """
+    if not {'min_range', 'max_range'} & set(grid):
+        return []
+    insensitive = []
+    for app in apps:
+        try:
+            mode_class = load_mode(app['trigger_mode'])
+        except (KeyError, ImportError):
+            continue
+        if issubclass(mode_class, ScaleByPolicy):
+            insensitive.append(app['id'])
+    return insensitive
+
+
+def verify(apps, values, instances, combos, results, samples=10, proportional=True, step=20, scale_down=True,
+           defaults=None, seed=0):
+    """Replay up to samples random (app, combination) cells of the
+    vectorised apps with replay() and compare them with the results of
+    sweep(). Returns the mismatches as [(app id, combination, result,
+    sweep value, replay value)].
+    """
+    cells = [(a, c) for a, app in enumerate(apps) if numpy is not None and app['trigger_mode'] in VECTORISED
+             for c in range(len(combos))]
+    mismatches = []
+    for a, c in random.Random(seed).sample(cells, min(samples, len(cells))):
+        expected = replay(apps[a], values[a], instances[a], dict(defaults or {}, **combos[c]),
+                          proportional=proportional, step=step, scale_down=scale_down)
+        for name in RESULTS:
+            fast, slow = results[name][a][c], expected[name]
+            if not (math.isnan(fast) and math.isnan(slow) or math.isclose(fast, slow, abs_tol=1e-9)):
+                mismatches.append((apps[a]['id'], combos[c], name, fast, slow))
+    return mismatches
+
+
+def load_configs(path):
+    """App configs from a file holding the response of the autoscale api
+    or a list of app configs
+    """
+    with open(path) as f:
+        configs = json.load(f)
+    if isinstance(configs, dict):
+        configs = configs['data']['marathon_apps']
+    return configs
+
+
+def parse_grid(items):
+    grid = {}
+    for item in items or []:
+        name, _, values = item.partition('=')
+        if name not in PARAMETERS:
+            raise ValueError('unknown parameter %s, expected one of %s' % (name, ', '.join(PARAMETERS)))
+        cast = float if name in FLOAT_PARAMETERS else int
+        grid[name] = [cast(v) for v in values.split(',')]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='replay a recorded trace through scaling policies')
+    parser.add_argument('trace', help='trace file written by the trace recorder')
+    parser.add_argument('--configs', required=True,
+                        help='response of the autoscale api, or a list of app configs')
+    parser.add_argument('--step', type=float, default=20, help='seconds per evaluation cycle')
+    parser.add_argument('--grid', action='append', help='parameter=v1,v2,... may be repeated')
+    parser.add_argument('--no-proportional', action='store_true',
+                        help='replay recorded values as is instead of spreading them over the simulated instances')
+    parser.add_argument('--scale-down-window', type=float, default=SCALE_DOWN['scale_down_window'],
+                        help='stabilisation window of scale downs (seconds)')
+    parser.add_argument('--scale-down-max-step', type=int, default=SCALE_DOWN['scale_down_max_step'],
+                        help='most instances removed by one scale down, 0 for no limit')
+    parser.add_argument('--no-scale-down', action='store_true', help='simulate with scale-down disabled')
+    parser.add_argument('--verify', type=int, default=10,
+                        help='cells of the vectorised sweep checked against a scalar replay, 0 to skip')
+    parser.add_argument('--json', help='write per app results to this file')
+    args = parser.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    trace = load_trace(args.trace)
+    apps = [app for app in load_configs(args.configs)
+            if (app['dcos_tenant'] + app['id'], app['trigger_mode']) in trace.series]
+    if not apps:
+        raise SystemExit('no app of the configs is in the trace')
+    keys = [(app['dcos_tenant'] + app['id'], app['trigger_mode']) for app in apps]
+    start, values, instances = trace.grid(keys, args.step)
+    options = dict(proportional=not args.no_proportional, step=args.step, scale_down=not args.no_scale_down,
+                   defaults={'scale_down_window': args.scale_down_window,
+                             'scale_down_max_step': args.scale_down_max_step})
+    grid = parse_grid(args.grid)
+    insensitive = threshold_insensitive(apps, grid)
+    if insensitive:
+        print('WARNING: min_range/max_range do not change the replay of the composed policies of %s' %
+              ', '.join(insensitive))
+    combos, results = sweep(apps, values, instances, grid, **options)
+    for app_id, combo, name, fast, slow in verify(apps, values, instances, combos, results,
+                                                  samples=args.verify, **options):
+        print('WARNING: vectorised %s of %s under %s is %s, replay gives %s' % (
+            name, app_id, json.dumps(combo, sort_keys=True), fast, slow))
+
+    steps = len(values[0]) if len(values) else 0
+    print('%s apps, %s steps of %ss' % (len(apps), steps, args.step))
+    for c, combo in enumerate(combos):
+        rows = [a for a in range(len(apps)) if not math.isnan(results['scale_ups'][a][c])]
+        column = lambda name: [results[name][a][c] for a in rows]
+        print('%-50s scale_ups=%-6d scale_downs=%-6d mean_instances=%-10.1f hot_ratio=%.4f invalid=%d' % (
+            json.dumps(combo, sort_keys=True), sum(column('scale_ups')), sum(column('scale_downs')),
+            sum(column('mean_instances')), sum(column('hot_ratio')) / max(len(rows), 1),
+            len(apps) - len(rows)))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'combinations': combos, 'apps': [k[0] for k in keys],
+                       'results': {name: [[float(v) for v in row] for row in value]
+                                   for name, value in results.items()}}, f)
+
+
+if __name__ == '__main__':
+    main()
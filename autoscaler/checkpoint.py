@@ -0,0 +1,151 @@
+# encoding: utf-8
+
+"""
+@file: checkpoint.py
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class CheckpointStore:
+    """Per-app evaluation state (cycle counters, stabilisation timestamps
+    and the history of the scaling mode) kept in a local SQLite file as
+    zlib compressed JSON, one row per app. Rows are written in batches by
+    a Checkpointer and read lazily, by each Autoscaler on its first
+    evaluation.
+    """
+
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS checkpoint ('
+              'key TEXT PRIMARY KEY, saved REAL NOT NULL, evaluated REAL, state BLOB NOT NULL)')
+
+    def __init__(self, path='autoscale-state.db', max_age=600, retention=86400):
+        """
+        :param max_age: 超过该时间(秒)的检查点不恢复周期计数，只恢复扩缩指标的历史
+        :param retention: 超过该时间(秒)未更新的检查点被删除
+        """
+        self.path = path
+        self.max_age = max_age
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(self.SCHEMA)
+        self.log = logging.getLogger('autoscale')
+
+    @staticmethod
+    def encode(state):
+        return zlib.compress(json.dumps(state, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+
+    def load(self, key):
+        """Returns (state, seconds since it was saved), or (None, None)"""
+        with self.lock:
+            row = self.db.execute('SELECT saved, state FROM checkpoint WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None, None
+        try:
+            return json.loads(zlib.decompress(row[1]).decode('utf-8')), time.time() - row[0]
+        except (zlib.error, ValueError) as e:
+            self.log.error('corrupt checkpoint of %s dropped: %s', key, e)
+            return None, None
+
+    def evaluated(self):
+        """{key: wall clock time of the last evaluation} of all apps"""
+        with self.lock:
+            return {key: evaluated for key, evaluated in
+                    self.db.execute('SELECT key, evaluated FROM checkpoint WHERE evaluated IS NOT NULL')}
+
+    def save(self, rows, touched=()):
+        """Write [(key, evaluated, encoded state)] and mark the unchanged
+        states of touched [(key, evaluated)] as current, in one transaction
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                self.db.executemany('INSERT OR REPLACE INTO checkpoint (key, saved, evaluated, state) '
+                                    'VALUES (?, ?, ?, ?)', [(key, now, evaluated, state)
+                                                            for key, evaluated, state in rows])
+                self.db.executemany('UPDATE checkpoint SET saved = ?, evaluated = ? WHERE key = ?',
+                                    [(now, evaluated, key) for key, evaluated in touched])
+                self.db.execute('DELETE FROM checkpoint WHERE saved < ?', (now - self.retention,))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def resume_delay(evaluated_at, interval, now=None):
+    """Delay of the first evaluation after a restart which keeps the app
+    at the phase of its interval it was evaluated at before, so that the
+    restarted fleet stays spread over the interval. None if unknown.
+    """
+    if evaluated_at is None or not interval:
+        return None
+    now = time.time() if now is None else now
+    return (evaluated_at - now) % interval
+
+
+class Checkpointer:
+    '''
+    定期将调度中所有autoscaler的状态写入CheckpointStore，状态未变化的app只更新保存时间
+    '''
+
+    def __init__(self, store, scheduler, interval=60):
+        self.store = store
+        self.scheduler = scheduler
+        self.interval = interval
+        # key -> 上次写入的编码后状态
+        self.written = {}
+        self.stopped = threading.Event()
+        self.thread = None
+        self.log = logging.getLogger('autoscale')
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='autoscale-checkpoint', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.checkpoint()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                self.log.exception(e)
+
+    def checkpoint(self):
+        """Write the state of every app which changed since the last checkpoint"""
+        rows = []
+        touched = []
+        keys = self.scheduler.keys()
+        for key in keys:
+            autoscaler = self.scheduler.get(key)
+            if autoscaler is None:
+                continue
+            state = autoscaler.get_state()
+            if state is None:
+                continue
+            encoded = self.store.encode(state)
+            if self.written.get(key) != encoded:
+                rows.append((key, autoscaler.evaluated_at, encoded))
+            else:
+                touched.append((key, autoscaler.evaluated_at))
+        if rows or touched:
+            self.store.save(rows, touched)
+            for key, _, encoded in rows:
+                self.written[key] = encoded
+        for key in set(self.written) - set(keys):
+            del self.written[key]
+        self.log.debug('checkpointed %s of %s apps', len(rows), len(keys))
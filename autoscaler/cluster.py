@@ -0,0 +1,215 @@
+# encoding: utf-8
+
+"""
+@file: cluster.py
+"""
+import bisect
+import hashlib
+import importlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class HashRing:
+    """Consistent hash ring of the members, each placed at `vnodes` points.
+    A key belongs to the first member point clockwise from the hash of
+    the key, so adding or removing one of N members only moves about 1/N
+    of the keys, all of them from or to that member.
+    """
+
+    def __init__(self, members, vnodes=64):
+        self.members = sorted(members)
+        self.vnodes = vnodes
+        points = sorted((self.hash('%s#%d' % (member, i)), member)
+                        for member in self.members for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.owners = [m for _, m in points]
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+
+    def owner(self, key):
+        """Returns the member owning key, or None if the ring is empty"""
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, self.hash(key)) % len(self.hashes)
+        return self.owners[index]
+
+
+class SQLiteMembership:
+    '''
+    基于SQLite的成员与leader协调，供同一主机(或共享卷)上的多个副本使用，也作为测试替身。
+    其他后端需实现相同的方法：heartbeat, leave, members, try_lead, publish, view
+    '''
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS members (member_id TEXT PRIMARY KEY, expires REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS leader (id INTEGER PRIMARY KEY CHECK (id = 0), member_id TEXT, expires REAL)',
+        'CREATE TABLE IF NOT EXISTS view (id INTEGER PRIMARY KEY CHECK (id = 0), epoch INTEGER, members TEXT)',
+    )
+
+    def __init__(self, path='autoscale-cluster.db', timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        db = self._connect()
+        try:
+            for statement in self.SCHEMA:
+                db.execute(statement)
+        finally:
+            db.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def _transaction(self, fn):
+        with self.lock:
+            db = self._connect()
+            try:
+                db.execute('BEGIN IMMEDIATE')
+                result = fn(db)
+                db.execute('COMMIT')
+                return result
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            finally:
+                db.close()
+
+    def heartbeat(self, member_id, ttl):
+        """Register member_id, or extend its registration, for ttl seconds"""
+        self._transaction(lambda db: db.execute(
+            'INSERT OR REPLACE INTO members (member_id, expires) VALUES (?, ?)', (member_id, time.time() + ttl)))
+
+    def leave(self, member_id):
+        def leave(db):
+            db.execute('DELETE FROM members WHERE member_id = ?', (member_id,))
+            db.execute('DELETE FROM leader WHERE member_id = ?', (member_id,))
+        self._transaction(leave)
+
+    def members(self):
+        """Members whose registration has not expired"""
+        def members(db):
+            db.execute('DELETE FROM members WHERE expires < ?', (time.time(),))
+            return sorted(row[0] for row in db.execute('SELECT member_id FROM members'))
+        return self._transaction(members)
+
+    def try_lead(self, member_id, ttl):
+        """Take or renew the leadership for ttl seconds. Returns True if
+        member_id is the leader.
+        """
+        def try_lead(db):
+            now = time.time()
+            row = db.execute('SELECT member_id, expires FROM leader WHERE id = 0').fetchone()
+            if row is not None and row[0] != member_id and row[1] >= now:
+                return False
+            db.execute('INSERT OR REPLACE INTO leader (id, member_id, expires) VALUES (0, ?, ?)',
+                       (member_id, now + ttl))
+            return True
+        return self._transaction(try_lead)
+
+    def publish(self, members):
+        """Store the membership view every replica shards by, returns its epoch"""
+        def publish(db):
+            row = db.execute('SELECT epoch, members FROM view WHERE id = 0').fetchone()
+            encoded = json.dumps(sorted(members))
+            if row is not None and row[1] == encoded:
+                return row[0]
+            epoch = row[0] + 1 if row is not None else 1
+            db.execute('INSERT OR REPLACE INTO view (id, epoch, members) VALUES (0, ?, ?)', (epoch, encoded))
+            return epoch
+        return self._transaction(publish)
+
+    def view(self):
+        """Returns (epoch, members) of the published view, (0, []) if none"""
+        with self.lock:
+            db = self._connect()
+            try:
+                row = db.execute('SELECT epoch, members FROM view WHERE id = 0').fetchone()
+            finally:
+                db.close()
+        return (row[0], json.loads(row[1])) if row is not None else (0, [])
+
+
+# 内置的成员协调后端，其他后端以 'module:Class' 指定
+BACKENDS = {
+    'sqlite': SQLiteMembership,
+}
+
+
+def build_backend(name, **options):
+    """Instantiate a membership backend by name or 'module:Class' path"""
+    if name in BACKENDS:
+        return BACKENDS[name](**options)
+    module, _, cls = name.partition(':')
+    return getattr(importlib.import_module(module), cls)(**options)
+
+
+class ShardCoordinator:
+    """Shards apps across the autoscaler replicas. Every replica heartbeats
+    into the membership backend; the leader publishes the live members as
+    a numbered view and every replica keeps the apps which the hash ring of
+    the published view assigns to it. Replicas therefore agree on the
+    owner of an app as soon as they have read the same view, and a change
+    of membership moves only the apps of the member which joined or left.
+    """
+
+    def __init__(self, backend, member_id=None, ttl=60, vnodes=64):
+        """
+        :param member_id: 副本标识，默认为 主机名:进程号
+        :param ttl: 心跳与leader租约的有效期(秒)，需大于tick的间隔
+        :param vnodes: 每个副本在哈希环上的虚拟节点数
+        """
+        self.backend = backend
+        self.member_id = member_id or '%s:%s' % (socket.gethostname(), os.getpid())
+        self.ttl = ttl
+        self.vnodes = vnodes
+        self.leader = False
+        self.epoch = None
+        self.ring = HashRing([], vnodes)
+        self.log = logging.getLogger('autoscale')
+
+    def tick(self):
+        """Heartbeat, take part in the leader election and read the view.
+        Returns True when the view changed since the previous tick.
+        """
+        self.backend.heartbeat(self.member_id, self.ttl)
+        leader = self.backend.try_lead(self.member_id, self.ttl)
+        if leader != self.leader:
+            self.log.info('%s %s the leader', self.member_id, 'is now' if leader else 'is no longer')
+            self.leader = leader
+        if leader:
+            self.backend.publish(self.backend.members())
+        epoch, members = self.backend.view()
+        if epoch == self.epoch:
+            return False
+        self.log.info('cluster view %s: %s', epoch, members)
+        self.epoch = epoch
+        self.ring = HashRing(members, self.vnodes)
+        return True
+
+    def rank(self):
+        """(index of this replica, number of replicas) in the current view"""
+        members = self.ring.members
+        index = members.index(self.member_id) if self.member_id in members else 0
+        return index, len(members)
+
+    def owns(self, key):
+        # 视图尚未发布或未包含本副本时(刚加入)，不认领任何app，等待leader发布新视图
+        return self.ring.owner(key) == self.member_id
+
+    def owned(self, apps):
+        """The apps, as returned by scale_api_url, owned by this replica"""
+        return [app for app in apps if self.owns(app['dcos_tenant'] + app['id'])]
+
+    def leave(self):
+        try:
+            self.backend.leave(self.member_id)
+        except Exception as e:
+            self.log.error('failed to leave the cluster: %s', e)
@@ -0,0 +1,106 @@
+# encoding: utf-8
+
+"""
+@file: http_transport.py
+"""
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from autoscaler import metrics
+
+
+class HttpTransport:
+    """Pooled HTTP transport shared by all Autoscaler threads. Connections to
+    the DC/OS master, Prometheus and the alarm endpoint are kept alive in a
+    requests.Session; idempotent requests are retried with exponential
+    backoff on connection errors and on the configured status codes.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, host_pool_sizes=None,
+                 connect_timeout=3.05, read_timeout=10, retries=2, backoff_factor=0.3,
+                 status_forcelist=(502, 503, 504)):
+        """
+        :param pool_connections: 缓存的连接池(host)个数
+        :param pool_maxsize: 每个host的默认最大连接数
+        :param host_pool_sizes: {url前缀: 最大连接数}，为指定host单独设置连接池大小
+        :param connect_timeout: 建立连接超时(秒)
+        :param read_timeout: 读超时(秒)
+        :param retries: 最大重试次数
+        :param backoff_factor: 重试退避因子，第n次重试前等待backoff_factor * 2^(n-1)秒
+        :param status_forcelist: 需要重试的http状态码
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.log = logging.getLogger('autoscale')
+        self.retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=status_forcelist,
+            raise_on_status=False
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=self.retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        for prefix, size in (host_pool_sizes or {}).items():
+            self.session.mount(prefix, HTTPAdapter(pool_connections=1,
+                                                   pool_maxsize=size,
+                                                   max_retries=self.retry))
+
+    def request(self, method, url, upstream='other', **kwargs):
+        """
+        :param upstream: 上游名称(dcos, mesos_agent, prometheus, alarm...)，用于延迟统计
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.monotonic()
+        status = 'error'
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.UPSTREAM_SECONDS.observe(upstream, status, value=time.monotonic() - started)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_transport = None
+_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """Replace the process wide transport, see HttpTransport for the options"""
+    global _transport
+    with _lock:
+        old = _transport
+        _transport = HttpTransport(**kwargs)
+    if old is not None:
+        old.close()
+    return _transport
+
+
+def get_transport():
+    """Returns the process wide transport, creating one with the defaults
+    if configure() was not called
+    """
+    global _transport
+    if _transport is None:
+        with _lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
@@ -0,0 +1,211 @@
+# encoding: utf-8
+
+"""
+@file: metrics.py
+"""
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for k, v in pairs) + '}'
+
+
+class Metric:
+    """Base of the metric types, a family of series keyed by label values"""
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def forget(self, label, value):
+        """Drop all series whose label has the given value"""
+        index = self.labelnames.index(label)
+        with self.lock:
+            for key in [key for key in self.series if key[index] == value]:
+                del self.series[key]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.TYPE)]
+        with self.lock:
+            items = list(self.series.items())
+        for labels, value in items:
+            lines.extend(self.render_series(labels, value))
+        return lines
+
+    def render_series(self, labels, value):
+        return ['%s%s %s' % (self.name, _format_labels(self.labelnames, labels), value)]
+
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.series[labels] = value
+
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # [每个桶的计数..., +Inf桶计数, sum]
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render_series(self, labels, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), value[:-1]):
+            cumulative += count
+            lines.append('%s_bucket%s %s' % (self.name, _format_labels(self.labelnames, labels, ('le', bound)),
+                                             cumulative))
+        lines.append('%s_sum%s %s' % (self.name, _format_labels(self.labelnames, labels), value[-1]))
+        lines.append('%s_count%s %s' % (self.name, _format_labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+class GaugeCallback(Metric):
+    """Gauge whose series are read from fn() at scrape time; fn returns
+    a list of (label values tuple, value)
+    """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, fn):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.TYPE)]
+        for labels, value in self.fn():
+            lines.extend(self.render_series(tuple(labels), value))
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def forget(self, label, value):
+        for metric in self.metrics:
+            if label in metric.labelnames and not isinstance(metric, GaugeCallback):
+                metric.forget(label, value)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logging.getLogger('autoscale').error('failed to render metric %s: %s', metric.name, e)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+EVALUATION_SECONDS = REGISTRY.register(Histogram(
+    'autoscaler_evaluation_seconds', 'Duration of one evaluation of an app', ['app']))
+SCALE_DIRECTION = REGISTRY.register(Counter(
+    'autoscaler_scale_direction_total', 'scale_direction results of an app', ['app', 'direction']))
+EVALUATION_ERRORS = REGISTRY.register(Counter(
+    'autoscaler_evaluation_errors_total', 'Evaluations of an app which raised', ['app']))
+SCALE_UP_CYCLES = REGISTRY.register(Gauge(
+    'autoscaler_scale_up_cycles', 'Consecutive cycles above the max threshold', ['app']))
+COOL_DOWN_CYCLES = REGISTRY.register(Gauge(
+    'autoscaler_cool_down_cycles', 'Consecutive cycles below the min threshold', ['app']))
+SCALE_ACTIONS = REGISTRY.register(Counter(
+    'autoscaler_scale_actions_total', 'Scale requests issued to Marathon', ['app', 'direction']))
+SCALE_BATCHES = REGISTRY.register(Counter(
+    'autoscaler_scale_batches_total', 'Batched scale requests by outcome (ok, fallback to one PUT per app, failed)',
+    ['result']))
+DEPLOYMENT_SKIPS = REGISTRY.register(Counter(
+    'autoscaler_deployment_skips_total', 'Evaluations skipped because the app was being deployed', ['app']))
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    'autoscaler_upstream_request_seconds', 'HTTP request latency per upstream', ['upstream', 'status']))
+
+
+def forget_app(app):
+    """Drop the series of an app which is no longer autoscaled"""
+    REGISTRY.forget('app', app)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    registry = REGISTRY
+    routes = {}
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            content_type = 'text/plain; version=0.0.4'
+            body = self.registry.render()
+        elif url.path in self.routes:
+            content_type, body = self.routes[url.path](dict(parse_qsl(url.query)))
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger('autoscale').debug('metrics: ' + format, *args)
+
+
+def start_server(port, host='', registry=REGISTRY, routes=None):
+    """Serve the registry on http://host:port/metrics in a daemon thread.
+    routes maps extra paths to fn(query params) -> (content type, body).
+    """
+    handler = type('MetricsHandler', (_Handler,), {'registry': registry, 'routes': routes or {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
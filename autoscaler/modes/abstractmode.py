@@ -2,10 +2,23 @@ from abc import ABC, abstractmethod
 import logging
 import threading
 
+from autoscaler.prometheus import PrometheusClient
+
+
+class NoSample(ValueError):
+    """The mode has no value yet, e.g. on its first cycle: no decision is
+    taken and the evaluation is not counted as failed.
+    """
+
+
 class AbstractMode(ABC):
 
+    # Data the mode reads, among autoscaler.modes.registry AGENT_STATS,
+    # PROMETHEUS and SQS, so that a collector fetches it ahead of time
+    REQUIRES = frozenset()
+
     def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
-                 dimension=None):
+                 dimension=None, prometheus=None, options=None):
 
         super().__init__()
 
@@ -15,19 +28,75 @@ class AbstractMode(ABC):
         self.min_range = 0.0
         self.max_range = 100.0
         self.prometheus_host = prometheus_host
+        self.prometheus = prometheus
+        # mode specific settings from the app's mode_options
+        self.options = options or {}
+        # value of the last scale_direction, recorded into traces
+        self.last_value = None
+        if self.prometheus is None and prometheus_host is not None:
+            self.prometheus = PrometheusClient(prometheus_host)
         if dimension is not None:
-            if isinstance(dimension["min"], list):
-                self.min_range = dimension["min"][0]
-            else:
-                self.min_range = dimension["min"]
-
-            if isinstance(dimension["max"], list):
-                self.max_range = dimension["max"][0]
-            else:
-                self.max_range = dimension["max"]
+            self.set_dimension(dimension)
 
         self.log = logging.getLogger('autoscale')
 
+    def set_dimension(self, dimension):
+        """
+        Apply the min/max thresholds, also used to change them on a
+        running mode without losing its state.
+        """
+        if isinstance(dimension["min"], list):
+            self.min_range = dimension["min"][0]
+        else:
+            self.min_range = dimension["min"]
+
+        if isinstance(dimension["max"], list):
+            self.max_range = dimension["max"][0]
+        else:
+            self.max_range = dimension["max"]
+
+    def requirements(self):
+        """
+        Returns the data the mode reads, REQUIRES of its class unless the
+        mode delegates to other modes.
+        """
+        return self.REQUIRES
+
+    def sqs_queues(self):
+        """
+        Returns the SQS queue urls the mode will read in its next
+        evaluation, so that a collector can fetch them ahead of time.
+        """
+        return []
+
+    def prometheus_queries(self):
+        """
+        Returns the Prometheus queries the mode will run in its next
+        evaluation, so that a collector can fetch them ahead of time.
+        """
+        return []
+
+    def get_state(self):
+        """
+        Returns the history of the mode as a JSON serialisable dict, which
+        is checkpointed so that a restarted autoscaler resumes from it.
+        """
+        return {'last_value': self.last_value}
+
+    def set_state(self, state):
+        """
+        Restore the history returned by get_state.
+        """
+        self.last_value = state.get('last_value')
+
+    def desired_instances(self, instances):
+        """
+        Returns the number of instances the mode wants the app to run
+        with, given its current instance count, or None to let the
+        autoscaler apply its autoscale_multiplier.
+        """
+        return None
+
     @abstractmethod
     def scale_direction(self, value):
         """
@@ -35,15 +104,22 @@ class AbstractMode(ABC):
         is below (-1), within (0), or above (1) the threshold of
         the scaling mode.
         """
-        if value > self.max_range:
+        self.last_value = value
+        return self.direction(value, self.min_range, self.max_range)
+
+    def direction(self, value, min_range, max_range):
+        """
+        Returns (-1, 0, 1) for value against the given thresholds.
+        """
+        if value > max_range:
             self.log.debug("Scaling mode above max threshold of %s"
-                           % self.max_range)
+                           % max_range)
             return 1
-        elif value < self.min_range:
+        elif value < min_range:
             self.log.debug("Scaling mode below min threshold of %s"
-                           % self.min_range)
+                           % min_range)
             return -1
         else:
             self.log.debug("Scaling mode within thresholds (min=%s, max=%s)"
-                           % (self.min_range, self.max_range))
+                           % (min_range, max_range))
             return 0
@@ -0,0 +1,92 @@
+# encoding: utf-8
+
+"""
+@file: registry.py
+"""
+import importlib
+import logging
+import threading
+from importlib import metadata
+
+from autoscaler.modes.abstractmode import AbstractMode
+
+# 扩缩模式声明的数据需求，采集器据此批量预取
+AGENT_STATS = 'agent_stats'
+PROMETHEUS = 'prometheus'
+SQS = 'sqs'
+
+# 第三方扩缩模式的entry point组
+ENTRY_POINT_GROUP = 'marathon_autoscaler.modes'
+
+
+class ModeRegistry:
+    """Registry of the scaling modes by trigger mode. A mode is registered
+    as a class or as a 'module:Class' string imported on first use, so a
+    mode module and its dependencies (boto3 for sqs) are only loaded when
+    an app uses it. Every mode is an AbstractMode subclass constructed with
+    the keyword arguments api_client, agent_stats, prometheus_host, app,
+    dimension, prometheus and options, and declares the data it reads in
+    REQUIRES.
+
+    Third-party modes are discovered from the entry points of the
+    'marathon_autoscaler.modes' group, the entry point name being the
+    trigger mode:
+
+        [project.entry-points."marathon_autoscaler.modes"]
+        example = "example_modes:ScaleByExample"
+    """
+
+    def __init__(self, modes=None):
+        # trigger mode -> 'module:Class' 或已加载的类
+        self.modes = dict(modes or {})
+        self.lock = threading.Lock()
+        self.log = logging.getLogger('autoscale')
+
+    def register(self, name, mode):
+        """Register mode ('module:Class' or class) as trigger mode name"""
+        with self.lock:
+            self.modes[name] = mode
+
+    def discover(self, group=ENTRY_POINT_GROUP):
+        """Register the modes of the installed entry points of group. The
+        built-in modes are not overridden. Returns the names added.
+        """
+        added = []
+        for entry_point in metadata.entry_points(group=group):
+            with self.lock:
+                if entry_point.name in self.modes:
+                    self.log.warning('scaling mode %s of entry point %s ignored, already registered',
+                                     entry_point.name, entry_point.value)
+                    continue
+                self.modes[entry_point.name] = entry_point.value
+            added.append(entry_point.name)
+        if added:
+            self.log.info('discovered scaling modes %s', added)
+        return added
+
+    def load(self, name):
+        """Returns the mode class of trigger mode name, importing it on first use"""
+        mode = self.modes[name]
+        if isinstance(mode, str):
+            with self.lock:
+                mode = self.modes[name]
+                if isinstance(mode, str):
+                    module, _, attribute = mode.partition(':')
+                    mode = getattr(importlib.import_module(module), attribute)
+                    if not (isinstance(mode, type) and issubclass(mode, AbstractMode)):
+                        raise TypeError('scaling mode %s (%s) is not an AbstractMode' % (name, self.modes[name]))
+                    self.modes[name] = mode
+        return mode
+
+    def get(self, name, default=None):
+        """The registered 'module:Class' or class of name, without importing it"""
+        return self.modes.get(name, default)
+
+    def __contains__(self, name):
+        return name in self.modes
+
+    def __iter__(self):
+        return iter(list(self.modes))
+
+    def __len__(self):
+        return len(self.modes)
@@ -0,0 +1,166 @@
+# encoding: utf-8
+
+"""
+@file: scalebyforecast.py
+"""
+import base64
+import math
+import time
+from array import array
+
+from autoscaler.modes.abstractmode import AbstractMode
+from autoscaler.modes.scalebyjvm import ScaleByJvm
+from autoscaler.modes.scalebyjvmrange import ScaleByJvmRange
+from autoscaler.modes.scalemem import ScaleByMemory
+
+# 可作为预测输入的指标
+SOURCES = {
+    'mem': ScaleByMemory,
+    'jvm': ScaleByJvm,
+    'jvm_range': ScaleByJvmRange,
+}
+
+
+class Forecast:
+    """Additive Holt-Winters state of one series: level, trend per second
+    and one seasonal offset per bucket of the season, kept in a float32
+    array (288 buckets of a daily season take 1.1KB). Observations may
+    arrive at irregular intervals.
+    """
+
+    __slots__ = ('alpha', 'beta', 'gamma', 'season', 'level', 'trend', 'seasonal', 'total', 'last', 'samples')
+
+    def __init__(self, alpha=0.1, beta=0.02, gamma=0.2, season=86400, buckets=288):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.season = season
+        self.level = None
+        self.trend = 0.0
+        self.seasonal = array('f', [0.0]) * (buckets if season else 0)
+        # 季节分量之和，读取时减去均值，使季节分量不吸收水平
+        self.total = 0.0
+        self.last = None
+        self.samples = 0
+
+    def bucket(self, timestamp):
+        return int((timestamp % self.season) * len(self.seasonal) / self.season)
+
+    def seasonal_at(self, timestamp):
+        if not self.seasonal:
+            return 0.0
+        return self.seasonal[self.bucket(timestamp)] - self.total / len(self.seasonal)
+
+    def update(self, value, timestamp):
+        seasonal = self.seasonal_at(timestamp)
+        if self.level is None:
+            self.level = value - seasonal
+        elif timestamp > self.last:
+            elapsed = timestamp - self.last
+            level = self.alpha * (value - seasonal) + (1 - self.alpha) * (self.level + self.trend * elapsed)
+            self.trend = self.beta * (level - self.level) / elapsed + (1 - self.beta) * self.trend
+            self.level = level
+        else:
+            return
+        if self.seasonal:
+            bucket = self.bucket(timestamp)
+            delta = self.gamma * (value - self.level - seasonal)
+            self.seasonal[bucket] += delta
+            self.total += delta
+        self.last = timestamp
+        self.samples += 1
+
+    def get_state(self):
+        # 季节分量以float32原始字节的base64保存
+        return {'level': self.level, 'trend': self.trend, 'total': self.total, 'last': self.last,
+                'samples': self.samples, 'seasonal': base64.b64encode(self.seasonal.tobytes()).decode('ascii')}
+
+    def set_state(self, state):
+        seasonal = array('f')
+        seasonal.frombytes(base64.b64decode(state.get('seasonal', '')))
+        if len(seasonal) != len(self.seasonal):
+            # 分桶数变化，季节分量无法沿用
+            return
+        self.seasonal = seasonal
+        self.level = state.get('level')
+        self.trend = state.get('trend', 0.0)
+        self.total = state.get('total', 0.0)
+        self.last = state.get('last')
+        self.samples = state.get('samples', 0)
+
+    def predict(self, horizon):
+        """Value expected horizon seconds after the last observation"""
+        if self.level is None:
+            return None
+        timestamp = self.last + horizon
+        return max(0.0, self.level + self.trend * horizon + self.seasonal_at(timestamp))
+
+
+class ScaleByForecast(AbstractMode):
+    """Scales ahead of the load: the metric of a source mode is fed into a
+    Holt-Winters forecast (level, linear trend and seasonality) and the
+    larger of the observed value and the value forecast `horizon` seconds
+    ahead is compared with the thresholds. mode_options:
+        metric: 源指标 mem | jvm | jvm_range，默认mem
+        source_options: 源指标模式的mode_options
+        horizon: 预测提前量(秒)，默认300
+        season: 季节周期(秒)，默认86400，0表示不考虑季节性
+        buckets: 每个季节周期的分桶数，默认288
+        alpha, beta, gamma: 水平、趋势、季节的平滑系数，默认0.1, 0.02, 0.2
+        min_samples: 开始使用预测前需要的样本数，默认3
+    """
+
+    def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
+                 dimension=None, prometheus=None, options=None):
+        super().__init__(api_client, agent_stats, prometheus_host, app, dimension, prometheus, options)
+        self.source = SOURCES[self.options.get('metric', 'mem')](
+            api_client=api_client, agent_stats=agent_stats, prometheus_host=prometheus_host, app=app,
+            dimension=dimension, prometheus=prometheus, options=self.options.get('source_options'))
+        self.horizon = float(self.options.get('horizon', 300))
+        self.min_samples = int(self.options.get('min_samples', 3))
+        self.forecast = Forecast(alpha=float(self.options.get('alpha', 0.1)),
+                                 beta=float(self.options.get('beta', 0.02)),
+                                 gamma=float(self.options.get('gamma', 0.2)),
+                                 season=float(self.options.get('season', 86400)),
+                                 buckets=int(self.options.get('buckets', 288)))
+
+    def requirements(self):
+        return self.source.requirements()
+
+    def prometheus_queries(self):
+        return self.source.prometheus_queries()
+
+    def get_state(self):
+        return dict(super().get_state(), source=self.source.get_state(), forecast=self.forecast.get_state())
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.source.set_state(state.get('source') or {})
+        if state.get('forecast'):
+            self.forecast.set_state(state['forecast'])
+
+    def get_value(self, now=None):
+        observed = self.source.get_value()
+        return self.predict(observed, time.time() if now is None else now)
+
+    def predict(self, observed, now):
+        """Feed the observation into the forecast, returns the value to
+        compare with the thresholds
+        """
+        self.forecast.update(observed, now)
+        if self.forecast.samples < self.min_samples:
+            return observed
+        predicted = self.forecast.predict(self.horizon)
+        if predicted is None or math.isnan(predicted):
+            return observed
+        self.log.info("Observed %s for app %s, forecast in %ss = %s",
+                      observed, self.app.app_name if self.app is not None else None, self.horizon, predicted)
+        return max(observed, predicted)
+
+    def scale_direction(self):
+
+        try:
+            value = self.get_value()
+            return super().scale_direction(value)
+        except ValueError:
+            raise
@@ -6,13 +6,18 @@
 @time: 2020/11/23 15:04
 """
 from autoscaler.modes.abstractmode import AbstractMode
-import requests
+from autoscaler.modes.registry import PROMETHEUS
 
 class ScaleByJvm(AbstractMode):
-    PROMETHEUS_QUERY_URI = '/api/v1/query?query=sum(agent_stats_jvm_gc{application="app_name",name="heap_used"}) / sum(agent_stats_jvm_gc{application="app_name",name="heap_max"})'
+
+    REQUIRES = frozenset([PROMETHEUS])
+
     def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
-                 dimension=None):
-        super().__init__(api_client, agent_stats, prometheus_host, app, dimension)
+                 dimension=None, prometheus=None, options=None):
+        super().__init__(api_client, agent_stats, prometheus_host, app, dimension, prometheus, options)
+
+    def prometheus_queries(self):
+        return [self.prometheus.JVM_HEAP_USED_QUERY, self.prometheus.JVM_HEAP_MAX_QUERY]
 
     def get_value(self):
         try:
@@ -33,13 +38,12 @@ class ScaleByJvm(AbstractMode):
             raise
 
     def get_jvm_heap_usage(self, app_name):
-        """Calculate jvm heap usage for the app
+        """Calculate jvm heap usage for the app, looked up in the heap
+        ratios of all applications fetched once per cycle
         """
 
-        response = requests.get(self.prometheus_host + self.PROMETHEUS_QUERY_URI.replace('app_name', app_name))
-        if response.status_code == 200 :
-            jvm_heap_usage = response.json()['data']['result'][0]['value'][1]
-        else:
+        jvm_heap_usage = self.prometheus.jvm_heap_ratios().get(app_name)
+        if jvm_heap_usage is None:
             raise ValueError("failed to get jvm heap usage  from prometheus")
 
         self.log.debug("jvm heap usage  from prometheus is {}".format(jvm_heap_usage))
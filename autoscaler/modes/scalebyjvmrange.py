@@ -0,0 +1,46 @@
+# encoding: utf-8
+
+"""
+@file: scalebyjvmrange.py
+"""
+from autoscaler.modes.abstractmode import AbstractMode
+from autoscaler.modes.registry import PROMETHEUS
+from autoscaler.prometheus import aggregate
+
+
+class ScaleByJvmRange(AbstractMode):
+    """Scales on the jvm heap usage aggregated over a time window instead of
+    the instant value. mode_options:
+        window: 窗口长度(秒)，默认300
+        step: 采样步长(秒)，默认15
+        aggregation: avg | max | pNN(如p95)，默认avg
+    """
+
+    REQUIRES = frozenset([PROMETHEUS])
+
+    def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
+                 dimension=None, prometheus=None, options=None):
+        super().__init__(api_client, agent_stats, prometheus_host, app, dimension, prometheus, options)
+        self.window = float(self.options.get('window', 300))
+        self.step = float(self.options.get('step', 15))
+        self.aggregation = self.options.get('aggregation', 'avg')
+
+    def get_value(self):
+        range_window = self.prometheus.range_window(
+            self.prometheus.JVM_HEAP_RATIO_QUERY, self.step, self.window)
+        samples = range_window.samples(self.app.app_name, self.window)
+        if not samples:
+            raise ValueError("no jvm heap usage samples in prometheus for app %s" % self.app.app_name)
+
+        jvm_heap_usage = aggregate(samples, self.aggregation) * 100
+        self.log.info("%s jvm utilization over the last %ss for app %s = %s",
+                      self.aggregation, self.window, self.app.app_name, jvm_heap_usage)
+        return jvm_heap_usage
+
+    def scale_direction(self):
+
+        try:
+            value = self.get_value()
+            return super().scale_direction(value)
+        except ValueError:
+            raise
@@ -0,0 +1,214 @@
+# encoding: utf-8
+
+"""
+@file: scalebypolicy.py
+"""
+import json
+
+from autoscaler.modes.abstractmode import AbstractMode, NoSample
+
+# 规则的组合方式
+ALL = 'all'
+ANY = 'any'
+MAX = 'max'
+WEIGHTED = 'weighted'
+
+
+class Metric:
+    """One named metric of a policy: the thresholds applied to the value
+    of a source mode. Metrics with the same mode and options share the
+    source, so its value is collected once per cycle.
+    """
+
+    __slots__ = ('name', 'source', 'min_range', 'max_range')
+
+    def __init__(self, name, source, min_range=None, max_range=None):
+        self.name = name
+        self.source = source
+        # None: 使用app的min_range/max_range
+        self.min_range = min_range
+        self.max_range = max_range
+
+
+class ScaleByPolicy(AbstractMode):
+    """Composes any number of metrics with a declarative rule. Every
+    metric is a registered mode with a get_value (cpu, mem, sqs, jvm,
+    jvm_range, forecast, target or a third-party mode) and its own
+    thresholds, and the rule combines their directions. Each source is
+    evaluated once per cycle however many rules reference it. The value of
+    the policy, recorded into traces and replayed by the backtest, is the
+    weighted score in [-1, 1] for a weighted rule, otherwise the combined
+    direction. mode_options:
+        metrics: {名称: {"mode": 模式, "min": 下限, "max": 上限, "options": 该模式的mode_options}}，
+                 min/max默认为app的min_range/max_range
+        rule: 指标名称，或 {"all": [规则...]}   全部方向一致时取该方向，否则为0
+                          {"any": [规则...]}   任一为1时为1，否则任一为-1时为-1
+                          {"max": [规则...]}   方向的最大值，全部为-1时才缩容
+                          {"weighted": {名称: 权重} 或 [[规则, 权重]...], "threshold": 0.5}
+                                               方向的加权平均达到±threshold时为±1
+
+        {"metrics": {"cpu": {"mode": "cpu", "min": 20, "max": 80},
+                     "heap": {"mode": "jvm", "min": 30, "max": 85}},
+         "rule": {"any": ["cpu", "heap"]}}
+    """
+
+    def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
+                 dimension=None, prometheus=None, options=None):
+        super().__init__(api_client, agent_stats, prometheus_host, app, None, prometheus, options)
+        # 延迟导入，MODES所在模块导入时会加载本模块
+        from autoscaler.autoscaler import MODES
+
+        # (mode, options) -> 源模式实例
+        self.sources = {}
+        self.metrics = {}
+        for name, spec in (self.options.get('metrics') or {}).items():
+            if not isinstance(spec, dict) or spec.get('mode') not in MODES:
+                raise ValueError("Metric %s of the policy requires a registered mode, got %s" % (name, spec))
+            key = '%s:%s' % (spec['mode'], json.dumps(spec.get('options') or {}, sort_keys=True))
+            if key not in self.sources:
+                source = MODES.load(spec['mode'])(
+                    api_client=api_client, agent_stats=agent_stats, prometheus_host=prometheus_host, app=app,
+                    dimension=None, prometheus=self.prometheus, options=spec.get('options'))
+                if not callable(getattr(source, 'get_value', None)):
+                    raise ValueError("Mode %s of metric %s has no value to compose" % (spec['mode'], name))
+                self.sources[key] = source
+            self.metrics[name] = Metric(name, key, spec.get('min'), spec.get('max'))
+
+        self.rule = self.compile(self.options.get('rule'))
+        # 规则引用的源，未引用的指标不采集
+        self.referenced = sorted({self.metrics[name].source for name in self.rule_metrics(self.rule)})
+        if dimension is not None:
+            self.set_dimension(dimension)
+
+    def compile(self, rule):
+        """Validate rule, returns it as (operator, [(rule, weight)], threshold)
+        or the name of a metric
+        """
+        if isinstance(rule, str):
+            if rule not in self.metrics:
+                raise ValueError("Unknown metric %s in the policy rule" % rule)
+            return rule
+        if not isinstance(rule, dict):
+            raise ValueError("Invalid policy rule %r" % (rule,))
+        operators = [op for op in (ALL, ANY, MAX, WEIGHTED) if op in rule]
+        if len(operators) != 1:
+            raise ValueError("A policy rule requires exactly one of all, any, max or weighted: %r" % (rule,))
+        op = operators[0]
+        children = rule[op]
+        if op == WEIGHTED:
+            children = list(children.items()) if isinstance(children, dict) else children
+            try:
+                children = [(self.compile(child), float(weight)) for child, weight in children]
+            except (TypeError, ValueError) as e:
+                raise ValueError("Invalid weighted policy rule %r: %s" % (rule, e))
+            if not sum(abs(weight) for _, weight in children):
+                raise ValueError("The weights of a policy rule must not all be 0: %r" % (rule,))
+        else:
+            if not isinstance(children, list):
+                raise ValueError("Policy rule %s requires a list of rules: %r" % (op, rule))
+            children = [(self.compile(child), 1.0) for child in children]
+        if not children:
+            raise ValueError("Empty policy rule %r" % (rule,))
+        return op, children, float(rule.get('threshold', 0.5))
+
+    def rule_metrics(self, rule):
+        if isinstance(rule, str):
+            return {rule}
+        return set().union(*[self.rule_metrics(child) for child, _ in rule[1]])
+
+    def score(self, rule, directions):
+        """Value of rule given the direction of every metric: the weighted
+        mean of the directions of its rules for a weighted rule, otherwise
+        its direction
+        """
+        if isinstance(rule, str):
+            return directions[rule]
+        op, children, _ = rule
+        results = [self.combine(child, directions) for child, _ in children]
+        if op == ALL:
+            return results[0] if all(result == results[0] for result in results) else 0
+        if op == ANY:
+            if 1 in results:
+                return 1
+            return -1 if -1 in results else 0
+        if op == MAX:
+            return max(results)
+        return sum(result * weight for result, (_, weight) in zip(results, children)) \
+            / sum(abs(weight) for _, weight in children)
+
+    def to_direction(self, rule, score):
+        """Direction of rule given its score"""
+        if isinstance(rule, str) or rule[0] != WEIGHTED:
+            return int(score)
+        if score >= rule[2]:
+            return 1
+        if score <= -rule[2]:
+            return -1
+        return 0
+
+    def combine(self, rule, directions):
+        """Direction of rule given the direction of every metric"""
+        return self.to_direction(rule, self.score(rule, directions))
+
+    def requirements(self):
+        return frozenset().union(*[self.sources[key].requirements() for key in self.referenced])
+
+    def prometheus_queries(self):
+        return [query for key in self.referenced for query in self.sources[key].prometheus_queries()]
+
+    def sqs_queues(self):
+        return [url for key in self.referenced for url in self.sources[key].sqs_queues()]
+
+    def get_state(self):
+        return dict(super().get_state(), sources={key: source.get_state() for key, source in self.sources.items()})
+
+    def set_state(self, state):
+        super().set_state(state)
+        for key, source_state in (state.get('sources') or {}).items():
+            if key in self.sources:
+                self.sources[key].set_state(source_state)
+
+    def get_values(self):
+        """{source: value} of the sources the rule references, each read
+        once. Every source is read even when another one fails, so that
+        stateful sources (cpu, forecast) keep their history current.
+        NoSample when the only sources missing have no sample yet.
+        """
+        values = {}
+        errors = []
+        warming_up = []
+        for key in self.referenced:
+            try:
+                values[key] = self.sources[key].get_value()
+            except NoSample as e:
+                warming_up.append('%s: %s' % (key.partition(':')[0], e))
+            except ValueError as e:
+                errors.append('%s: %s' % (key.partition(':')[0], e))
+        if errors:
+            raise ValueError("Policy metrics unavailable: %s" % '; '.join(errors + warming_up))
+        if warming_up:
+            raise NoSample("Policy metrics without a sample yet: %s" % '; '.join(warming_up))
+        return values
+
+    def get_value(self):
+        """Score of the rule for the current values of the metrics"""
+        values = self.get_values()
+        directions = {}
+        for name, metric in self.metrics.items():
+            if metric.source in values:
+                value = values[metric.source]
+                min_range = self.min_range if metric.min_range is None else float(metric.min_range)
+                max_range = self.max_range if metric.max_range is None else float(metric.max_range)
+                directions[name] = self.direction(value, min_range, max_range)
+                self.log.info("Policy metric %s = %s, direction %s", name, value, directions[name])
+        return self.score(self.rule, directions)
+
+    def scale_direction(self):
+        try:
+            value = self.get_value()
+        except ValueError:
+            raise
+        self.last_value = value
+        result = self.to_direction(self.rule, value)
+        self.log.debug("Policy score = %s, direction = %s", value, result)
+        return result
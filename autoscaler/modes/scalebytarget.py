@@ -0,0 +1,88 @@
+# encoding: utf-8
+
+"""
+@file: scalebytarget.py
+"""
+import math
+
+from autoscaler.modes.abstractmode import AbstractMode
+from autoscaler.modes.scalebyforecast import SOURCES, ScaleByForecast
+
+
+class ScaleByTarget(AbstractMode):
+    """Target tracking: when the metric of the source mode leaves
+    min_range/max_range, the app is sized in one step to the instance
+    count which brings the metric back to the target utilisation,
+    desired = ceil(instances * observed / target), instead of being
+    multiplied by autoscale_multiplier. mode_options:
+        metric: 源指标 mem | jvm | jvm_range | forecast，默认mem
+        source_options: 源指标模式的mode_options
+        target: 目标使用率(%)，须介于min_range与max_range之间，默认为两者的中点
+        max_step_up: 每次扩容最多增加的实例数，默认不限
+        max_step_down: 每次缩容最多减少的实例数，默认不限
+    """
+
+    SOURCES = dict(SOURCES, forecast=ScaleByForecast)
+
+    def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
+                 dimension=None, prometheus=None, options=None):
+        super().__init__(api_client, agent_stats, prometheus_host, app, dimension, prometheus, options)
+        self.source = self.SOURCES[self.options.get('metric', 'mem')](
+            api_client=api_client, agent_stats=agent_stats, prometheus_host=prometheus_host, app=app,
+            dimension=dimension, prometheus=prometheus, options=self.options.get('source_options'))
+        self.max_step_up = int(self.options.get('max_step_up') or 0)
+        self.max_step_down = int(self.options.get('max_step_down') or 0)
+
+    def set_dimension(self, dimension):
+        """The target, by default the midpoint of the thresholds, must lie
+        strictly within the new thresholds, otherwise the thresholds are
+        left unchanged
+        """
+        min_range, max_range = self.min_range, self.max_range
+        super().set_dimension(dimension)
+        target = self.target()
+        if not self.min_range < target < self.max_range:
+            self.min_range, self.max_range = min_range, max_range
+            raise ValueError("Scale mode target requires target %s within min_range and max_range (%s, %s)"
+                             % (target, dimension['min'], dimension['max']))
+
+    def target(self):
+        if self.options.get('target') is not None:
+            return float(self.options['target'])
+        return (self.min_range + self.max_range) / 2
+
+    def requirements(self):
+        return self.source.requirements()
+
+    def prometheus_queries(self):
+        return self.source.prometheus_queries()
+
+    def get_value(self):
+        return self.source.get_value()
+
+    def get_state(self):
+        return dict(super().get_state(), source=self.source.get_state())
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.source.set_state(state.get('source') or {})
+
+    def desired_instances(self, instances):
+        if self.last_value is None or not instances:
+            return None
+        desired = math.ceil(instances * self.last_value / self.target())
+        if self.max_step_up:
+            desired = min(desired, instances + self.max_step_up)
+        if self.max_step_down:
+            desired = max(desired, instances - self.max_step_down)
+        self.log.info("Observed %s against a target of %s, desired instances %s -> %s",
+                      self.last_value, self.target(), instances, desired)
+        return desired
+
+    def scale_direction(self):
+
+        try:
+            value = self.get_value()
+            return super().scale_direction(value)
+        except ValueError:
+            raise
@@ -1,16 +1,20 @@
-import time
-
-from autoscaler.modes.abstractmode import AbstractMode
+from autoscaler.modes.abstractmode import AbstractMode, NoSample
+from autoscaler.modes.registry import AGENT_STATS
 
 
 class ScaleByCPU(AbstractMode):
 
-    def __init__(self, api_client=None, agent_stats=None, app=None,
-                 dimension=None):
-        super().__init__(api_client, agent_stats, app, dimension)
+    REQUIRES = frozenset([AGENT_STATS])
+
+    def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
+                 dimension=None, prometheus=None, options=None):
+        super().__init__(api_client, agent_stats, prometheus_host, app, dimension, prometheus, options)
+        # task -> (cpu time, timestamp) of the last snapshot seen for the task
+        self.history = {}
 
     def get_value(self):
-        """Get the approximate number of visible messages in a SQS queue
+        """Get the average CPU usage of the app's tasks since the previous
+        cycle
         """
         app_cpu_values = []
 
@@ -21,6 +25,9 @@ class ScaleByCPU(AbstractMode):
         if not app_task_dict:
             raise ValueError("No marathon app task data found for app %s" % self.app.app_name)
 
+        # Fetch the statistics of all agents of the app in parallel
+        self.agent_stats.prefetch(app_task_dict.values())
+
         try:
 
             for task, agent in app_task_dict.items():
@@ -28,10 +35,19 @@ class ScaleByCPU(AbstractMode):
 
                 # CPU usage
                 cpu_usage = self.get_cpu_usage(task, agent)
-                app_cpu_values.append(cpu_usage)
+                if cpu_usage is not None:
+                    app_cpu_values.append(cpu_usage)
 
         except ValueError:
             raise
+        finally:
+            # Forget tasks which are gone
+            for task in list(self.history.keys()):
+                if task not in app_task_dict:
+                    del self.history[task]
+
+        if not app_cpu_values:
+            raise NoSample("No previous CPU sample for the tasks of app %s yet" % self.app.app_name)
 
         # Normalized data for all tasks into a single value by averaging
         value = (sum(app_cpu_values) / len(app_cpu_values))
@@ -40,6 +56,13 @@ class ScaleByCPU(AbstractMode):
 
         return value
 
+    def get_state(self):
+        return dict(super().get_state(), history=self.history)
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.history = {task: tuple(sample) for task, sample in (state.get('history') or {}).items()}
+
     def scale_direction(self):
 
         try:
@@ -49,30 +72,29 @@ class ScaleByCPU(AbstractMode):
             raise
 
     def get_cpu_usage(self, task, agent):
-        """Compute the cpu usage per task per agent"""
-        cpu_sys_time = []
-        cpu_user_time = []
-        timestamp = []
-
-        for i in range(2):
-            task_stats = self.agent_stats.get_task_stats(agent, task, i)
-            if task_stats is not None:
-                cpu_sys_time.insert(i, float(task_stats['cpus_system_time_secs']))
-                cpu_user_time.insert(i, float(task_stats['cpus_user_time_secs']))
-                timestamp.insert(i, float(task_stats['timestamp']))
-            else:
-                cpu_sys_time.insert(i, 0.0)
-                cpu_user_time.insert(i, 0.0)
-                timestamp.insert(i, 0.0)
-            time.sleep(1)
-
-        cpu_time_delta = (cpu_sys_time[1] + cpu_user_time[1]) - (cpu_sys_time[0] + cpu_user_time[0])
-        timestamp_delta = timestamp[1] - timestamp[0]
+        """Compute the cpu usage per task per agent from the current
+        snapshot and the one seen in a previous cycle. Returns None when
+        there is no earlier sample of the task yet.
+        """
+        task_stats = self.agent_stats.get_task_stats(agent, task)
+        if task_stats is None:
+            return None
 
-        # CPU percentage usage
-        if timestamp_delta == 0:
-            raise ValueError("timestamp_delta for task {} agent {} is 0".format(task, agent))
+        cpu_time = float(task_stats['cpus_system_time_secs']) + float(task_stats['cpus_user_time_secs'])
+        timestamp = float(task_stats['timestamp'])
+
+        previous = self.history.get(task)
+        if previous is not None and timestamp <= previous[1]:
+            # Same snapshot as last cycle, wait for a newer one
+            return None
+        self.history[task] = (cpu_time, timestamp)
+        if previous is None:
+            return None
 
+        cpu_time_delta = cpu_time - previous[0]
+        timestamp_delta = timestamp - previous[1]
+
+        # CPU percentage usage
         cpu_usage = float(cpu_time_delta / timestamp_delta) * 100
 
         return cpu_usage
@@ -1,49 +1,37 @@
-import sys
-
-from autoscaler.modes.abstractmode import AbstractMode
-from autoscaler.modes.scalecpu import ScaleByCPU
-from autoscaler.modes.scalemem import ScaleByMemory
-
-
-class ScaleByCPUAndMemory(AbstractMode):
-
-    def __init__(self,  api_client=None, agent_stats=None, app=None,
-                 dimension=None):
-        super().__init__(api_client, agent_stats, app)
-        self.mode_map = {'cpu': ScaleByCPU, 'mem': ScaleByMemory}
-
-        if len(dimension['min']) < 2 or len(dimension['max']) < 2:
-            self.log.error("Scale mode AND requires two comma-delimited "
-                           "values for MIN_RANGE and MAX_RANGE.")
-            sys.exit(1)
-
-        # Instantiate the CPU/Memory mode classes
-        for idx, mode in enumerate(list(self.mode_map.keys())):
-            self.mode_map[mode] = self.mode_map[mode](
-                api_client,
-                app,
-                dimension={
-                    'min': dimension['min'][idx],
-                    'max': dimension['max'][idx]
-                }
-            )
-
-    def scale_direction(self):
-        """
-        Test CPU (x) and Memory (y) direction for equality.
-        If (x = y), return x, otherwise return 0.
-        """
-        results = []
-
-        try:
-            for mode in list(self.mode_map.keys()):
-                results.append(self.mode_map[mode].scale_direction())
-        except ValueError:
-            raise
-
-        self.log.info("CPU direction = %s, Memory direction = %s",
-                      results[0], results[1])
-        if results[0] == results[1]:
-            return results[0]
-        else:
-            return 0
+from autoscaler.modes.scalebypolicy import ALL, ScaleByPolicy
+
+
+class ScaleByCPUAndMemory(ScaleByPolicy):
+    """Policy testing CPU (x) and Memory (y) direction for equality: if
+    (x = y) the direction is x, otherwise 0. The first thresholds apply
+    to CPU, the second to Memory.
+    """
+
+    RULE = ALL
+    RULE_NAME = 'AND'
+
+    def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
+                 dimension=None, prometheus=None, options=None):
+        self.check_dimension(dimension)
+        policy = {
+            'metrics': {
+                'cpu': {'mode': 'cpu', 'min': dimension['min'][0], 'max': dimension['max'][0]},
+                'mem': {'mode': 'mem', 'min': dimension['min'][1], 'max': dimension['max'][1]}
+            },
+            'rule': {self.RULE: ['cpu', 'mem']}
+        }
+        super().__init__(api_client, agent_stats, prometheus_host, app, None, prometheus, policy)
+
+    @classmethod
+    def check_dimension(cls, dimension):
+        if dimension is None or not isinstance(dimension['min'], list) or not isinstance(dimension['max'], list) \
+                or len(dimension['min']) < 2 or len(dimension['max']) < 2:
+            raise ValueError("Scale mode %s requires two comma-delimited "
+                             "values for MIN_RANGE and MAX_RANGE." % cls.RULE_NAME)
+
+    def set_dimension(self, dimension):
+        """The first thresholds apply to CPU, the second to Memory"""
+        self.check_dimension(dimension)
+        for idx, name in enumerate(['cpu', 'mem']):
+            self.metrics[name].min_range = dimension['min'][idx]
+            self.metrics[name].max_range = dimension['max'][idx]
@@ -1,11 +1,14 @@
 from autoscaler.modes.abstractmode import AbstractMode
+from autoscaler.modes.registry import AGENT_STATS
 
 
 class ScaleByMemory(AbstractMode):
 
-    def __init__(self, api_client=None, agent_stats=None, prometheus_host= None, app=None,
-                 dimension=None):
-        super().__init__(api_client=api_client, agent_stats=agent_stats, app=app, dimension=dimension)
+    REQUIRES = frozenset([AGENT_STATS])
+
+    def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
+                 dimension=None, prometheus=None, options=None):
+        super().__init__(api_client, agent_stats, prometheus_host, app, dimension, prometheus, options)
 
     def get_value(self):
 
@@ -18,6 +21,9 @@ class ScaleByMemory(AbstractMode):
         if not app_task_dict:
             raise ValueError("No marathon app task data found for app %s" % self.app.app_name)
 
+        # Fetch the statistics of all agents of the app in parallel
+        self.agent_stats.prefetch(app_task_dict.values())
+
         try:
 
             for task, agent in app_task_dict.items():
@@ -1,49 +1,34 @@
 import os
-import sys
-import logging
-
-from boto3 import client
-from botocore.errorfactory import ClientError
 
+from autoscaler import sqs
 from autoscaler.modes.abstractmode import AbstractMode
+from autoscaler.modes.registry import SQS
 
 
 class ScaleBySQS(AbstractMode):
+    """Scales on the approximate number of visible messages of a SQS queue.
+    mode_options:
+        queue_url: 队列的完整url，默认为环境变量AS_QUEUE_URL
+    """
 
-    def __init__(self, api_client=None, agent_stats=None, app=None,
-                 dimension=None):
-        super().__init__(api_client, agent_stats, app, dimension)
+    REQUIRES = frozenset([SQS])
 
-        # Override the boto logging level to something less chatty
-        logger = logging.getLogger('botocore.vendored.requests')
-        logger.setLevel(logging.ERROR)
+    def __init__(self, api_client=None, agent_stats=None, prometheus_host=None, app=None,
+                 dimension=None, prometheus=None, options=None):
+        super().__init__(api_client, agent_stats, prometheus_host, app, dimension, prometheus, options)
 
-        # Verify environment vars for SQS config exist
-        if 'AS_QUEUE_URL' not in os.environ.keys():
-            self.log.error("AS_QUEUE_URL env var is not set.")
-            sys.exit(1)
+        # Verify the queue of the app is configured
+        self.url = self.options.get('queue_url') or os.environ.get('AS_QUEUE_URL')
+        if not self.url:
+            raise ValueError("Scale mode sqs requires mode_options.queue_url or the AS_QUEUE_URL env var")
 
-        """Boto3 will use the AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
-        and AWS_DEFAULT_REGION env vars as it's credentials
-        """
-        self.sqs = client('sqs')
-        self.url = os.environ.get('AS_QUEUE_URL')
+    def sqs_queues(self):
+        return [self.url]
 
     def get_value(self):
         """Get the approximate number of visible messages in a SQS queue
         """
-
-        try:
-
-            attributes = self.sqs.get_queue_attributes(
-                QueueUrl=self.url,
-                AttributeNames=['ApproximateNumberOfMessages']
-            )
-
-            value = float(attributes['Attributes']['ApproximateNumberOfMessages'])
-
-        except ClientError as e:
-            raise ValueError("Boto3 client error: %s", e.response)
+        value = sqs.SQS.queue_length(self.url)
 
         self.log.info("Current available messages for queue is %s", value)
 
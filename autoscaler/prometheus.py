@@ -0,0 +1,204 @@
+# encoding: utf-8
+
+"""
+@file: prometheus.py
+"""
+import bisect
+import logging
+import math
+import threading
+import time
+from urllib.parse import urlencode
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from autoscaler import http_transport
+from autoscaler.api_client import ResponseCache
+
+
+def aggregate(values, how):
+    """Aggregate a window of samples with avg, max or pNN (e.g. p95)"""
+    if numpy is not None:
+        values = numpy.asarray(values, dtype=float)
+        if how == 'avg':
+            return float(values.mean())
+        if how == 'max':
+            return float(values.max())
+        if how.startswith('p'):
+            return float(numpy.percentile(values, float(how[1:])))
+    else:
+        if how == 'avg':
+            return sum(values) / len(values)
+        if how == 'max':
+            return max(values)
+        if how.startswith('p'):
+            ordered = sorted(values)
+            rank = (len(ordered) - 1) * float(how[1:]) / 100
+            low, high = int(math.floor(rank)), int(math.ceil(rank))
+            return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+    raise ValueError("unknown aggregation %s" % how)
+
+
+class RangeWindow:
+    """Sliding window of the samples of a range query, kept per series.
+    Each update only queries the tail since the last sample fetched, so
+    overlapping windows of consecutive cycles are not fetched twice; a
+    window grown beyond the samples held is fetched in full. The query
+    runs outside the lock of the samples, one at a time.
+    """
+
+    def __init__(self, client, query, step, window, label):
+        self.client = client
+        self.query = query
+        self.step = step
+        self.window = window
+        self.label = label
+        # series label value -> ([timestamps], [values])
+        self.series = {}
+        # 已持有[start, end]区间内的全部样本
+        self.start = None
+        self.end = None
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+
+    def update(self):
+        with self.fetch_lock:
+            now = time.time()
+            with self.lock:
+                window = self.window
+                full = self.start is None or self.start > now - window + self.step
+                if not full and now - self.end < self.step:
+                    return
+                start = now - window if full else max(self.end + self.step, now - window)
+            result = self.client.query_range(self.query, start, now, self.step)
+            with self.lock:
+                self.merge(result)
+                self.end = now
+                if full:
+                    self.start = start
+                # Drop samples which fell out of the window
+                self.start = max(self.start, now - self.window)
+                for key in list(self.series.keys()):
+                    timestamps, values = self.series[key]
+                    cut = bisect.bisect_left(timestamps, now - self.window)
+                    if cut == len(timestamps):
+                        del self.series[key]
+                    elif cut:
+                        del timestamps[:cut]
+                        del values[:cut]
+
+    def merge(self, result):
+        """Add the samples of a range query result to the series"""
+        for i in result:
+            key = i['metric'].get(self.label)
+            timestamps, values = self.series.setdefault(key, ([], []))
+            fetched = [(float(ts), float(value)) for ts, value in i['values']]
+            if not timestamps or not fetched or fetched[0][0] > timestamps[-1]:
+                timestamps.extend(ts for ts, _ in fetched)
+                values.extend(value for _, value in fetched)
+                continue
+            # 完整拉取与已持有的样本重叠，按时间戳合并
+            merged = dict(zip(timestamps, values))
+            merged.update(fetched)
+            timestamps[:] = sorted(merged)
+            values[:] = [merged[ts] for ts in timestamps]
+
+    def samples(self, key, window):
+        """Values of the series within the last window seconds"""
+        self.update()
+        with self.lock:
+            timestamps, values = self.series.get(key, ([], []))
+            cut = bisect.bisect_left(timestamps, time.time() - window)
+            return values[cut:]
+
+
+class PrometheusClient:
+    """Prometheus HTTP API client shared by all modes. Query results are
+    cached for max_age seconds so that a query is issued at most once per
+    cycle, and may be stored ahead of time by a collector.
+    """
+
+    QUERY_URI = '/api/v1/query'
+    QUERY_RANGE_URI = '/api/v1/query_range'
+    JVM_HEAP_USED_QUERY = 'sum by (application) (agent_stats_jvm_gc{name="heap_used"})'
+    JVM_HEAP_MAX_QUERY = 'sum by (application) (agent_stats_jvm_gc{name="heap_max"})'
+    JVM_HEAP_RATIO_QUERY = JVM_HEAP_USED_QUERY + ' / ' + JVM_HEAP_MAX_QUERY
+
+    def __init__(self, prometheus_host, max_age=10, transport=None):
+        self.prometheus_host = prometheus_host
+        self.transport = transport
+        self.cache = ResponseCache(default_ttl=max_age)
+        self.lock = threading.Lock()
+        # (heap_used result, heap_max result, {application: ratio})
+        self.jvm_heap = (None, None, {})
+        self.windows = {}
+        self.log = logging.getLogger('autoscale')
+
+    def query_url(self, query):
+        return self.prometheus_host + self.QUERY_URI + '?' + urlencode({'query': query})
+
+    def query(self, query):
+        """Run an instant query
+        Returns:
+            the data.result list of the response
+        """
+        return self.cache.get_or_load(query, query, lambda: self._query(query))
+
+    def query_range(self, query, start, end, step):
+        """Run a range query
+        Returns:
+            the data.result matrix of the response
+        """
+        transport = self.transport or http_transport.get_transport()
+        response = transport.get(self.prometheus_host + self.QUERY_RANGE_URI, upstream='prometheus', params={
+            'query': query, 'start': start, 'end': end, 'step': step})
+        if response.status_code != 200:
+            raise ValueError("prometheus range query failed with status %s: %s" % (response.status_code, query))
+        return response.json()['data']['result']
+
+    def range_window(self, query, step, window, label='application'):
+        """Returns the RangeWindow of the query shared by all modes, grown
+        to the largest window requested
+        """
+        with self.lock:
+            range_window = self.windows.get((query, step))
+            if range_window is None:
+                range_window = self.windows[(query, step)] = RangeWindow(self, query, step, window, label)
+            range_window.window = max(range_window.window, window)
+            return range_window
+
+    def store(self, query, result):
+        """Store the result of a query fetched elsewhere"""
+        self.cache.put(query, query, result)
+
+    def _query(self, query):
+        transport = self.transport or http_transport.get_transport()
+        response = transport.get(self.query_url(query), upstream='prometheus')
+        if response.status_code != 200:
+            raise ValueError("prometheus query failed with status %s: %s" % (response.status_code, query))
+        result = response.json()['data']['result']
+        self.log.debug("prometheus query %s returned %s series", query, len(result))
+        return result, len(response.content)
+
+    def jvm_heap_ratios(self):
+        """Heap used / heap max of every application, computed from two
+        vector queries shared by all JVM apps of the cycle
+        Returns:
+            dict of application to ratio
+        """
+        used = self.query(self.JVM_HEAP_USED_QUERY)
+        limit = self.query(self.JVM_HEAP_MAX_QUERY)
+        with self.lock:
+            if self.jvm_heap[0] is used and self.jvm_heap[1] is limit:
+                return self.jvm_heap[2]
+            heap_max = {i['metric'].get('application'): float(i['value'][1]) for i in limit}
+            ratios = {}
+            for i in used:
+                application = i['metric'].get('application')
+                if heap_max.get(application):
+                    ratios[application] = float(i['value'][1]) / heap_max[application]
+            self.jvm_heap = (used, limit, ratios)
+            return ratios
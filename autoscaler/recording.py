@@ -0,0 +1,221 @@
+# encoding: utf-8
+
+"""
+@file: recording.py
+"""
+import gzip
+import logging
+import math
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 记录类型
+NAME_RECORD = b'N'
+SAMPLE_RECORD = b'S'
+# 名称记录: 名称类型, 序号, 名称字节数, 之后为utf-8编码的名称
+NAME = struct.Struct('<BIH')
+APP_NAME, METRIC_NAME = 0, 1
+# 样本记录: 时间戳, app序号, 指标序号, 指标值, 实例数
+SAMPLE = struct.Struct('<dIHff')
+
+
+class TraceRecorder:
+    """Records, for every evaluation, the value of the app's scaling metric
+    and its instance count into a gzip compressed stream of fixed size
+    binary records (~23 bytes per sample before compression). App and
+    metric names are written once per file as name records. Appending to
+    an existing file starts a new gzip member and a new name table.
+    """
+
+    def __init__(self, enabled=False, path=None, flush_interval=10):
+        self.enabled = enabled
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.file = None
+        self.buffer = bytearray()
+        self.names = ({}, {})
+        self.flushed_at = time.monotonic()
+        self.log = logging.getLogger('autoscale')
+
+    def configure(self, path, flush_interval=10):
+        self.close()
+        with self.lock:
+            self.path = path
+            self.flush_interval = flush_interval
+            self.file = gzip.open(path, 'ab')
+            self.names = ({}, {})
+            self.enabled = True
+
+    def _index(self, kind, name):
+        table = self.names[kind]
+        index = table.get(name)
+        if index is None:
+            index = table[name] = len(table)
+            encoded = name.encode('utf-8')
+            self.buffer += NAME_RECORD + NAME.pack(kind, index, len(encoded)) + encoded
+        return index
+
+    def record(self, app, metric, value, instances, timestamp=None):
+        """Record one observation of metric for app"""
+        if not self.enabled or value is None:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            if self.file is None:
+                return
+            self.buffer += SAMPLE_RECORD + SAMPLE.pack(
+                timestamp, self._index(APP_NAME, app), self._index(METRIC_NAME, metric),
+                value, instances if instances is not None else math.nan)
+            if time.monotonic() - self.flushed_at >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        try:
+            self.file.write(bytes(self.buffer))
+            self.file.flush()
+        except OSError as e:
+            self.log.error('failed to write trace %s: %s', self.path, e)
+        self.buffer = bytearray()
+        self.flushed_at = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self._flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._flush()
+                self.file.close()
+                self.file = None
+            self.enabled = False
+
+
+RECORDER = TraceRecorder()
+
+
+class Series:
+    """Samples of one metric of one app, in columnar arrays"""
+
+    def __init__(self):
+        self.timestamps = array('d')
+        self.values = array('f')
+        self.instances = array('f')
+
+
+class Trace:
+    """A recorded trace: {(app, metric): Series}"""
+
+    def __init__(self):
+        self.series = {}
+
+    def apps(self, metric=None):
+        return sorted({app for app, m in self.series if metric is None or m == metric})
+
+    def metrics(self):
+        return sorted({m for app, m in self.series})
+
+    def span(self):
+        starts = [s.timestamps[0] for s in self.series.values() if s.timestamps]
+        ends = [s.timestamps[-1] for s in self.series.values() if s.timestamps]
+        if not starts:
+            return None, None
+        return min(starts), max(ends)
+
+    def grid(self, keys, step, start=None, end=None):
+        """Align the given (app, metric) series on a grid of step seconds,
+        the last sample within a step wins and steps without a sample are
+        NaN. Returns (start, values, instances) where values and
+        instances are [len(keys), steps] numpy arrays, or lists of lists
+        without numpy.
+        """
+        span_start, span_end = self.span()
+        start = span_start if start is None else start
+        end = span_end if end is None else end
+        steps = int((end - start) // step) + 1 if start is not None else 0
+        if numpy is not None:
+            values = numpy.full((len(keys), steps), numpy.nan)
+            instances = numpy.full((len(keys), steps), numpy.nan)
+        else:
+            values = [[math.nan] * steps for _ in keys]
+            instances = [[math.nan] * steps for _ in keys]
+        for row, key in enumerate(keys):
+            series = self.series.get(key)
+            if series is None:
+                continue
+            if numpy is not None:
+                timestamps = numpy.frombuffer(series.timestamps, dtype=numpy.float64)
+                keep = (timestamps >= start) & (timestamps <= end)
+                columns = ((timestamps[keep] - start) // step).astype(int)
+                values[row, columns] = numpy.frombuffer(series.values, dtype=numpy.float32)[keep]
+                instances[row, columns] = numpy.frombuffer(series.instances, dtype=numpy.float32)[keep]
+            else:
+                for ts, value, count in zip(series.timestamps, series.values, series.instances):
+                    if start <= ts <= end:
+                        column = int((ts - start) // step)
+                        values[row][column] = value
+                        instances[row][column] = count
+        return start, values, instances
+
+
+def _read_all(path):
+    """Read the decompressed content of path, keeping what precedes a
+    truncated tail (e.g. the process was killed while writing)
+    """
+    chunks = []
+    with gzip.open(path, 'rb') as f:
+        try:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except (EOFError, zlib.error) as e:
+            logging.getLogger('autoscale').warning('trace %s is truncated: %s', path, e)
+    return b''.join(chunks)
+
+
+def load_trace(path):
+    """Load a trace written by TraceRecorder"""
+    data = _read_all(path)
+    trace = Trace()
+    names = ({}, {})
+    offset = 0
+    while offset < len(data):
+        kind = data[offset:offset + 1]
+        offset += 1
+        if kind == NAME_RECORD:
+            if offset + NAME.size > len(data):
+                break
+            name_kind, index, length = NAME.unpack_from(data, offset)
+            offset += NAME.size
+            if name_kind == APP_NAME and index == 0 and names[APP_NAME]:
+                # 追加写入开始了新的名称表
+                names = ({}, {})
+            names[name_kind][index] = data[offset:offset + length].decode('utf-8')
+            offset += length
+        elif kind == SAMPLE_RECORD:
+            if offset + SAMPLE.size > len(data):
+                break
+            timestamp, app, metric, value, instances = SAMPLE.unpack_from(data, offset)
+            offset += SAMPLE.size
+            key = (names[APP_NAME][app], names[METRIC_NAME][metric])
+            series = trace.series.get(key)
+            if series is None:
+                series = trace.series[key] = Series()
+            series.timestamps.append(timestamp)
+            series.values.append(value)
+            series.instances.append(instances)
+        else:
+            raise ValueError('corrupted trace %s at offset %s' % (path, offset - 1))
+    return trace
@@ -0,0 +1,116 @@
+# encoding: utf-8
+
+"""
+@file: scale_batch.py
+"""
+import json
+import logging
+import threading
+
+import requests
+
+from autoscaler import metrics
+
+
+class ScaleBatcher:
+    '''
+    批量下发扩缩动作，所有autoscaler共享一个实例：
+    1. autoscaler提交的扩缩动作按租户合并，同一app以最后一次提交为准
+    2. 后台线程在第一个动作提交linger秒后，每个租户以一个 PATCH /v2/apps?force=true 下发
+    3. 批量请求失败(如Marathon不支持PATCH)时逐个app PUT
+    4. 某个租户下发出错时记录日志，不影响其他租户
+    '''
+
+    MARATHON_APPS_URI = '/service/marathon/v2/apps'
+
+    def __init__(self, api_client, linger=1.0, max_batch=100, force=True):
+        """
+        :param linger: 第一个动作提交后等待合并的时间(秒)
+        :param max_batch: 单个批量请求包含的最大app数
+        :param force: 是否带force=true，使批量请求不因其中某个app被部署锁定而整体失败(409)
+        """
+        self.api_client = api_client
+        self.linger = linger
+        self.max_batch = max_batch
+        self.force = force
+        self.cond = threading.Condition()
+        # tenant -> {app_id: instances}
+        self.pending = {}
+        self.active = False
+        self.thread = None
+        self.log = logging.getLogger('autoscale')
+
+    def apps_uri(self, dcos_tenant):
+        uri = ScaleBatcher.MARATHON_APPS_URI.replace('marathon', dcos_tenant)
+        return uri + '?force=true' if self.force else uri
+
+    def submit(self, dcos_tenant, app_id, instances):
+        """Queue a scale of app_id to instances"""
+        with self.cond:
+            self.pending.setdefault(dcos_tenant, {})[app_id] = instances
+            self.cond.notify()
+
+    def start(self):
+        self.active = True
+        self.thread = threading.Thread(target=self._run, name='autoscale-scale-batcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.active = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.active and not self.pending:
+                    self.cond.wait()
+                if not self.active:
+                    return
+                # 等待linger秒，合并其他app的扩缩动作
+                self.cond.wait(self.linger)
+            try:
+                self.flush()
+            except Exception as e:
+                self.log.exception(e)
+
+    def flush(self):
+        """Send every queued scale, one request per tenant and max_batch apps"""
+        with self.cond:
+            pending, self.pending = self.pending, {}
+        for dcos_tenant, actions in pending.items():
+            updates = [{'id': app_id, 'instances': instances} for app_id, instances in actions.items()]
+            for i in range(0, len(updates), self.max_batch):
+                batch = updates[i:i + self.max_batch]
+                try:
+                    self._send(dcos_tenant, batch)
+                except Exception as e:
+                    metrics.SCALE_BATCHES.inc('failed')
+                    self.log.error("scale of apps %s of tenant %s failed: %s",
+                                   [update['id'] for update in batch], dcos_tenant, e)
+
+    def _send(self, dcos_tenant, updates):
+        try:
+            response = self.api_client.dcos_rest("patch", self.apps_uri(dcos_tenant), data=json.dumps(updates))
+            metrics.SCALE_BATCHES.inc('ok')
+            self.log.info("scaled %s apps of tenant %s in one request, deployment %s",
+                          len(updates), dcos_tenant, response.get('deploymentId'))
+            return
+        except requests.exceptions.RequestException as e:
+            self.log.warning("batched scale of %s apps of tenant %s failed (%s), scaling them one by one",
+                             len(updates), dcos_tenant, e)
+            metrics.SCALE_BATCHES.inc('fallback')
+        uri = ScaleBatcher.MARATHON_APPS_URI.replace('marathon', dcos_tenant)
+        for update in updates:
+            try:
+                self.api_client.dcos_rest(
+                    "put",
+                    uri + update['id'] + ('?force=true' if self.force else ''),
+                    data=json.dumps({'instances': update['instances']})
+                )
+            except requests.exceptions.RequestException as e:
+                self.log.error("scale of %s%s to %s instances failed: %s",
+                               dcos_tenant, update['id'], update['instances'], e)
@@ -0,0 +1,101 @@
+# encoding: utf-8
+
+"""
+@file: scale_down.py
+"""
+import logging
+import threading
+import time
+
+
+class ScaleDownGuard:
+    '''
+    缩容保护，所有autoscaler共享一个实例：
+    1. 稳定窗口：app持续低于缩容阈值window秒，且距上次扩缩动作超过window秒后才缩容
+    2. 单次最大步长：每次缩容最多减少max_step个实例
+    3. 全局并发预算：同时进行中的缩容最多max_concurrent个，app的部署完成后释放。
+       多副本部署时预算由share按集群视图在副本间分配，各副本之和为max_concurrent，
+       余数的名额每deployment_timeout秒在副本间轮转
+    4. app有进行中的Marathon部署时不缩容
+    '''
+
+    def __init__(self, enabled=True, window=300, max_step=1, max_concurrent=5, deployment_timeout=600):
+        """
+        :param enabled: 为False时只告警不缩容
+        :param window: 稳定窗口(秒)
+        :param max_step: 每次缩容最多减少的实例数，0为不限
+        :param max_concurrent: 同时进行中的缩容数上限，0为不限
+        :param deployment_timeout: 缩容占用预算的最长时间(秒)，超时后即使部署未完成也释放
+        """
+        self.enabled = enabled
+        self.window = window
+        self.max_step = max_step
+        self.max_concurrent = max_concurrent
+        #本副本的并发缩容预算
+        self.budget = max_concurrent
+        #本副本在集群视图中的位置及副本数
+        self.index = 0
+        self.replicas = 1
+        self.deployment_timeout = deployment_timeout
+        self.lock = threading.Lock()
+        # app key -> 开始缩容的时间
+        self.in_flight = {}
+        self.log = logging.getLogger('autoscale')
+
+    def limit(self, app_instances, target_instances):
+        """Apply the maximum step to a scale-down target"""
+        if self.max_step:
+            return max(target_instances, app_instances - self.max_step)
+        return target_instances
+
+    def share(self, index, replicas):
+        """Take the share of the max_concurrent budget of the replica at
+        index among replicas: the budget is split evenly, so that the
+        replicas together never exceed it, and the slots of the remainder
+        rotate over the replicas every deployment_timeout seconds. With
+        more replicas than max_concurrent every replica gets a slot in
+        turn.
+        """
+        with self.lock:
+            self.index = index
+            self.replicas = max(1, replicas)
+            self._share(time.time())
+
+    def _share(self, now):
+        if not self.max_concurrent:
+            return
+        remainder = self.max_concurrent % self.replicas
+        #各副本按墙钟计算同一轮次，无需协调
+        turn = int(now // max(1, self.deployment_timeout))
+        budget = self.max_concurrent // self.replicas \
+            + (1 if (self.index - turn * remainder) % self.replicas < remainder else 0)
+        if budget != self.budget:
+            self.log.info('scale down budget %s of %s shared by %s replicas',
+                          budget, self.max_concurrent, self.replicas)
+        self.budget = budget
+
+    def _expire(self, now):
+        for key, started in list(self.in_flight.items()):
+            if now - started >= self.deployment_timeout:
+                self.log.warning('scale down of %s still in flight after %ss, releasing its budget', key, now - started)
+                del self.in_flight[key]
+
+    def acquire(self, key):
+        """Take a slot of the concurrency budget for a scale-down of key.
+        Returns False when the budget is exhausted.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            self._share(time.time())
+            if key not in self.in_flight and self.max_concurrent and len(self.in_flight) >= self.budget:
+                return False
+            self.in_flight[key] = now
+            return True
+
+    def holds(self, key):
+        return key in self.in_flight
+
+    def release(self, key):
+        with self.lock:
+            self.in_flight.pop(key, None)
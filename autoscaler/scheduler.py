@@ -0,0 +1,155 @@
+# encoding: utf-8
+
+"""
+@file: scheduler.py
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Job:
+
+    def __init__(self, key, autoscaler, interval):
+        self.key = key
+        self.autoscaler = autoscaler
+        self.interval = interval
+        #同一个app同一时刻只允许一个评估在执行
+        self.running = False
+        self.removed = False
+
+
+class Scheduler:
+    """Central evaluation scheduler. All Autoscaler evaluations are kept in
+    a heap keyed by their next due time and dispatched by a single thread
+    onto a bounded worker pool, so the number of threads depends on the
+    pool size and not on the number of apps.
+    """
+
+    def __init__(self, workers=16, jitter=0.0, default_interval=20):
+        """
+        :param workers: 工作线程数
+        :param jitter: 每次调度在interval上叠加的随机抖动比例(0.1即±10%)
+        :param default_interval: app未配置interval时使用的评估周期(秒)
+        """
+        self.workers = int(workers)
+        self.jitter = float(jitter)
+        self.default_interval = default_interval
+        self.log = logging.getLogger('autoscale')
+
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='autoscale-worker')
+        self._dispatcher = None
+        self._active = False
+        #正在执行评估的工作线程数
+        self.busy = 0
+
+    def _next_delay(self, interval):
+        if self.jitter <= 0:
+            return interval
+        return max(0.0, interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _push(self, job, delay):
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job))
+        self._cond.notify()
+
+    def add(self, key, autoscaler, interval=None, delay=None):
+        """Register an Autoscaler. The first evaluation runs after `delay`
+        seconds, or at a random point within its interval when not given,
+        so that a large fleet does not wake up at the same moment.
+        """
+        interval = interval or self.default_interval
+        job = _Job(key, autoscaler, interval)
+        if delay is None:
+            delay = random.uniform(0, interval)
+        with self._cond:
+            old = self._jobs.get(key)
+            if old is not None:
+                old.removed = True
+            self._jobs[key] = job
+            self._push(job, delay)
+
+    def remove(self, key):
+        """Unregister the Autoscaler; an evaluation already in flight is
+        allowed to finish but will not be rescheduled.
+        """
+        with self._cond:
+            job = self._jobs.pop(key, None)
+            if job is None:
+                return None
+            job.removed = True
+        job.autoscaler.terminal()
+        return job.autoscaler
+
+    def set_interval(self, key, interval):
+        """Change the interval of a registered Autoscaler, effective from
+        its next evaluation
+        """
+        with self._cond:
+            job = self._jobs.get(key)
+            if job is not None:
+                job.interval = interval or self.default_interval
+
+    def get(self, key):
+        job = self._jobs.get(key)
+        return job.autoscaler if job is not None else None
+
+    def keys(self):
+        return list(self._jobs.keys())
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def start(self):
+        self._active = True
+        self._dispatcher = threading.Thread(target=self._dispatch, name='autoscale-scheduler', daemon=True)
+        self._dispatcher.start()
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._active = False
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait)
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while self._active and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if not self._active:
+                    return
+                _, _, job = heapq.heappop(self._heap)
+                if job.removed:
+                    continue
+                if job.running:
+                    #上一次评估尚未结束，顺延一个周期
+                    self.log.warning('evaluation of %s overran its interval %ss', job.key, job.interval)
+                    self._push(job, self._next_delay(job.interval))
+                    continue
+                job.running = True
+            self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        started = time.monotonic()
+        with self._cond:
+            self.busy += 1
+        try:
+            job.autoscaler.evaluate()
+        except Exception as e:
+            job.autoscaler.log.exception(e)
+        finally:
+            with self._cond:
+                self.busy -= 1
+                job.running = False
+                if not job.removed and self._active:
+                    elapsed = time.monotonic() - started
+                    self._push(job, max(0.0, self._next_delay(job.interval) - elapsed))
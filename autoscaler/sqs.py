@@ -0,0 +1,89 @@
+# encoding: utf-8
+
+"""
+@file: sqs.py
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class SqsClient:
+    """Approximate number of visible messages of SQS queues, shared by all
+    sqs mode autoscalers. Each queue is read at most once per max_age
+    seconds and several queues can be fetched in parallel by a collector.
+    boto3 is imported, and its client created, on first use; it reads its
+    credentials from AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and
+    AWS_DEFAULT_REGION.
+    """
+
+    def __init__(self, max_age=None, workers=8):
+        """
+        :param max_age: 队列长度的有效期(秒)，为None时每次都查询
+        :param workers: 并行查询队列的线程数
+        """
+        self.max_age = max_age
+        self.workers = workers
+        self.client = None
+        # queue url -> (fetched_at, 消息数)
+        self.lengths = {}
+        self.lock = threading.Lock()
+        self.executor = None
+        self.log = logging.getLogger('autoscale')
+
+    def configure(self, max_age=None, workers=8):
+        self.max_age = max_age
+        self.workers = workers
+
+    def _client(self):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    from boto3 import client
+                    # Override the boto logging level to something less chatty
+                    logging.getLogger('botocore.vendored.requests').setLevel(logging.ERROR)
+                    self.client = client('sqs')
+        return self.client
+
+    def _cached(self, url):
+        entry = self.lengths.get(url)
+        if entry is None or self.max_age is None or time.monotonic() - entry[0] >= self.max_age:
+            return None
+        return entry[1]
+
+    def queue_length(self, url):
+        """Approximate number of visible messages of the queue"""
+        value = self._cached(url)
+        if value is not None:
+            return value
+        from botocore.exceptions import ClientError
+        try:
+            attributes = self._client().get_queue_attributes(
+                QueueUrl=url,
+                AttributeNames=['ApproximateNumberOfMessages']
+            )
+        except ClientError as e:
+            raise ValueError("Boto3 client error: %s" % e.response)
+        value = float(attributes['Attributes']['ApproximateNumberOfMessages'])
+        with self.lock:
+            self.lengths[url] = (time.monotonic(), value)
+        return value
+
+    def prefetch(self, urls):
+        """Fetch the lengths of the given queues in parallel"""
+        missing = [url for url in set(urls) if self._cached(url) is None]
+        if not missing:
+            return
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sqs')
+        futures = [self.executor.submit(self.queue_length, url) for url in missing]
+        wait(futures)
+        for future in futures:
+            if future.exception() is not None:
+                self.log.error("failed to prefetch sqs queue length: %s", future.exception())
+
+
+SQS = SqsClient()
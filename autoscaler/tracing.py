@@ -0,0 +1,157 @@
+# encoding: utf-8
+
+"""
+@file: tracing.py
+"""
+import cProfile
+import json
+import logging
+import os
+import re
+import signal
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Tracer:
+    """Opt-in timing of the stages of an evaluation (app_exists,
+    get_app_details, get_task_stats, get_value, autoscale, scale_app).
+    The last sample_size durations of every stage are kept to compute
+    percentiles, together with the slowest app seen per stage. A single
+    evaluation of an app can be profiled with cProfile on request.
+    """
+
+    def __init__(self, enabled=False, sample_size=1024, profile_dir='.'):
+        self.enabled = enabled
+        self.sample_size = sample_size
+        self.profile_dir = profile_dir
+        self.lock = threading.Lock()
+        # stage -> deque of durations
+        self.samples = {}
+        # stage -> (duration, app)
+        self.slowest = {}
+        self.profile_requests = set()
+        self.local = threading.local()
+        self.log = logging.getLogger('autoscale')
+
+    def configure(self, enabled=True, sample_size=1024, profile_dir='.'):
+        with self.lock:
+            self.enabled = enabled
+            self.sample_size = sample_size
+            self.profile_dir = profile_dir
+            self.samples = {}
+            self.slowest = {}
+
+    def record(self, stage, seconds):
+        app = getattr(self.local, 'app', None)
+        with self.lock:
+            samples = self.samples.get(stage)
+            if samples is None:
+                samples = self.samples[stage] = deque(maxlen=self.sample_size)
+            samples.append(seconds)
+            if seconds > self.slowest.get(stage, (0, None))[0]:
+                self.slowest[stage] = (seconds, app)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    @contextmanager
+    def evaluation(self, app):
+        """Wraps one evaluation of app: attributes stage timings to it and
+        profiles it if a profile was requested
+        """
+        self.local.app = app
+        profiler = None
+        if app in self.profile_requests:
+            self.profile_requests.discard(app)
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            yield
+        finally:
+            self.local.app = None
+            if profiler is not None:
+                profiler.disable()
+                path = os.path.join(self.profile_dir, '%s-%d.pstats' % (
+                    re.sub(r'[^\w.-]', '_', app).strip('_'), int(time.time())))
+                profiler.dump_stats(path)
+                self.log.warning('profile of %s written to %s', app, path)
+
+    def request_profile(self, app):
+        """Profile the next evaluation of app"""
+        self.profile_requests.add(app)
+
+    def percentiles(self):
+        """Returns {stage: {count, p50, p95, p99, max, slowest_app}}"""
+        with self.lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+            slowest = dict(self.slowest)
+        result = {}
+        for stage, values in samples.items():
+            if not values:
+                continue
+            pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+            result[stage] = {
+                'count': len(values),
+                'p50': pick(0.5),
+                'p95': pick(0.95),
+                'p99': pick(0.99),
+                'max': values[-1],
+                'slowest_app': slowest.get(stage, (0, None))[1],
+            }
+        return result
+
+    def log_percentiles(self):
+        for stage, stats in sorted(self.percentiles().items()):
+            self.log.info('stage %s: %s', stage, json.dumps(stats, ensure_ascii=False))
+
+    def profile_slowest(self):
+        """Profile the next evaluation of the app with the slowest
+        evaluation recorded so far
+        """
+        app = self.slowest.get('evaluate', (0, None))[1]
+        if app is not None:
+            self.request_profile(app)
+            self.log.warning('profiling the next evaluation of %s', app)
+
+    def install_signal_handlers(self):
+        """SIGUSR1 logs the stage percentiles, SIGUSR2 profiles the next
+        evaluation of the slowest app
+        """
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.log_percentiles())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.profile_slowest())
+
+    def http_routes(self):
+        """Debug routes for the metrics server: /debug/stages returns the
+        percentiles, /debug/profile?app=<dcos_tenant + id> profiles the next
+        evaluation of the app
+        """
+        def stages(params):
+            return 'application/json', json.dumps(self.percentiles(), ensure_ascii=False)
+
+        def profile(params):
+            app = params.get('app')
+            if not app:
+                return 'text/plain', 'missing app parameter\n'
+            self.request_profile(app)
+            return 'text/plain', 'profiling the next evaluation of %s into %s\n' % (app, self.profile_dir)
+
+        return {'/debug/stages': stages, '/debug/profile': profile}
+
+
+TRACER = Tracer()
+
+
+def stage(name):
+    """Time a stage of the current evaluation with the process wide tracer"""
+    return TRACER.stage(name)
@@ -0,0 +1,359 @@
+# encoding: utf-8
+
+"""
+@file: fake_dcos.py
+
+Local stand-in for DC/OS (Marathon of every tenant), the Mesos agents and
+Prometheus, serving a synthetic fleet. Run it on its own with
+
+    python -m benchmarks.fake_dcos --apps 1000 --tasks 3 --agents 100 --port 8080
+
+or let run_benchmark start it in a child process.
+"""
+import argparse
+import json
+import math
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+APPS_URI = re.compile(r'^/service/(?P<tenant>[^/]+)/v2/apps/?$')
+DEPLOYMENTS_URI = re.compile(r'^/service/(?P<tenant>[^/]+)/v2/deployments/?$')
+APP_URI = re.compile(r'^/service/(?P<tenant>[^/]+)/v2/apps(?P<app_id>/.+)$')
+AGENT_STATS_URI = re.compile(r'^/slave/(?P<agent>[^/]+)/monitor/statistics$')
+
+MEM_LIMIT_BYTES = 1024 * 1024 * 1024
+HEAP_MAX_BYTES = 512 * 1024 * 1024
+CPUS_LIMIT = 1.0
+
+
+class FakeFleet:
+    """Synthetic fleet of apps x tasks x agents spread over tenants.
+
+    Every app has a load level in [0, 1) derived from its index, which
+    drives its memory, cpu and jvm heap usage, so that with the default
+    50/80 thresholds some apps are below, within and above range. Load
+    drifts slowly with time so that consecutive cycles see different
+    values, and cpu counters advance with wall clock time.
+    """
+
+    def __init__(self, apps=100, tasks=3, agents=10, tenants=1, prefix='/bench', deployment_seconds=0.0):
+        self.started = time.time()
+        # 扩缩后app的部署持续的秒数
+        self.deployment_seconds = deployment_seconds
+        # (tenant, app_id) -> (部署结束时间, 部署id)
+        self.deploying = {}
+        self.lock = threading.Lock()
+        self.tenants = ['tenant-%d' % i for i in range(tenants)]
+        self.agents = ['agent-%d' % i for i in range(agents)]
+        # tenant -> {app_id: app document}
+        self.apps = {tenant: {} for tenant in self.tenants}
+        # agent -> [(executor_id, app index)]
+        self.executors = {agent: [] for agent in self.agents}
+        self.loads = []
+        for i in range(apps):
+            tenant = self.tenants[i % tenants]
+            app_id = '%s/app-%d' % (prefix, i)
+            self.loads.append((i * 0.37) % 1)
+            app_tasks = []
+            for j in range(tasks):
+                agent = self.agents[(i * tasks + j) % agents]
+                task_id = 'bench_app-%d.%08x-%d' % (i, i, j)
+                app_tasks.append({'id': task_id, 'host': agent + '.local', 'slaveId': agent,
+                                  'appId': app_id, 'state': 'TASK_RUNNING'})
+                self.executors[agent].append((task_id, i))
+            self.apps[tenant][app_id] = {
+                'id': app_id,
+                'instances': tasks,
+                'cpus': CPUS_LIMIT,
+                'mem': MEM_LIMIT_BYTES // (1024 * 1024),
+                'env': {'APP_NAME': 'app-%d' % i},
+                'tasks': app_tasks,
+                'deployments': [],
+            }
+
+    def load(self, index, now=None):
+        """Load level of the app at time now"""
+        now = time.time() if now is None else now
+        return min(0.99, max(0.0, self.loads[index] + 0.05 * math.sin((now - self.started) / 60 + index)))
+
+    def configs(self, trigger_mode='mem', interval=None, mode_options=None):
+        """The payload of the autoscale config api for the whole fleet"""
+        marathon_apps = []
+        for tenant in self.tenants:
+            for app in self.apps[tenant].values():
+                config = {
+                    'dcos_tenant': tenant,
+                    'id': app['id'],
+                    'trigger_mode': trigger_mode,
+                    'autoscale_multiplier': 1.5,
+                    'min_instances': 1,
+                    'max_instances': app['instances'] * 4,
+                    'cool_down_factor': 3,
+                    'scale_up_factor': 3,
+                    # and/or 模式的两组阈值分别作用于cpu与内存
+                    'min_range': [50, 50] if trigger_mode in ('and', 'or') else [50],
+                    'max_range': [80, 80] if trigger_mode in ('and', 'or') else [80],
+                    'log_level': 'INFO',
+                    'alarm_key': 'bench',
+                }
+                if interval is not None:
+                    config['interval'] = interval
+                if mode_options:
+                    config['mode_options'] = mode_options
+                marathon_apps.append(config)
+        return {'data': {'marathon_apps': marathon_apps}}
+
+    def _finish_deployments(self):
+        now = time.time()
+        for (tenant, app_id), (until, _) in list(self.deploying.items()):
+            if now >= until:
+                self.apps[tenant][app_id]['deployments'] = []
+                del self.deploying[(tenant, app_id)]
+
+    def apps_response(self, tenant):
+        with self.lock:
+            self._finish_deployments()
+            return {'apps': list(self.apps[tenant].values())}
+
+    def deployments_response(self, tenant):
+        with self.lock:
+            self._finish_deployments()
+            deployments = {}
+            for (app_tenant, app_id), (_, deployment_id) in self.deploying.items():
+                if app_tenant == tenant:
+                    deployments.setdefault(deployment_id, []).append(app_id)
+        return [{'id': deployment_id, 'affectedApps': app_ids, 'currentStep': 1, 'totalSteps': 1}
+                for deployment_id, app_ids in deployments.items()]
+
+    def app_response(self, tenant, app_id):
+        app = self.apps.get(tenant, {}).get(app_id)
+        return None if app is None else {'app': app}
+
+    def scale(self, tenant, app_id, instances):
+        return self.scale_many(tenant, [{'id': app_id, 'instances': instances}])
+
+    def scale_many(self, tenant, updates):
+        """Apply [{id, instances}] in one deployment, None if an app is unknown"""
+        with self.lock:
+            apps = [self.apps.get(tenant, {}).get(update.get('id')) for update in updates]
+            if any(app is None for app in apps):
+                return None
+            deployment_id = '%08x' % (hash((tenant, len(updates), time.time())) & 0xffffffff)
+            for app, update in zip(apps, updates):
+                app['instances'] = update['instances']
+                if self.deployment_seconds:
+                    app['deployments'] = [{'id': deployment_id}]
+                    self.deploying[(tenant, app['id'])] = (time.time() + self.deployment_seconds, deployment_id)
+        return {'version': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+                'deploymentId': deployment_id}
+
+    def agent_statistics(self, agent):
+        """A /monitor/statistics response, see
+        marathon_definitions/autoscale_examples/sample-mesos-statistics.json
+        """
+        now = time.time()
+        elapsed = now - self.started
+        result = []
+        for executor_id, index in self.executors.get(agent, []):
+            load = self.load(index, now)
+            cpu_secs = 100 + elapsed * CPUS_LIMIT * load
+            mem_rss_bytes = int(MEM_LIMIT_BYTES * load)
+            result.append({
+                'executor_id': executor_id,
+                'executor_name': 'Command Executor (Task: %s)' % executor_id,
+                'framework_id': 'bench-framework-0000',
+                'source': executor_id,
+                'statistics': {
+                    'cpus_limit': CPUS_LIMIT,
+                    'cpus_system_time_secs': round(cpu_secs * 0.2, 3),
+                    'cpus_user_time_secs': round(cpu_secs * 0.8, 3),
+                    'mem_anon_bytes': mem_rss_bytes,
+                    'mem_limit_bytes': MEM_LIMIT_BYTES,
+                    'mem_rss_bytes': mem_rss_bytes,
+                    'mem_total_bytes': mem_rss_bytes,
+                    'timestamp': now,
+                }
+            })
+        return result
+
+    def heap(self, index, name, now):
+        if name == 'heap_max':
+            return HEAP_MAX_BYTES
+        return HEAP_MAX_BYTES * self.load(index, now)
+
+    def prometheus_query(self, query):
+        """Instant vector of the jvm heap queries, one series per application"""
+        now = time.time()
+        if 'heap_used' in query and 'heap_max' in query:
+            name = 'ratio'
+        elif 'heap_used' in query:
+            name = 'heap_used'
+        elif 'heap_max' in query:
+            name = 'heap_max'
+        else:
+            return []
+        result = []
+        for index in range(len(self.loads)):
+            value = self.load(index, now) if name == 'ratio' else self.heap(index, name, now)
+            result.append({'metric': {'application': 'app-%d' % index}, 'value': [now, str(value)]})
+        return result
+
+    def prometheus_query_range(self, query, start, end, step):
+        """Range matrix of the jvm heap ratio query"""
+        if 'heap_used' not in query:
+            return []
+        timestamps = []
+        ts = start
+        while ts <= end:
+            timestamps.append(ts)
+            ts += step
+        result = []
+        for index in range(len(self.loads)):
+            result.append({'metric': {'application': 'app-%d' % index},
+                           'values': [[ts, str(self.load(index, ts))] for ts in timestamps]})
+        return result
+
+
+class RequestCounter:
+    """Thread safe count of the requests served, per category"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def inc(self, category):
+        with self.lock:
+            self.counts[category] = self.counts.get(category, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    fleet = None
+    counter = None
+    latency = 0.0
+
+    def _reply(self, category, body, status=200):
+        if category is not None:
+            self.counter.inc(category)
+        if self.latency:
+            time.sleep(self.latency)
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        match = APPS_URI.match(url.path)
+        if match:
+            if match.group('tenant') not in self.fleet.apps:
+                return self._reply('marathon_apps', {'message': 'not found'}, 404)
+            return self._reply('marathon_apps', self.fleet.apps_response(match.group('tenant')))
+        match = DEPLOYMENTS_URI.match(url.path)
+        if match:
+            return self._reply('marathon_deployments', self.fleet.deployments_response(match.group('tenant')))
+        match = APP_URI.match(url.path)
+        if match:
+            app = self.fleet.app_response(match.group('tenant'), match.group('app_id'))
+            return self._reply('marathon_app', app, 200 if app is not None else 404)
+        match = AGENT_STATS_URI.match(url.path)
+        if match:
+            return self._reply('agent_stats', self.fleet.agent_statistics(match.group('agent')))
+        if url.path == '/api/v1/query':
+            return self._reply('prometheus_query', {'status': 'success', 'data': {
+                'resultType': 'vector', 'result': self.fleet.prometheus_query(params.get('query', ''))}})
+        if url.path == '/api/v1/query_range':
+            return self._reply('prometheus_query_range', {'status': 'success', 'data': {
+                'resultType': 'matrix', 'result': self.fleet.prometheus_query_range(
+                    params.get('query', ''), float(params['start']), float(params['end']),
+                    float(params['step']))}})
+        if url.path == '/ca/dcos-ca.crt':
+            return self._reply('auth', None)
+        if url.path == '/_bench/requests':
+            return self._reply(None, self.counter.snapshot())
+        self._reply('unknown', {'message': 'not found'}, 404)
+
+    def do_PUT(self):
+        url = urlsplit(self.path)
+        match = APP_URI.match(url.path)
+        body = self._body()
+        if not match:
+            return self._reply('unknown', {'message': 'not found'}, 404)
+        instances = json.loads(body or b'{}').get('instances')
+        result = self.fleet.scale(match.group('tenant'), match.group('app_id'), instances)
+        self._reply('marathon_scale', result, 200 if result is not None else 404)
+
+    def do_PATCH(self):
+        url = urlsplit(self.path)
+        match = APPS_URI.match(url.path)
+        body = self._body()
+        if not match:
+            return self._reply('unknown', {'message': 'not found'}, 404)
+        result = self.fleet.scale_many(match.group('tenant'), json.loads(body or b'[]'))
+        self._reply('marathon_scale_batch', result, 200 if result is not None else 404)
+
+    def do_POST(self):
+        self._body()
+        self._reply('alarm', {'code': 0})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(fleet, port=0, host='127.0.0.1', latency=0.0):
+    """Serve the fleet in a daemon thread
+    Returns:
+        (server, RequestCounter)
+    """
+    counter = RequestCounter()
+    handler = type('FakeDcosHandler', (_Handler,), {'fleet': fleet, 'counter': counter, 'latency': latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, name='fake-dcos', daemon=True).start()
+    return server, counter
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='fake DC/OS, Mesos agent and Prometheus server')
+    parser.add_argument('--apps', type=int, default=100)
+    parser.add_argument('--tasks', type=int, default=3, help='tasks per app')
+    parser.add_argument('--agents', type=int, default=10)
+    parser.add_argument('--tenants', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--deployment-seconds', type=float, default=0.0,
+                        help='seconds a deployment stays in progress after a scale')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    fleet = FakeFleet(args.apps, args.tasks, args.agents, args.tenants,
+                      deployment_seconds=args.deployment_seconds)
+    server, counter = start_server(fleet, args.port, args.host, args.latency)
+    # 父进程从第一行读取监听端口
+    print(server.server_address[1], flush=True)
+    try:
+        # 读到stdin关闭(父进程退出)时停止
+        sys.stdin.read()
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
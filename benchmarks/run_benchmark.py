@@ -0,0 +1,332 @@
+# encoding: utf-8
+
+"""
+@file: run_benchmark.py
+
+Benchmark of the autoscaler against a local fake DC/OS / Mesos /
+Prometheus (benchmarks/fake_dcos.py) serving a synthetic fleet. It builds
+every Autoscaler through the same reconciliation as marathon_autoscaler,
+then runs evaluation cycles in which every app is evaluated once, and
+reports per cycle latency, requests per upstream, memory and CPU.
+
+    python -m benchmarks.run_benchmark --apps 1000 --tasks 3 --agents 100 --cycles 5
+    python -m benchmarks.run_benchmark --engine asyncio --mode jvm --json result.json
+    python -m benchmarks.run_benchmark --baseline result.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import marathon_autoscaler
+from autoscaler import autoscaler
+from autoscaler import http_transport
+from autoscaler import recording
+from autoscaler.agent_stats import AgentStats
+from autoscaler.api_client import APIClient, ResponseCache
+from autoscaler.app import AppsSnapshotService
+from autoscaler.prometheus import PrometheusClient
+from autoscaler.scale_down import ScaleDownGuard
+from autoscaler.scale_batch import ScaleBatcher
+from autoscaler.scheduler import Scheduler
+from benchmarks.fake_dcos import FakeFleet
+
+# 基准测试中显式过期共享数据，各有效期设为足够大
+MAX_AGE = 3600
+
+
+def start_fake(args):
+    """Start fake_dcos in a child process so that its work is not counted
+    in the CPU and memory of the benchmark
+    Returns:
+        (process, base url)
+    """
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.fake_dcos',
+         '--apps', str(args.apps), '--tasks', str(args.tasks), '--agents', str(args.agents),
+         '--tenants', str(args.tenants), '--latency', str(args.latency),
+         '--deployment-seconds', str(args.deployment_seconds)],
+        cwd=REPO_ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    port = int(process.stdout.readline())
+    return process, 'http://127.0.0.1:%d' % port
+
+
+def server_requests(url):
+    return requests.get(url + '/_bench/requests').json()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def expire(api_client, snapshots, agent_stats, prometheus):
+    """Start a new cycle: everything shared between apps is fetched again"""
+    for snapshot in list(snapshots.snapshots.values()):
+        snapshot.fetched_at = None
+    agent_stats.reset()
+    api_client.cache.clear()
+    prometheus.cache.clear()
+
+
+def mode_options(args):
+    if args.mode == 'jvm_range':
+        return {'window': args.window, 'step': args.step, 'aggregation': 'p95'}
+    if args.mode == 'policy':
+        # mem is referenced by two rules and collected once
+        return {'metrics': {'cpu': {'mode': 'cpu'}, 'mem': {'mode': 'mem'}, 'heap': {'mode': 'jvm'}},
+                'rule': {'any': [{'all': ['cpu', 'mem']}, {'weighted': {'mem': 1, 'heap': 1}}]}}
+    return None
+
+
+def churn(configs, ratio):
+    """Modify the thresholds of ratio of the apps and replace ratio / 2 of
+    them by new apps
+    """
+    apps = [dict(app) for app in configs['data']['marathon_apps']]
+    changed = int(len(apps) * ratio)
+    for app in apps[:changed]:
+        app['max_range'] = [85] * len(app['max_range'])
+    replaced = changed // 2
+    for i, app in enumerate(apps[len(apps) - replaced:]):
+        app['id'] = app['id'] + '-new'
+    return apps
+
+
+def measure(fn):
+    """Run fn and return (result, wall seconds, cpu seconds)"""
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = fn()
+    return result, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def run_threaded_cycles(args, autoscalers, api_client, snapshots, agent_stats, prometheus, url, batcher=None):
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='autoscale-worker')
+
+    def cycle():
+        futures = [executor.submit(a.evaluate) for a in autoscalers]
+        errors = sum(1 for f in futures if f.exception() is not None)
+        # 批量扩缩请求在周期结束时下发，不等待linger
+        if batcher is not None:
+            batcher.flush()
+        return errors
+
+    cycles = []
+    for i in range(args.cycles):
+        if i and args.pause:
+            time.sleep(args.pause)
+        expire(api_client, snapshots, agent_stats, prometheus)
+        before = server_requests(url)
+        errors, wall, cpu = measure(cycle)
+        cycles.append(cycle_result(before, server_requests(url), errors, wall, cpu))
+    executor.shutdown()
+    return cycles
+
+
+def run_asyncio_cycles(args, engine, api_client, snapshots, agent_stats, prometheus, url):
+    import aiohttp
+
+    async def run():
+        cycles = []
+        async with aiohttp.ClientSession() as session:
+            for i in range(args.cycles):
+                if i and args.pause:
+                    await asyncio.sleep(args.pause)
+                expire(api_client, snapshots, agent_stats, prometheus)
+                before = server_requests(url)
+                wall, cpu = time.perf_counter(), time.process_time()
+                await engine.cycle(session)
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                cycles.append(cycle_result(before, server_requests(url), None, wall, cpu))
+        return cycles
+
+    return asyncio.run(run())
+
+
+def cycle_result(before, after, errors, wall, cpu):
+    return {
+        'seconds': wall,
+        'cpu_seconds': cpu,
+        'errors': errors,
+        'requests': {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)},
+    }
+
+
+def summarize(args, reconcile_results, cycles):
+    latencies = [c['seconds'] for c in cycles]
+    categories = sorted({k for c in cycles for k in c['requests']})
+    return {
+        'fleet': {'apps': args.apps, 'tasks': args.tasks, 'agents': args.agents, 'tenants': args.tenants,
+                  'mode': args.mode, 'engine': args.engine, 'workers': args.workers, 'latency': args.latency},
+        'reconcile': reconcile_results,
+        'cycle_seconds': {
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'max': max(latencies),
+        },
+        'cycle_cpu_seconds': sum(c['cpu_seconds'] for c in cycles) / len(cycles),
+        'requests_per_cycle': {k: sum(c['requests'].get(k, 0) for c in cycles) / len(cycles)
+                               for k in categories},
+        'first_cycle_requests': cycles[0]['requests'],
+        'errors_per_cycle': None if cycles[0]['errors'] is None
+        else sum(c['errors'] for c in cycles) / len(cycles),
+        # Linux上ru_maxrss单位为KB
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'tracemalloc_peak_mb': tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        if tracemalloc.is_tracing() else None,
+        'cycles': cycles,
+    }
+
+
+def print_report(result, baseline=None):
+    def line(name, value, key=None):
+        text = '%-28s %s' % (name, ('%.4f' % value) if isinstance(value, float) else value)
+        if baseline is not None and key is not None:
+            old = key(baseline)
+            if old:
+                text += '   (baseline %.4f, %+.1f%%)' % (old, (key(result) - old) * 100.0 / old)
+        print(text)
+
+    fleet = result['fleet']
+    print('fleet: %(apps)s apps x %(tasks)s tasks x %(agents)s agents, %(tenants)s tenants, '
+          'mode=%(mode)s engine=%(engine)s workers=%(workers)s latency=%(latency)ss' % fleet)
+    for phase, stats in result['reconcile'].items():
+        line('reconcile %s (s)' % phase, stats['seconds'], lambda r, p=phase: r['reconcile'][p]['seconds'])
+    for name in ('p50', 'p95', 'max'):
+        line('cycle %s (s)' % name, result['cycle_seconds'][name], lambda r, n=name: r['cycle_seconds'][n])
+    line('cpu per cycle (s)', result['cycle_cpu_seconds'], lambda r: r['cycle_cpu_seconds'])
+    for category, count in sorted(result['requests_per_cycle'].items()):
+        line('requests/cycle %s' % category, float(count),
+             lambda r, c=category: r['requests_per_cycle'].get(c, 0))
+    if result['errors_per_cycle'] is not None:
+        line('errors/cycle', float(result['errors_per_cycle']))
+    line('max rss (MB)', result['max_rss_mb'], lambda r: r['max_rss_mb'])
+    if result['tracemalloc_peak_mb'] is not None:
+        line('tracemalloc peak (MB)', result['tracemalloc_peak_mb'], lambda r: r['tracemalloc_peak_mb'])
+
+
+def run(args):
+    process, url = start_fake(args)
+    try:
+        # 本地伪造集群不需要认证，CA证书写入临时目录
+        for key in ('AS_USERID', 'AS_PASSWORD', 'AS_SECRET'):
+            os.environ.pop(key, None)
+        os.chdir(tempfile.mkdtemp(prefix='autoscale-bench-'))
+        if args.tracemalloc:
+            tracemalloc.start()
+        http_transport.configure(pool_maxsize=max(args.workers, 10), retries=0)
+
+        api_client = APIClient(url, cache=ResponseCache(default_ttl=MAX_AGE))
+        snapshots = AppsSnapshotService(api_client, max_age=MAX_AGE)
+        agent_stats = AgentStats(api_client, max_age=MAX_AGE, workers=args.agent_workers)
+        prometheus = PrometheusClient(url, max_age=MAX_AGE)
+        batcher = None if args.no_batch else ScaleBatcher(api_client)
+        if args.engine == 'asyncio':
+            from autoscaler.async_engine import AsyncEngine
+            scheduler = AsyncEngine(api_client, snapshots, agent_stats, prometheus, MAX_AGE,
+                                    workers=args.workers, per_host_limit=args.per_host_limit,
+                                    batcher=batcher)
+        else:
+            # 不启动调度线程，由基准测试逐周期驱动评估
+            scheduler = Scheduler(workers=args.workers, default_interval=MAX_AGE)
+
+        fleet = FakeFleet(args.apps, args.tasks, args.agents, args.tenants)
+        configs = fleet.configs(args.mode, mode_options=mode_options(args))
+        scale_down = ScaleDownGuard(window=args.scale_down_window, max_concurrent=args.scale_down_concurrency)
+        build = lambda app: marathon_autoscaler.build_autoscaler(
+            app, url, MAX_AGE, api_client, snapshots, agent_stats, prometheus, scale_down, batcher)
+
+        reconcile_results = {}
+        apps = configs['data']['marathon_apps']
+        hashes, wall, cpu = measure(lambda: marathon_autoscaler.reconcile(scheduler, {}, apps, MAX_AGE, build,
+                                                                          workers=args.workers))
+        reconcile_results['initial'] = {'seconds': wall, 'cpu_seconds': cpu, 'apps': len(apps)}
+        changed = churn(configs, args.churn)
+        churned, wall, cpu = measure(lambda: marathon_autoscaler.reconcile(scheduler, hashes, changed, MAX_AGE, build,
+                                                                           workers=args.workers))
+        reconcile_results['churn'] = {'seconds': wall, 'cpu_seconds': cpu, 'apps': len(changed)}
+        # 恢复为原始配置后再跑评估周期，使每次运行的负载一致
+        marathon_autoscaler.reconcile(scheduler, churned, apps, MAX_AGE, build)
+
+        if args.record:
+            recording.RECORDER.configure(args.record)
+        if args.engine == 'asyncio':
+            cycles = run_asyncio_cycles(args, scheduler, api_client, snapshots, agent_stats, prometheus, url)
+        else:
+            autoscalers = [scheduler.get(key) for key in scheduler.keys()]
+            cycles = run_threaded_cycles(args, autoscalers, api_client, snapshots, agent_stats, prometheus, url,
+                                         batcher)
+        recording.RECORDER.close()
+        return summarize(args, reconcile_results, cycles)
+    finally:
+        process.stdin.close()
+        process.wait()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='marathon-autoscale benchmark against a local fake cluster')
+    parser.add_argument('--apps', type=int, default=200)
+    parser.add_argument('--tasks', type=int, default=3, help='tasks per app')
+    parser.add_argument('--agents', type=int, default=20)
+    parser.add_argument('--tenants', type=int, default=1)
+    parser.add_argument('--mode', default='mem', choices=sorted(autoscaler.MODES))
+    parser.add_argument('--engine', default='threaded', choices=['threaded', 'asyncio'])
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--agent-workers', type=int, default=8)
+    parser.add_argument('--per-host-limit', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the fake server adds to every response')
+    parser.add_argument('--deployment-seconds', type=float, default=0.0,
+                        help='seconds a deployment of the fake Marathon stays in progress after a scale')
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds between cycles')
+    parser.add_argument('--churn', type=float, default=0.1, help='share of the apps changed in the churn reconcile')
+    parser.add_argument('--scale-down-window', type=float, default=0,
+                        help='stabilisation window of scale downs, 0 so that they happen within the run')
+    parser.add_argument('--scale-down-concurrency', type=int, default=5)
+    parser.add_argument('--no-batch', action='store_true', help='one PUT per scale instead of a PATCH per tenant')
+    parser.add_argument('--window', type=float, default=300, help='jvm_range window')
+    parser.add_argument('--step', type=float, default=15, help='jvm_range step')
+    parser.add_argument('--tracemalloc', action='store_true', help='also report the python heap peak (slower)')
+    parser.add_argument('--verbose', action='store_true', help='keep the autoscaler logs')
+    parser.add_argument('--record', help='record a trace of the cycles to this file, see autoscaler.backtest')
+    parser.add_argument('--json', help='write the result to this file')
+    parser.add_argument('--baseline', help='compare with the result of a previous run')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.verbose:
+        # 每个app每周期的日志会淹没结果
+        logging.disable(logging.WARNING)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if args.record:
+        args.record = os.path.abspath(args.record)
+    result = run(args)
+    print_report(result, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
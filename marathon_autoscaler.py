@@ -1,16 +1,33 @@
+import atexit
 import logging
 import json
+import hashlib
 import os
+import sys
 import time
 import urllib3
-import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 import socket
-from autoscaler.api_client import APIClient
+from autoscaler.api_client import APIClient, ResponseCache
+from autoscaler import http_transport
+from autoscaler.app import AppsSnapshotService
+from autoscaler.agent_stats import AgentStats
 from logging.handlers import RotatingFileHandler
 from autoscaler.autoscaler import Autoscaler
 from autoscaler import autoscaler
-from autoscaler.http_handler import MyHttpHandler, AlarmFilter
+from autoscaler.scheduler import Scheduler
+from autoscaler.async_engine import AsyncEngine
+from autoscaler.prometheus import PrometheusClient
+from autoscaler.alarm import AlarmDispatcher, AlarmSuppressor
+from autoscaler.scale_down import ScaleDownGuard
+from autoscaler.scale_batch import ScaleBatcher
+from autoscaler.cluster import ShardCoordinator, build_backend
+from autoscaler.checkpoint import CheckpointStore, Checkpointer, resume_delay
+from autoscaler import metrics
+from autoscaler import tracing
+from autoscaler import recording
+from autoscaler import sqs
 
 
 LOGGING_FORMAT = '%(asctime)s - %(threadName)s - %(thread)s - %(pathname)s:%(lineno)d - %(levelname)s - %(message)s'
@@ -22,6 +39,184 @@ JSON_CONFIG_URL = os.environ.get('JSON_CONFIG_URL')
 #判断是否支持mode
 supportMode = lambda app: False if autoscaler.MODES.get(app['trigger_mode'], None) is None else True
 
+
+def build_autoscaler(app, prometheus_host, interval, api_client, snapshots, agent_stats, prometheus, scale_down=None,
+                     batcher=None, checkpoint=None):
+    '''
+    根据扩缩策略接口返回的app配置创建autoscaler
+    '''
+    return Autoscaler(app['dcos_tenant'],
+                      prometheus_host,
+                      app['id'],
+                      app['trigger_mode'],
+                      app['autoscale_multiplier'],
+                      app['min_instances'],
+                      app['max_instances'],
+                      app['cool_down_factor'],
+                      app['scale_up_factor'],
+                      app['min_range'],
+                      app['max_range'],
+                      app.get('interval', interval),
+                      app['log_level'],
+                      api_client,
+                      app['alarm_key'],
+                      snapshots=snapshots,
+                      agent_stats=agent_stats,
+                      prometheus=prometheus,
+                      mode_options=app.get('mode_options'),
+                      scale_down=scale_down,
+                      batcher=batcher,
+                      checkpoint=checkpoint)
+
+
+def reconfigure_autoscaler(autoScaler, app, interval):
+    '''
+    将扩缩策略接口返回的新配置应用到运行中的autoscaler
+    '''
+    autoScaler.reconfigure(app['trigger_mode'],
+                           app['autoscale_multiplier'],
+                           app['min_instances'],
+                           app['max_instances'],
+                           app['cool_down_factor'],
+                           app['scale_up_factor'],
+                           app['min_range'],
+                           app['max_range'],
+                           app.get('interval', interval),
+                           app['log_level'],
+                           app['alarm_key'],
+                           mode_options=app.get('mode_options'))
+
+
+def register_runtime_metrics(scheduler, caches, alarm_dispatcher):
+    '''
+    注册在采集时读取的运行时指标：工作线程利用率、缓存命中率、告警发送统计
+    '''
+    def cache_requests():
+        result = []
+        for name, cache in caches.items():
+            info = cache.info()
+            result += [((name, 'hit'), info.hits), ((name, 'miss'), info.misses), ((name, 'shared'), info.shared)]
+        return result
+
+    def cache_hit_ratio():
+        result = []
+        for name, cache in caches.items():
+            info = cache.info()
+            total = info.hits + info.misses + info.shared
+            result.append(((name,), (info.hits + info.shared) / total if total else 0))
+        return result
+
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_workers', 'Size of the evaluation worker pool', [],
+        lambda: [((), scheduler.workers)]))
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_workers_busy', 'Workers currently evaluating an app', [],
+        lambda: [((), scheduler.busy)]))
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_apps', 'Apps being autoscaled', [],
+        lambda: [((), len(scheduler))]))
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_cache_requests', 'Cache lookups by result since start', ['cache', 'result'],
+        cache_requests))
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_cache_hit_ratio', 'Share of cache lookups served without a new request', ['cache'],
+        cache_hit_ratio))
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_alarms', 'Alarms by outcome since start', ['outcome'],
+        lambda: [((k,), v) for k, v in alarm_dispatcher.stats().items()]))
+
+
+def register_cluster_metrics(coordinator):
+    '''
+    注册多副本部署的指标：视图中的副本数、视图编号、是否为leader
+    '''
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_cluster_members', 'Replicas in the cluster view this replica shards by', [],
+        lambda: [((), len(coordinator.ring.members))]))
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_cluster_epoch', 'Epoch of the cluster view this replica shards by', [],
+        lambda: [((), coordinator.epoch or 0)]))
+    metrics.REGISTRY.register(metrics.GaugeCallback(
+        'autoscaler_cluster_leader', '1 if this replica is the leader', [],
+        lambda: [((), 1 if coordinator.leader else 0)]))
+
+
+def reconcile(scheduler, currentAppHashes, expectedApps, interval, build, delay=None, workers=16):
+    '''
+    将调度中的autoscaler与扩缩策略接口返回的app对齐：新增的app创建autoscaler加入调度，
+    移除的app退出调度，配置有变化的app热更新
+    :param currentAppHashes: 调度中app的配置摘要，key为app['dcos_tenant'] + app['id']
+    :param expectedApps: 扩缩策略接口返回的app配置
+    :param build: 根据app配置创建autoscaler的函数
+    :param delay: delay(key, interval)返回新增app首次评估的延迟，为None时在interval内随机
+    :param workers: 并发创建autoscaler的线程数
+    :return: 对齐后app的配置摘要
+    '''
+    log = logging.getLogger('autoscale')
+    #当前app key set
+    currentAppKeySet = set(currentAppHashes.keys())
+    #接口返回app信息
+    expectedAppsMap = {app['dcos_tenant'] + app['id']:app for app in expectedApps}
+    expectedAppHashes = {key: config_hash(app) for key, app in expectedAppsMap.items()}
+    #接口返回的app key set
+    expectedAppKeySet = set(expectedAppsMap.keys())
+    #新增key
+    newAppKeySet = expectedAppKeySet - currentAppKeySet
+    log.info('new app:' + str(newAppKeySet))
+    #移除的key
+    removedKeySet = currentAppKeySet - expectedAppKeySet
+    log.info('removed app:' + str(removedKeySet))
+    #保留的key
+    reservedAppKeySet = expectedAppKeySet & currentAppKeySet
+    #保留key中，配置摘要有变化的key
+    modifiedKeySet = set()
+    for key in reservedAppKeySet:
+        if currentAppHashes.get(key) != expectedAppHashes.get(key):
+            modifiedKeySet.add(key)
+            log.info('app:{} modified to:\n{}'.format(key, str(expectedAppsMap.get(key))))
+    log.info('modified app:' + str(modifiedKeySet))
+
+    #新增app，根据参数并发创建新的autoscaler，创建完成即加入调度
+    if newAppKeySet:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(newAppKeySet))),
+                                thread_name_prefix='autoscale-build') as executor:
+            futures = {executor.submit(build, expectedAppsMap.get(key)): key for key in newAppKeySet}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    autoScaler = future.result()
+                except Exception as e:
+                    #创建失败的app不计入摘要，配置下次变化时重试
+                    log.error('failed to create autoscaler for app %s: %s', key, e)
+                    del expectedAppHashes[key]
+                    continue
+                scheduler.add(key, autoScaler, autoScaler.interval,
+                              delay(key, autoScaler.interval) if delay is not None else None)
+    #移除app，从调度器中移除并调用autoscaler的terminal方法
+    for key in removedKeySet:
+        scheduler.remove(key)
+        metrics.forget_app(key)
+    #修改app,在运行中的autoscaler上热更新配置，保留其计数与缓存
+    for key in modifiedKeySet:
+        app = expectedAppsMap.get(key)
+        autoScaler = scheduler.get(key)
+        try:
+            reconfigure_autoscaler(autoScaler, app, interval)
+        except Exception as e:
+            #更新失败的app保留原摘要，继续使用原配置，下次对齐时重试
+            log.error('failed to reconfigure autoscaler for app %s: %s', key, e)
+            expectedAppHashes[key] = currentAppHashes[key]
+            continue
+        scheduler.set_interval(key, autoScaler.interval)
+    return expectedAppHashes
+
+
+def config_hash(value):
+    '''
+    配置的摘要，用于判断配置是否变化
+    '''
+    return hashlib.sha1(json.dumps(value, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
 if __name__ == "__main__":
     #从配置中心加载配置
     #配置格式
@@ -29,10 +224,68 @@ if __name__ == "__main__":
     dcos_master: http://leader.mesos
     prometheus_host: http://1.1.1.1:8888
     internal: 20
+    engine: threaded
+    workers: 16
+    jitter: 0.1
+    async:
+      per_host_limit: 16
+      timeout: 10
+    cache:
+      max_entries: 10000
+      max_bytes: 67108864
+      ttl_rules:
+        '/monitor/statistics$': 5
+    http:
+      pool_maxsize: 32
+      host_pool_sizes:
+        'http://leader.mesos': 64
+      connect_timeout: 3.05
+      read_timeout: 10
+      retries: 2
+      backoff_factor: 0.3
+    agent_stats:
+      workers: 8
+    metrics:
+      port: 9102
+    tracing:
+      enabled: false
+      sample_size: 1024
+      profile_dir: /tmp
+    scale_down:
+      enabled: true
+      window: 300
+      max_step: 1
+      max_concurrent: 5
+      deployment_timeout: 600
+    scale_batch:
+      enabled: true
+      linger: 1
+      max_batch: 100
+      force: true
+    cluster:
+      backend: sqlite
+      options:
+        path: /data/autoscale-cluster.db
+      member_id: autoscale-1
+      ttl: 60
+      vnodes: 64
+    checkpoint:
+      path: /data/autoscale-state.db
+      interval: 60
+      max_age: 600
+      retention: 86400
+    trace:
+      path: /data/autoscale-trace.gz
+      flush_interval: 10
     log_level: INFO
     alarm_api:
       host: marathon-lb-skyark.sae-skyark.dcos.2i.unicom.local
       url: /mser/business/monitor/alarm
+      queue_size: 1000
+      batch_size: 50
+      retries: 3
+      suppress_window: 600
+      suppress_max_keys: 10000
       params:
         globalKey: 'starship'
         alarmLevel: 'P0'
@@ -51,6 +304,17 @@ if __name__ == "__main__":
     dcos_master = config['dcos_master']
     prometheus_host = config['prometheus_host']
     interval = config['internal']
+    #评估线程池大小及调度抖动比例
+    workers = config.get('workers', 16)
+    jitter = config.get('jitter', 0.0)
+    #采集引擎：threaded(默认，按app调度) 或 asyncio(每周期并发采集所有数据后统一评估)
+    engine = config.get('engine', 'threaded')
+    #GET响应缓存，默认过期时间为一个interval
+    cache_config = config.get('cache', {})
+    #共享连接池，默认每个host的连接数不小于工作线程数
+    http_config = dict(config.get('http', {}))
+    http_config.setdefault('pool_maxsize', workers)
+    http_transport.configure(**http_config)
     #log_level = config['log_level']
     alarm_host = config['alarm_api']['host']
     alarm_url = config['alarm_api']['url']
@@ -82,138 +346,158 @@ if __name__ == "__main__":
     rhe.setLevel(level=logging.WARN)
     rhe.setFormatter(logging.Formatter(LOGGING_FORMAT))
     rootlog.addHandler(rhe)
-    #告警类日志还需要调用alarm接口
-    httpHandler = MyHttpHandler(alarm_host, alarm_url, method="POST")
-    httpHandler.addFilter(AlarmFilter())
-    httpHandler.setLevel(level=logging.WARN)
-    rootlog.addHandler(httpHandler)
+    #告警通过后台线程异步批量发送，不阻塞扩缩线程
+    alarm_dispatcher = AlarmDispatcher(alarm_host, alarm_url, method="POST",
+                                       queue_size=config['alarm_api'].get('queue_size', 1000),
+                                       batch_size=config['alarm_api'].get('batch_size', 50),
+                                       retries=config['alarm_api'].get('retries', 3),
+                                       suppressor=AlarmSuppressor(
+                                           window=config['alarm_api'].get('suppress_window', 600),
+                                           max_keys=config['alarm_api'].get('suppress_max_keys', 10000)))
+    alarm_dispatcher.start()
+    autoscaler.ALARM_DISPATCHER = alarm_dispatcher
 
     log = logging.getLogger('autoscale')
 
     #访问扩缩策略接口
     argsJson = ''
-    response = requests.get(scale_api_url)
+    response = http_transport.get_transport().get(scale_api_url)
     if response.status_code != 200:
         raise SystemError(scale_api_url + ' is not available\n' + response.content)
     jsonArgs = response.json()
-    #每个app对应一个autoscaler,并运行在单独的线程中
-    api_client = APIClient(dcos_master)
+    #所有app的autoscaler由统一的调度器按各自的interval调度到有界的线程池中执行
+    api_client = APIClient(dcos_master, cache=ResponseCache(
+        default_ttl=cache_config.get('ttl', interval),
+        ttl_rules=cache_config.get('ttl_rules'),
+        max_entries=cache_config.get('max_entries', 10000),
+        max_bytes=cache_config.get('max_bytes', 64 * 1024 * 1024)))
+    #每个租户每个周期只全量查询一次marathon app列表
+    snapshots = AppsSnapshotService(api_client, max_age=interval)
+    #所有app共享agent统计信息，每个agent每个周期只查询一次
+    agent_stats = AgentStats(api_client, max_age=interval,
+                             workers=config.get('agent_stats', {}).get('workers', 8))
+    #所有app共享prometheus查询结果
+    prometheus = PrometheusClient(prometheus_host, max_age=interval)
+    #缩容保护：稳定窗口、单次最大步长、全局并发缩容数、进行中部署检查
+    scale_down_config = config.get('scale_down', {})
+    scale_down = ScaleDownGuard(enabled=scale_down_config.get('enabled', True),
+                                window=scale_down_config.get('window', 300),
+                                max_step=scale_down_config.get('max_step', 1),
+                                max_concurrent=scale_down_config.get('max_concurrent', 5),
+                                deployment_timeout=scale_down_config.get('deployment_timeout', 600))
+    #扩缩请求按租户合并为PATCH /v2/apps批量下发
+    scale_batch_config = config.get('scale_batch', {})
+    batcher = None
+    if scale_batch_config.get('enabled', True):
+        batcher = ScaleBatcher(api_client,
+                               linger=scale_batch_config.get('linger', 1),
+                               max_batch=scale_batch_config.get('max_batch', 100),
+                               force=scale_batch_config.get('force', True))
+        batcher.start()
+    if engine == 'asyncio':
+        async_config = config.get('async', {})
+        scheduler = AsyncEngine(api_client, snapshots, agent_stats, prometheus, interval,
+                                workers=workers,
+                                per_host_limit=async_config.get('per_host_limit', 16),
+                                timeout=async_config.get('timeout', 10),
+                                batcher=batcher)
+    else:
+        scheduler = Scheduler(workers=workers, jitter=jitter, default_interval=interval)
+    #注册通过entry point安装的第三方扩缩模式
+    autoscaler.MODES.discover()
+    #sqs模式的队列长度每周期每个队列只查询一次
+    sqs.SQS.configure(max_age=interval)
     current_marathon_apps = list(filter(supportMode, jsonArgs['data']['marathon_apps']))
-    #map的key为app['dcos_tenant'] + app['id']
-    #threadsMap = {}
-    autoScalerMap = {}
-    for app in current_marathon_apps:
-        autoScaler = Autoscaler(app['dcos_tenant'],
-                                prometheus_host,
-                                app['id'],
-                                app['trigger_mode'],
-                                app['autoscale_multiplier'],
-                                app['min_instances'],
-                                app['max_instances'],
-                                app['cool_down_factor'],
-                                app['scale_up_factor'],
-                                app['min_range'],
-                                app['max_range'],
-                                interval,
-                                app['log_level'],
-                                api_client,
-                                app['alarm_key'])
-        t = threading.Thread(target=autoScaler.run,name=app['dcos_tenant'] + app['id'])
-        t.start()
-        #threadsMap[t.getName()] = t
-        autoScalerMap[t.getName()] = autoScaler
-    #定时任务：1.清空api_client.dcos_rest_get()缓存；2.动态更新扩缩策略
+    #多副本部署：app按 dcos_tenant + id 一致性哈希分配到各副本，每个副本只调度自己的app
+    cluster_config = config.get('cluster')
+    coordinator = None
+    if cluster_config:
+        coordinator = ShardCoordinator(build_backend(cluster_config.get('backend', 'sqlite'),
+                                                     **cluster_config.get('options', {})),
+                                       member_id=cluster_config.get('member_id'),
+                                       ttl=cluster_config.get('ttl', 3 * interval),
+                                       vnodes=cluster_config.get('vnodes', 64))
+        coordinator.tick()
+        #并发缩容预算是全局的，按视图在副本间分配
+        scale_down.share(*coordinator.rank())
+        atexit.register(coordinator.leave)
+        register_cluster_metrics(coordinator)
+        current_marathon_apps = coordinator.owned(current_marathon_apps)
+    view_changed = False
+    #扩缩策略接口响应的摘要，未变化时跳过对比
+    current_payload_hash = hashlib.sha1(response.content).hexdigest()
+    #检查点：app的周期计数与扩缩指标历史定期写入本地SQLite，重启后在首次评估时恢复
+    checkpoint_config = config.get('checkpoint', {})
+    checkpoint = None
+    delay = None
+    if checkpoint_config.get('path'):
+        checkpoint = CheckpointStore(checkpoint_config['path'],
+                                     max_age=checkpoint_config.get('max_age', 600),
+                                     retention=checkpoint_config.get('retention', 86400))
+        #重启后各app沿用之前的评估相位，避免所有app同时发起首次请求
+        evaluated = checkpoint.evaluated()
+        delay = lambda key, app_interval: resume_delay(evaluated.get(key), app_interval)
+    build = lambda app: build_autoscaler(app, prometheus_host, interval, api_client, snapshots, agent_stats, prometheus,
+                                         scale_down, batcher, checkpoint)
+    #按app调度时先启动调度器，app创建完成即按各自的首次延迟开始评估；
+    #asyncio引擎每周期评估全部app，在创建完成后启动
+    if engine != 'asyncio':
+        scheduler.start()
+    #key为app['dcos_tenant'] + app['id'],value为app配置的摘要
+    currentAppHashes = reconcile(scheduler, {}, current_marathon_apps, interval, build, delay, workers)
+    if engine == 'asyncio':
+        scheduler.start()
+    if checkpoint is not None:
+        checkpointer = Checkpointer(checkpoint, scheduler, interval=checkpoint_config.get('interval', 60))
+        checkpointer.start()
+        atexit.register(checkpointer.stop)
+    #暴露/metrics接口
+    register_runtime_metrics(scheduler, {'dcos': api_client.cache, 'prometheus': prometheus.cache},
+                             alarm_dispatcher)
+    #分阶段耗时统计与按需profile：SIGUSR1输出各阶段耗时分位数，SIGUSR2对最慢的app做一次profile
+    tracing_config = config.get('tracing', {})
+    if tracing_config.get('enabled'):
+        tracing.TRACER.configure(sample_size=tracing_config.get('sample_size', 1024),
+                                 profile_dir=tracing_config.get('profile_dir', '.'))
+        tracing.TRACER.install_signal_handlers()
+    #记录每次评估的扩缩指标与实例数，用于离线回放调参(python -m autoscaler.backtest)
+    trace_config = config.get('trace', {})
+    if trace_config.get('path'):
+        recording.RECORDER.configure(trace_config['path'], flush_interval=trace_config.get('flush_interval', 10))
+    if config.get('metrics', {}).get('port'):
+        metrics.start_server(config['metrics']['port'], routes=tracing.TRACER.http_routes())
+    #定时任务：1.输出缓存统计；2.动态更新扩缩策略
     while True:
         try:
 
-            time.sleep(interval)
-            #清空api_client.dcos_rest_get()的缓存
-            log.info(' '.join(['current cache_info:', str(api_client.dcos_rest_get.cache_info()), '\n cache cleared']))
-            api_client.dcos_rest_get.cache_clear()
+            #凭据被DC/OS拒绝时退出，由进程守护重启或告警
+            if api_client.fatal.wait(interval):
+                log.error('authentication to DC/OS failed, exiting: %s', api_client.auth_error)
+                sys.exit(1)
+            #心跳；集群视图变化(副本加入或退出)时，即使配置未变也需要重新分配app
+            if coordinator is not None and coordinator.tick():
+                view_changed = True
+                scale_down.share(*coordinator.rank())
+            #缓存条目按ttl过期，超出容量时按LRU淘汰，不再整体清空
+            log.info('current cache_info: ' + str(api_client.cache.info()))
+            log.info('alarm stats: ' + str(alarm_dispatcher.stats()))
             #访问服务扩缩信息全量查询接口，更新autoscale
-            log.info('Polling Update Autoscaler Threads Begin')
-            response = requests.get(scale_api_url)
+            log.info('Polling Update Autoscaler Begin')
+            response = http_transport.get_transport().get(scale_api_url)
             if response.status_code != 200:
                 log.error("request for autoscale api error:" + response.content)
                 continue
+            payload_hash = hashlib.sha1(response.content).hexdigest()
+            if payload_hash == current_payload_hash and not view_changed:
+                log.info('autoscale configs not changed')
             else:
-                #当前app key set
-                currentAppsMap = {app['dcos_tenant'] + app['id']:app for app in current_marathon_apps}
-                currentAppKeySet = set(currentAppsMap.keys())
-                #接口返回app信息
                 expectedApps = list(filter(supportMode, response.json()['data']['marathon_apps']))
-                expectedAppsMap = {app['dcos_tenant'] + app['id']:app for app in expectedApps}
-                #接口返回的app key set
-                expectedAppKeySet = set(expectedAppsMap.keys())
-                #新增key
-                newAppKeySet = expectedAppKeySet - currentAppKeySet
-                log.info('new app:' + str(newAppKeySet))
-                #移除的key
-                removedKeySet = currentAppKeySet - expectedAppKeySet
-                log.info('removed app:' + str(removedKeySet))
-                #保留的key
-                reservedAppKeySet = expectedAppKeySet & currentAppKeySet
-                #保留key中，value有更新的key
-                modifiedKeySet = set()
-                for key in reservedAppKeySet:
-                    if currentAppsMap.get(key) != expectedAppsMap.get(key):
-                        modifiedKeySet.add(key)
-                        log.info('app:{} modified from: \n{}\nto:\n{}'.format(key, str(currentAppsMap.get(key)), str(expectedAppsMap.get(key))))
-                log.info('modified app:' + str(modifiedKeySet))
-
-                #新增app，根据参数创建新的autoscaler线程
-                for key in newAppKeySet:
-                    app = expectedAppsMap.get(key)
-                    autoScaler = Autoscaler(app['dcos_tenant'],
-                                            prometheus_host,
-                                            app['id'],
-                                            app['trigger_mode'],
-                                            app['autoscale_multiplier'],
-                                            app['min_instances'],
-                                            app['max_instances'],
-                                            app['cool_down_factor'],
-                                            app['scale_up_factor'],
-                                            app['min_range'],
-                                            app['max_range'],
-                                            interval,
-                                            app['log_level'],
-                                            api_client,
-                                            app['alarm_key'])
-                    t = threading.Thread(target=autoScaler.run, name=app['dcos_tenant'] + app['id'])
-                    t.start()
-                    autoScalerMap[t.getName()] = autoScaler
-                    #threadsMap[t.getName()] = t
-                #移除app，调用autoscaler的ternimal方法，让线程终止
-                for key in removedKeySet:
-                    autoScalerMap.get(key).terminal()
-                    autoScalerMap.pop(key)
-                    #threadsMap.pop(key)
-                #修改app,先移除app,再根据新参数创建autoscaler线程
-                for key in modifiedKeySet:
-                    autoScalerMap.get(key).terminal()
-                    autoScalerMap.pop(key)
-                    #threadsMap.pop(key)
-                    app = expectedAppsMap.get(key)
-                    autoScaler = Autoscaler(app['dcos_tenant'],
-                                            prometheus_host,
-                                            app['id'],
-                                            app['trigger_mode'],
-                                            app['autoscale_multiplier'],
-                                            app['min_instances'],
-                                            app['max_instances'],
-                                            app['cool_down_factor'],
-                                            app['scale_up_factor'],
-                                            app['min_range'],
-                                            app['max_range'],
-                                            interval,
-                                            app['log_level'],
-                                            api_client,
-                                            app['alarm_key'])
-                    t = threading.Thread(target=autoScaler.run, name=app['dcos_tenant'] + app['id'])
-                    t.start()
-                    #threadsMap[t.getName()] = t
-                    autoScalerMap[t.getName()] = autoScaler
-                current_marathon_apps = expectedApps
-                log.info('Polling Update Autoscaler Threads End')
+                if coordinator is not None:
+                    expectedApps = coordinator.owned(expectedApps)
+                currentAppHashes = reconcile(scheduler, currentAppHashes, expectedApps, interval, build,
+                                             workers=workers)
+                current_payload_hash = payload_hash
+                view_changed = False
+                log.info('Polling Update Autoscaler End')
         except Exception as e:
             log.exception(e)